@@ -0,0 +1,172 @@
+"""
+Micro-benchmark for code-fence parsing in EventHandler.on_text_delta.
+
+Feeds delta streams through the original regex-over-buffer state machine and
+through CodeFenceScanner, checks that both produce the same code chunks and
+reports the time spent per stream.
+
+    python backend/benchmarks/bench_fence_scanner.py
+    python backend/benchmarks/bench_fence_scanner.py --streams recorded.json
+
+A streams file is a JSON list of delta lists (one list of strings per run).
+Without it a deterministic synthetic builder response is used.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'functions'))
+
+from fence_scanner import CodeFenceScanner  # noqa: E402
+
+
+class LegacyFenceParser:
+    """
+    The state machine EventHandler used before CodeFenceScanner, kept verbatim
+    apart from collecting chunks instead of triggering Pusher events.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.full_response = ""
+        self.state = 'normal'
+
+    def feed(self, value):
+        chunks = []
+        self.full_response += value
+        self.buffer += value
+
+        while True:
+            if self.state == 'normal':
+                start_match = re.search(r'```', self.buffer)
+                if start_match:
+                    self.state = 'awaiting_language'
+                    self.buffer = self.buffer[start_match.end():]
+                else:
+                    break
+
+            elif self.state == 'awaiting_language':
+                newline_index = self.buffer.find('\n')
+                if newline_index != -1:
+                    self.buffer = self.buffer[newline_index+1:]
+                    self.state = 'in_code_block'
+                else:
+                    break
+
+            elif self.state == 'in_code_block':
+                end_match = re.search(r'```', self.buffer)
+                if end_match:
+                    code_content = self.buffer[:end_match.start()]
+                    if code_content:
+                        chunks.append(code_content)
+                    self.buffer = self.buffer[end_match.end():]
+                    self.state = 'normal'
+                elif self.buffer.endswith('```'):
+                    code_content = self.buffer[:-3]
+                    if code_content:
+                        chunks.append(code_content)
+                    self.buffer = ''
+                    self.state = 'normal'
+                else:
+                    if self.buffer:
+                        partial_delimiter_match = re.search(r'`+$', self.buffer)
+                        if partial_delimiter_match:
+                            code_content = self.buffer[:partial_delimiter_match.start()]
+                            self.buffer = self.buffer[partial_delimiter_match.start():]
+                        else:
+                            code_content = self.buffer
+                            self.buffer = ''
+
+                        if code_content:
+                            chunks.append(code_content)
+                    break
+        return chunks
+
+
+class ScannerParser:
+    """
+    The current EventHandler path: list-accumulated response plus CodeFenceScanner.
+    """
+
+    def __init__(self):
+        self.parts = []
+        self.scanner = CodeFenceScanner()
+
+    def feed(self, value):
+        self.parts.append(value)
+        return self.scanner.feed(value)
+
+    @property
+    def full_response(self):
+        return "".join(self.parts)
+
+
+def synthetic_stream(lines, seed):
+    rng = random.Random(seed)
+    body = []
+    for i in range(lines):
+        body.append(rng.choice([
+            f"    pub fn get_{i}(env: Env, user: Address) -> i128 {{",
+            f"        let balance = read_balance(&env, &user); // `balance` #{i}",
+            "        env.storage().instance().extend_ttl(100, 100);",
+            "    }",
+            f"    /// Returns the ``value`` stored under key {i}",
+        ]))
+    text = (
+        "Here is the implementation of `src/lib.rs`:\n\n"
+        "```rust\n" + "\n".join(body) + "\n```\n\n"
+        "It exposes the public interface described in the design.\n"
+    )
+    deltas = []
+    pos = 0
+    while pos < len(text):
+        size = rng.randint(1, 8)
+        deltas.append(text[pos:pos + size])
+        pos += size
+    return deltas
+
+
+def run(parser_cls, deltas):
+    parser = parser_cls()
+    chunks = []
+    started = time.perf_counter()
+    for value in deltas:
+        chunks.extend(parser.feed(value))
+    response = parser.full_response
+    return time.perf_counter() - started, chunks, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', help="JSON file with a list of recorded delta lists")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.streams:
+        with open(args.streams) as f:
+            streams = {f"recorded[{i}]": deltas for i, deltas in enumerate(json.load(f))}
+    else:
+        streams = {f"synthetic_{n}_lines": synthetic_stream(n, seed=n) for n in (200, 1000, 4000)}
+
+    print(f"{'stream':<22}{'deltas':>8}{'legacy ms':>12}{'scanner ms':>12}{'speedup':>10}")
+    for name, deltas in streams.items():
+        legacy_best = scanner_best = float('inf')
+        for _ in range(args.repeat):
+            legacy_time, legacy_chunks, legacy_response = run(LegacyFenceParser, deltas)
+            scanner_time, scanner_chunks, scanner_response = run(ScannerParser, deltas)
+            if legacy_chunks != scanner_chunks:
+                sys.exit(f"{name}: scanner output differs from the legacy parser")
+            if legacy_response != scanner_response:
+                sys.exit(f"{name}: accumulated response differs from the legacy parser")
+            legacy_best = min(legacy_best, legacy_time)
+            scanner_best = min(scanner_best, scanner_time)
+        print(f"{name:<22}{len(deltas):>8}{legacy_best * 1000:>12.2f}{scanner_best * 1000:>12.2f}"
+              f"{legacy_best / scanner_best:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
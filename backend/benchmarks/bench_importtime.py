@@ -0,0 +1,91 @@
+"""
+Cold-start benchmark: import-time profile of backend/functions/main.py.
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter (a few times,
+keeping the fastest run), prints the slowest modules and checks that none of the
+heavy client packages are imported at module level.
+
+    python backend/benchmarks/bench_importtime.py
+    python backend/benchmarks/bench_importtime.py --compare importtime_baseline.json
+    python backend/benchmarks/bench_importtime.py --write importtime_baseline.json
+
+--compare exits non-zero when the total import time regressed by more than
+--tolerance percent against the checked-in baseline.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+
+# Packages that must only be imported when a client is first used
+LAZY_MODULES = ('openai', 'pusher', 'google.cloud.firestore', 'firebase_admin.firestore', 'event_handler', 'transport')
+
+
+def profile_import():
+    env = dict(os.environ, FIRESTORE_BACKEND='memory')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=FUNCTIONS_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        sys.exit(f"import main failed:\n{result.stderr}")
+
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = {'self_us': int(self_us), 'cumulative_us': int(cumulative_us)}
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--compare', help="baseline JSON to compare the total against")
+    parser.add_argument('--tolerance', type=float, default=50.0, help="allowed regression in percent")
+    parser.add_argument('--write', help="write the report as a new baseline")
+    args = parser.parse_args()
+
+    best = min((profile_import() for _ in range(args.runs)), key=lambda m: m['main']['cumulative_us'])
+    total_ms = best['main']['cumulative_us'] / 1000
+
+    print(f"import main: {total_ms:.1f} ms (best of {args.runs})\n")
+    print(f"{'module':<50}{'cumulative ms':>15}{'self ms':>10}")
+    slowest = sorted(best.items(), key=lambda item: item[1]['cumulative_us'], reverse=True)[:args.top]
+    for name, timing in slowest:
+        print(f"{name:<50}{timing['cumulative_us'] / 1000:>15.1f}{timing['self_us'] / 1000:>10.1f}")
+
+    eager = [name for name in LAZY_MODULES if name in best]
+    report = {
+        'total_ms': round(total_ms, 1),
+        'slowest': {name: round(timing['cumulative_us'] / 1000, 1) for name, timing in slowest},
+        'eager_client_modules': eager,
+    }
+
+    if args.write:
+        with open(args.write, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+    failed = False
+    if eager:
+        print(f"\nClient modules imported at module level: {', '.join(eager)}")
+        failed = True
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        change = (total_ms - baseline['total_ms']) / baseline['total_ms'] * 100
+        print(f"\nBaseline {baseline['total_ms']:.1f} ms, now {total_ms:.1f} ms ({change:+.1f}%)")
+        if change > args.tolerance:
+            print(f"Import time regressed by more than {args.tolerance:.0f}%")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
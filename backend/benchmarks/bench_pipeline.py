@@ -0,0 +1,138 @@
+"""
+End-to-end benchmark of chat_handler and generate_contract, run offline against
+the fakes in fakes.py.
+
+Runs are replayed from a directory of recordings (STREAM_RECORD_DIR) or from
+synthetic ones. --speed 1 replays at the recorded pace, 10 ten times faster and
+0 (the default) without any delay, which measures our own overhead.
+
+    python backend/benchmarks/bench_pipeline.py
+    python backend/benchmarks/bench_pipeline.py --recordings /tmp/recordings --speed 1
+    python backend/benchmarks/bench_pipeline.py --token-interval 0.01 --json results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import time
+
+# Keep every backend in process before main reads its configuration
+os.environ.setdefault('FIRESTORE_BACKEND', 'memory')
+os.environ.setdefault('JOB_STORE', 'memory')
+os.environ['GENERATION_CACHE_BACKEND'] = 'none'
+
+import fakes  # noqa: E402  (puts backend/functions on sys.path)
+import main  # noqa: E402
+import tracing  # noqa: E402
+
+
+def summary(samples):
+    ordered = sorted(samples)
+    return {
+        'runs': len(ordered),
+        'mean': statistics.mean(ordered),
+        'p50': tracing.percentile(ordered, 50),
+        'p95': tracing.percentile(ordered, 95),
+        'max': ordered[-1],
+    }
+
+
+def first_event_latency(pusher, channel, event_name, started):
+    events = pusher.events_for(channel, event_name)
+    return events[0][0] - started if events else None
+
+
+def bench_chat_handler(pusher, run):
+    from flask import Flask, request
+
+    channel = f"bench-chat-{run}"
+    app = Flask(__name__)
+    started = time.perf_counter()
+    with app.test_request_context(method='POST', json={'input': 'I want a token vault', 'channel_id': channel}):
+        response = main.chat_handler(request)
+    elapsed = time.perf_counter() - started
+    status = response[1] if isinstance(response, tuple) else response.status_code
+    if status >= 400:
+        raise RuntimeError(f"chat_handler answered {status}")
+    return elapsed, first_event_latency(pusher, channel, 'chat-response', started), len(pusher.events_for(channel))
+
+
+def bench_generate_contract(client, pusher, run):
+    channel = f"bench-generate-{run}"
+    thread_id = main.run_async(client.beta.threads.create()).id
+    started = time.perf_counter()
+    contract_id = main.generate_contract(thread_id, channel, 'I want a token vault')
+    elapsed = time.perf_counter() - started
+    if not contract_id:
+        errors = pusher.events_for(channel, 'error')
+        raise RuntimeError(f"generate_contract failed: {errors[-1][3] if errors else 'no contract'}")
+    return elapsed, first_event_latency(pusher, channel, 'code-chunk', started), len(pusher.events_for(channel))
+
+
+def run_benchmarks():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recordings', help="directory of recorded runs (default: synthetic runs)")
+    parser.add_argument('--speed', type=float, default=0.0, help="replay speed, 0 for no delays")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--token-interval', type=float, default=0.0, help="seconds between synthetic deltas")
+    parser.add_argument('--file-size', type=int, default=2000, help="characters per synthetic file")
+    parser.add_argument('--pusher-latency', type=float, default=0.0, help="seconds per Pusher call")
+    parser.add_argument('--json', help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.recordings:
+        recordings = args.recordings
+        speed = args.speed
+    else:
+        recordings = fakes.default_recordings(token_interval=args.token_interval, file_size=args.file_size)
+        speed = args.speed or (1.0 if args.token_interval else 0.0)
+
+    spans = []
+    tracing.add_sink(spans.append)
+
+    results = {}
+    for name in ('chat_handler', 'generate_contract'):
+        durations, first_events, event_counts = [], [], []
+        # The first run pays for imports and client setup, leave it out
+        for run in range(-1, args.runs):
+            client = fakes.FakeOpenAI(recordings, speed=speed)
+            pusher = fakes.FakePusher(latency=args.pusher_latency)
+            fakes.install(main, client, pusher)
+            with contextlib.redirect_stdout(io.StringIO()):
+                if name == 'chat_handler':
+                    elapsed, first_event, events = bench_chat_handler(pusher, run)
+                else:
+                    elapsed, first_event, events = bench_generate_contract(client, pusher, run)
+            if run < 0:
+                continue
+            durations.append(elapsed)
+            if first_event is not None:
+                first_events.append(first_event)
+            event_counts.append(events)
+        results[name] = {
+            'duration': summary(durations),
+            'first_event': summary(first_events) if first_events else None,
+            'pusher_events': statistics.mean(event_counts),
+            'openai_calls': dict(client.calls),
+        }
+
+    tracing.remove_sink(spans.append)
+    results['stages'] = tracing.summarize(spans)
+
+    for name in ('chat_handler', 'generate_contract'):
+        result = results[name]
+        line = f"{name:<20} p50 {result['duration']['p50'] * 1000:8.1f} ms  p95 {result['duration']['p95'] * 1000:8.1f} ms"
+        if result['first_event']:
+            line += f"  first event p50 {result['first_event']['p50'] * 1000:7.1f} ms"
+        print(f"{line}  {result['pusher_events']:.0f} Pusher events  OpenAI calls {result['openai_calls']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+
+
+if __name__ == '__main__':
+    run_benchmarks()
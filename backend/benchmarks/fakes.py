@@ -0,0 +1,407 @@
+"""
+Local stand-ins for OpenAI, Pusher and Firestore, for benchmarks and offline runs.
+
+FakeOpenAI replays assistant runs, either recorded with STREAM_RECORD_DIR (see
+functions/stream_recorder.py) or built with synthetic_run(), through the real
+openai async stream manager so AsyncEventHandler sees the same callbacks as in
+production.
+FakePusher keeps every triggered event with the time it was sent, and
+MemoryFirestore comes from the functions package.
+
+    import main, fakes
+    fakes.install(main, fakes.FakeOpenAI(fakes.default_recordings()), fakes.FakePusher())
+"""
+import asyncio
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+FUNCTIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'functions')
+if FUNCTIONS_DIR not in sys.path:
+    sys.path.insert(0, FUNCTIONS_DIR)
+
+import tracing  # noqa: E402
+from memory_firestore import MemoryFirestore  # noqa: E402
+from stream_recorder import load_recordings  # noqa: E402
+
+_ids = itertools.count(1)
+
+
+def _new_id(prefix):
+    return f"{prefix}_{next(_ids):06d}"
+
+
+def _delay(latency):
+    seconds = latency() if callable(latency) else latency
+    return seconds if seconds and seconds > 0 else 0.0
+
+
+def _sleep(latency):
+    seconds = _delay(latency)
+    if seconds:
+        time.sleep(seconds)
+
+
+async def _async_sleep(latency):
+    seconds = _delay(latency)
+    if seconds:
+        await asyncio.sleep(seconds)
+
+
+def synthetic_run(stage, text, file_path=None, chunk_size=16, token_interval=0.0, tool_call=None, tool_arguments=None):
+    """
+    Builds a recording of a run streaming `text` in chunks of chunk_size characters,
+    token_interval seconds apart. With tool_call set to a function name the run
+    calls it after the text, with tool_arguments, and stops at requires_action,
+    like the questioner.
+    """
+    run_id, message_id, thread_id = _new_id('run'), _new_id('msg'), 'thread_recorded'
+    run = {
+        'id': run_id, 'object': 'thread.run', 'created_at': 0, 'thread_id': thread_id,
+        'assistant_id': 'asst_recorded', 'status': 'queued', 'instructions': '', 'model': 'gpt-4o',
+        'tools': [], 'parallel_tool_calls': True, 'metadata': {}, 'usage': None,
+    }
+    message = {
+        'id': message_id, 'object': 'thread.message', 'created_at': 0, 'thread_id': thread_id,
+        'role': 'assistant', 'content': [], 'status': 'in_progress', 'assistant_id': 'asst_recorded',
+        'run_id': run_id, 'attachments': [], 'metadata': {},
+    }
+    offset = 0.0
+    events = [
+        {'offset': offset, 'event': 'thread.run.created', 'data': run},
+        {'offset': offset, 'event': 'thread.run.in_progress', 'data': dict(run, status='in_progress')},
+        {'offset': offset, 'event': 'thread.message.created', 'data': message},
+    ]
+    for start in range(0, len(text), chunk_size):
+        offset += token_interval
+        events.append({'offset': offset, 'event': 'thread.message.delta', 'data': {
+            'id': message_id, 'object': 'thread.message.delta',
+            'delta': {'content': [{'index': 0, 'type': 'text', 'text': {'value': text[start:start + chunk_size], 'annotations': []}}]},
+        }})
+    events.append({'offset': offset, 'event': 'thread.message.completed', 'data': dict(
+        message, status='completed', content=[{'type': 'text', 'text': {'value': text, 'annotations': []}}]
+    )})
+
+    if tool_call:
+        call = {'id': _new_id('call'), 'type': 'function',
+                'function': {'name': tool_call, 'arguments': json.dumps(tool_arguments or {})}}
+        step = {
+            'id': _new_id('step'), 'object': 'thread.run.step', 'created_at': 0, 'run_id': run_id,
+            'assistant_id': 'asst_recorded', 'thread_id': thread_id, 'type': 'tool_calls',
+            'status': 'in_progress', 'step_details': {'type': 'tool_calls', 'tool_calls': []},
+        }
+        events += [
+            {'offset': offset, 'event': 'thread.run.step.created', 'data': step},
+            {'offset': offset, 'event': 'thread.run.step.delta', 'data': {
+                'id': step['id'], 'object': 'thread.run.step.delta',
+                'delta': {'step_details': {'type': 'tool_calls', 'tool_calls': [
+                    dict(call, index=0, function=dict(call['function'], output=None))
+                ]}},
+            }},
+            {'offset': offset, 'event': 'thread.run.requires_action', 'data': dict(run, status='requires_action', required_action={
+                'type': 'submit_tool_outputs', 'submit_tool_outputs': {'tool_calls': [call]},
+            })},
+        ]
+    else:
+        tokens = max(1, len(text) // 4)
+        events.append({'offset': offset, 'event': 'thread.run.completed', 'data': dict(
+            run, status='completed', usage={'prompt_tokens': 0, 'completion_tokens': tokens, 'total_tokens': tokens}
+        )})
+
+    return {'stage': stage, 'thread_id': thread_id, 'file_path': file_path}, events
+
+
+def rate_limited_run(retry_after=1.0):
+    """
+    Recording of a run failing on a rate limit before streaming anything.
+    """
+    _, events = synthetic_run('rate_limited', '')
+    run = dict(events[0]['data'], status='failed', last_error={
+        'code': 'rate_limit_exceeded',
+        'message': f"Rate limit reached for gpt-4o. Please try again in {retry_after}s.",
+    })
+    return events[:2] + [{'offset': 0.0, 'event': 'thread.run.failed', 'data': run}]
+
+
+SAMPLE_DESIGN = """# Token Vault Design
+
+## Project structure
+
+```
+token_vault/
+├── src/
+│   ├── lib.rs
+│   ├── storage.rs
+│   └── events.rs
+└── tests/
+    └── vault_test.rs
+```
+
+## src/lib.rs
+Contract entry points: `deposit`, `withdraw` and `balance`.
+
+## src/storage.rs
+Persistent balances keyed by address.
+
+## src/events.rs
+Events published on deposit and withdrawal.
+"""
+
+SAMPLE_FILES = {
+    'src/lib.rs': '#![no_std]\nuse soroban_sdk::{contract, contractimpl, Address, Env};\n\n#[contract]\npub struct TokenVault;\n',
+    'src/storage.rs': 'use soroban_sdk::{Address, Env};\n\npub fn balance(env: &Env, owner: &Address) -> i128 {\n    0\n}\n',
+    'src/events.rs': 'use soroban_sdk::{symbol_short, Address, Env};\n\npub fn deposited(env: &Env, owner: Address, amount: i128) {}\n',
+    'test/vault_test.rs': '#![cfg(test)]\nuse soroban_sdk::Env;\n\n#[test]\nfn deposit_then_withdraw() {}\n',
+    'Cargo.toml': '[package]\nname = "token_vault"\nversion = "0.1.0"\n',
+    'README.md': '# Token Vault\n\nA Soroban vault contract.\n',
+}
+
+
+def default_recordings(token_interval=0.0, chunk_size=16, file_size=2000):
+    """
+    Synthetic recordings of a whole session: a questioner reply, the designer
+    output and one build per file of the design, each file padded to file_size
+    characters.
+    """
+    recordings = [
+        synthetic_run('questioner', "Which token should the vault accept, and who can withdraw?",
+                      chunk_size=chunk_size, token_interval=token_interval),
+        synthetic_run('designer', SAMPLE_DESIGN, chunk_size=chunk_size, token_interval=token_interval),
+    ]
+    for file_path, body in SAMPLE_FILES.items():
+        body = body + '// ' + 'x' * max(0, file_size - len(body)) + '\n'
+        fence = 'toml' if file_path.endswith('.toml') else 'markdown' if file_path.endswith('.md') else 'rust'
+        recordings.append(synthetic_run('build_file', f"```{fence}\n{body}```\n", file_path=file_path,
+                                        chunk_size=chunk_size, token_interval=token_interval))
+    return recordings
+
+
+class ReplayStream:
+    """
+    Async iterator over the events of a recording as openai stream events,
+    sleeping so they arrive at their recorded offsets divided by speed (no
+    sleeping when speed is 0).
+    """
+
+    def __init__(self, events, speed=0.0, on_event=None):
+        self.events = events
+        self.speed = speed
+        self.on_event = on_event
+        self.closed = False
+
+    async def __aiter__(self):
+        from openai._models import construct_type
+        from openai.types.beta import AssistantStreamEvent
+
+        started = time.perf_counter()
+        for recorded in self.events:
+            if self.closed:
+                return
+            if self.speed:
+                delay = recorded['offset'] / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            event = construct_type(type_=AssistantStreamEvent, value={'event': recorded['event'], 'data': recorded['data']})
+            if self.on_event:
+                self.on_event(event)
+            yield event
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeOpenAI:
+    """
+    Stands in for openai.AsyncOpenAI. Threads and messages are kept in memory and each
+    runs.stream() call replays the recording returned by recording_for(), by
+    default the one matching the event handler's stage and file path (or the
+    stage alone), recordings of a stage being used in turn.
+
+    latency is awaited before answering every call, in seconds or as a callable
+    returning seconds. `calls` counts the API calls made, by method name, and
+    each call adds to the openai_round_trips metric of the current spans.
+    request_hooks are awaited with the httpx.Request the real client would send,
+    install() sets main's rate limiter. The first rate_limited_runs runs fail
+    on a rate limit, asking to retry after retry_after seconds.
+    """
+
+    ROUTES = {
+        'threads.create': ('POST', '/v1/threads'),
+        'threads.retrieve': ('GET', '/v1/threads/thread'),
+        'threads.delete': ('DELETE', '/v1/threads/thread'),
+        'messages.create': ('POST', '/v1/threads/thread/messages'),
+        'messages.list': ('GET', '/v1/threads/thread/messages'),
+        'runs.stream': ('POST', '/v1/threads/thread/runs'),
+        'runs.cancel': ('POST', '/v1/threads/thread/runs/run/cancel'),
+        'chat.completions.create': ('POST', '/v1/chat/completions'),
+    }
+
+    def __init__(self, recordings, speed=0.0, latency=0.0, rate_limited_runs=0, retry_after=0.1):
+        if isinstance(recordings, str):
+            recordings = load_recordings(recordings)
+        self.speed = speed
+        self.latency = latency
+        self.request_hooks = []
+        self.rate_limited_runs = rate_limited_runs
+        self.retry_after = retry_after
+        self.calls = {}
+        self.threads = {}
+        self._recordings = {}
+        self._cursors = {}
+        self._lock = threading.Lock()
+        for header, events in recordings:
+            self._recordings.setdefault((header['stage'], header.get('file_path')), []).append(events)
+            if header.get('file_path') is not None:
+                self._recordings.setdefault((header['stage'], None), []).append(events)
+
+        threads = SimpleNamespace(
+            create=self._create_thread,
+            retrieve=self._retrieve_thread,
+            delete=self._delete_thread,
+            messages=SimpleNamespace(create=self._create_message, list=self._list_messages),
+            runs=SimpleNamespace(stream=self._stream, cancel=self._cancel_run),
+        )
+        self.beta = SimpleNamespace(threads=threads)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat_completion))
+
+    async def _count(self, method):
+        if self.request_hooks:
+            import httpx
+            http_method, path = self.ROUTES[method]
+            request = httpx.Request(http_method, f"https://api.openai.com{path}")
+            for hook in self.request_hooks:
+                await hook(request)
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        # Counted like the real client's HTTP hook does
+        tracing.count('openai_round_trips')
+        await _async_sleep(self.latency)
+
+    async def _create_thread(self, messages=None, **kwargs):
+        await self._count('threads.create')
+        thread_id = _new_id('thread')
+        with self._lock:
+            self.threads[thread_id] = [dict(m) for m in messages or []]
+        return SimpleNamespace(id=thread_id)
+
+    async def _retrieve_thread(self, thread_id, **kwargs):
+        await self._count('threads.retrieve')
+        return SimpleNamespace(id=thread_id)
+
+    async def _delete_thread(self, thread_id, **kwargs):
+        await self._count('threads.delete')
+        with self._lock:
+            self.threads.pop(thread_id, None)
+        return SimpleNamespace(id=thread_id, deleted=True)
+
+    async def _create_message(self, thread_id, role, content, **kwargs):
+        await self._count('messages.create')
+        with self._lock:
+            self.threads.setdefault(thread_id, []).append({'role': role, 'content': content})
+
+    async def _list_messages(self, thread_id, **kwargs):
+        await self._count('messages.list')
+        with self._lock:
+            messages = list(reversed(self.threads.get(thread_id, [])))
+        return SimpleNamespace(data=[
+            SimpleNamespace(role=m['role'], content=[SimpleNamespace(text=SimpleNamespace(value=m['content']))])
+            for m in messages
+        ])
+
+    async def _cancel_run(self, thread_id, run_id, **kwargs):
+        await self._count('runs.cancel')
+
+    async def _chat_completion(self, **kwargs):
+        await self._count('chat.completions.create')
+        raise RuntimeError("FakeOpenAI has no recordings for chat completions")
+
+    def messages_of(self, thread_id):
+        with self._lock:
+            return list(self.threads.get(thread_id, []))
+
+    def recording_for(self, event_handler, thread_id):
+        key = (event_handler.stage, getattr(event_handler, 'current_file_path', None))
+        with self._lock:
+            if key not in self._recordings:
+                key = (key[0], None)
+            runs = self._recordings.get(key)
+            if not runs:
+                raise RuntimeError(f"No recording for stage {key[0]}")
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            return runs[cursor % len(runs)]
+
+    def _stream(self, thread_id, assistant_id, event_handler, additional_messages=None, **kwargs):
+        from openai.lib.streaming import AsyncAssistantStreamManager
+
+        def on_event(event):
+            # Completed messages are added to the thread like the API does
+            if event.event == 'thread.message.completed':
+                text = "".join(c.text.value for c in event.data.content if c.type == 'text')
+                with self._lock:
+                    self.threads.setdefault(thread_id, []).append({'role': 'assistant', 'content': text})
+
+        # Like the real client, the request is only sent when the manager is entered
+        async def api_request():
+            await self._count('runs.stream')
+            with self._lock:
+                self.threads.setdefault(thread_id, []).extend(dict(m) for m in additional_messages or [])
+                rate_limited = self.rate_limited_runs > 0
+                self.rate_limited_runs -= int(rate_limited)
+            if rate_limited:
+                return ReplayStream(rate_limited_run(self.retry_after), self.speed, on_event)
+            events = self.recording_for(event_handler, thread_id)
+            return ReplayStream(events, self.speed, on_event)
+
+        return AsyncAssistantStreamManager(api_request(), event_handler=event_handler)
+
+
+class FakePusher:
+    """
+    Stands in for pusher.Pusher, keeping (time, channel, event, data) for every
+    event triggered. latency (seconds, or a callable returning seconds) is slept
+    on every call.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.events = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def trigger(self, channel, event_name, data):
+        self.trigger_batch([{'channel': channel, 'name': event_name, 'data': data}])
+
+    def trigger_batch(self, batch):
+        _sleep(self.latency)
+        now = time.perf_counter()
+        with self._lock:
+            self.calls += 1
+            for event in batch:
+                data = event['data']
+                self.events.append((now, event['channel'], event['name'], json.loads(data) if isinstance(data, str) else data))
+
+    def events_for(self, channel, event_name=None):
+        with self._lock:
+            return [e for e in self.events if e[1] == channel and (event_name is None or e[2] == event_name)]
+
+
+def install(main, openai_client, pusher_client, db=None):
+    """
+    Makes main use the given clients (and a fresh MemoryFirestore by default).
+    Clients built on top of them (publisher, counters, job manager, rate limiter)
+    are recreated, and the requests of a FakeOpenAI wait for the rate limiter
+    like the real client's.
+    """
+    if isinstance(openai_client, FakeOpenAI):
+        openai_client.request_hooks = [main.limit_openai_request]
+    with main._clients_lock:
+        main._clients.clear()
+        main._clients['openai'] = openai_client
+        main._clients['pusher'] = pusher_client
+        main._clients['db'] = db if db is not None else MemoryFirestore()
+    main.file_names_cache.clear()
@@ -0,0 +1,240 @@
+"""
+Load generator: N concurrent scripted chat sessions against chat_handler, through
+the Flask test client, on the fakes of fakes.py.
+
+Every session plays the turns of a script. A turn with "generate": true makes the
+questioner call generate_contract, so the background contract pipeline competes
+with the chat traffic. Latencies of the stubbed OpenAI calls, streamed tokens,
+Pusher calls and think time between turns are drawn from distributions:
+
+    const:0.05   uniform:0.01,0.1   normal:0.05,0.01   lognormal:-3,0.5   exp:0.05
+
+    python backend/benchmarks/loadgen.py --sessions 50
+    python backend/benchmarks/loadgen.py --sessions 20 --openai-latency lognormal:-2.5,0.4 \\
+        --token-interval 0.01 --pusher-latency uniform:0.01,0.04 --out run.json
+
+With --openai-rpm/--openai-tpm the OpenAI calls go through main's rate limiter,
+and --rate-limited-runs makes the first runs fail on a rate limit, to see how
+chat turns and background builds share the budget:
+
+    python backend/benchmarks/loadgen.py --sessions 20 --openai-rpm 600 --rate-limited-runs 3
+
+The results (throughput, p50/p99 latencies, Pusher event rate, error rate,
+rate limiter waits and thread pool hit rate) are printed as JSON.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('FIRESTORE_BACKEND', 'memory')
+os.environ.setdefault('JOB_STORE', 'memory')
+
+import fakes  # noqa: E402  (puts backend/functions on sys.path)
+import tracing  # noqa: E402
+
+DEFAULT_SCRIPT = {
+    'turns': [
+        {'input': "I want a vault contract for Stellar tokens",
+         'reply': "Which token should the vault accept, and who can withdraw?"},
+        {'input': "Only XLM, and only the depositor can withdraw their balance",
+         'reply': "Should deposits be locked for a minimum time?"},
+        {'input': "No lock, please generate it",
+         'reply': "Great, I have everything I need.", 'generate': True},
+    ]
+}
+
+
+def distribution(spec, rng):
+    """
+    A callable returning samples, in seconds, of a distribution like 'uniform:0.01,0.1'.
+    """
+    if spec is None:
+        return lambda: 0.0
+    kind, _, params = spec.partition(':')
+    values = [float(v) for v in params.split(',') if v]
+    if kind == 'const':
+        return lambda: values[0]
+    if kind == 'uniform':
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == 'normal':
+        return lambda: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == 'lognormal':
+        return lambda: rng.lognormvariate(values[0], values[1])
+    if kind == 'exp':
+        return lambda: rng.expovariate(1 / values[0])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class ScriptedOpenAI(fakes.FakeOpenAI):
+    """
+    FakeOpenAI where the questioner answers every user input of the script with
+    the reply of its turn, calling generate_contract on generating turns.
+    """
+
+    def __init__(self, script, token_interval, latency, file_size, rate_limited_runs=0):
+        recordings = fakes.default_recordings(token_interval=token_interval, file_size=file_size)
+        super().__init__(recordings, speed=1.0 if token_interval else 0.0, latency=latency,
+                         rate_limited_runs=rate_limited_runs)
+        self.replies = {
+            turn['input']: fakes.synthetic_run(
+                'questioner', turn['reply'], token_interval=token_interval,
+                tool_call='generate_contract' if turn.get('generate') else None
+            )[1]
+            for turn in script['turns']
+        }
+
+    def recording_for(self, event_handler, thread_id):
+        if event_handler.stage == 'questioner':
+            inputs = [m['content'] for m in self.messages_of(thread_id) if m['role'] == 'user']
+            if inputs and inputs[-1] in self.replies:
+                return self.replies[inputs[-1]]
+        return super().recording_for(event_handler, thread_id)
+
+
+def run_session(client, session, script, think_time):
+    channel = f"load-{session}"
+    thread_id = None
+    results = []
+    # Browsers send a CORS preflight before their first message
+    client.options('/chat')
+    for turn in script['turns']:
+        started = time.perf_counter()
+        try:
+            response = client.post('/chat', json={'input': turn['input'], 'thread_id': thread_id, 'channel_id': channel})
+            body = response.get_json() or {}
+            ok = response.status_code < 400
+            thread_id = body.get('thread_id', thread_id)
+        except Exception as e:
+            body, ok = {'error': str(e)}, False
+        results.append({
+            'latency': time.perf_counter() - started,
+            'ok': ok,
+            'job_id': body.get('job_id'),
+            'error': body.get('error'),
+        })
+        if not ok:
+            break
+        time.sleep(think_time())
+    return results
+
+
+def wait_for_jobs(main, job_ids, timeout):
+    manager = main.get_job_manager()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        jobs = [manager.get(job_id) for job_id in job_ids]
+        if all(job and job['state'] in ('done', 'failed') for job in jobs):
+            return jobs
+        time.sleep(0.05)
+    return [manager.get(job_id) for job_id in job_ids]
+
+
+def summarize_latencies(samples):
+    if not samples:
+        return None
+    return {
+        'count': len(samples),
+        'p50': tracing.percentile(samples, 50),
+        'p99': tracing.percentile(samples, 99),
+        'max': max(samples),
+    }
+
+
+def run_load(args):
+    if not args.cache:
+        os.environ['GENERATION_CACHE_BACKEND'] = 'none'
+    os.environ['OPENAI_REQUESTS_PER_MINUTE'] = str(args.openai_rpm)
+    os.environ['OPENAI_TOKENS_PER_MINUTE'] = str(args.openai_tpm)
+    import main
+    from flask import Flask, request
+
+    rng = random.Random(args.seed)
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+
+    openai_client = ScriptedOpenAI(script, args.token_interval, distribution(args.openai_latency, rng),
+                                   args.file_size, args.rate_limited_runs)
+    pusher = fakes.FakePusher(latency=distribution(args.pusher_latency, rng))
+    fakes.install(main, openai_client, pusher)
+
+    app = Flask(__name__)
+    app.add_url_rule('/chat', 'chat', lambda: main.chat_handler(request), methods=['POST', 'OPTIONS'])
+    think_time = distribution(args.think_time, rng)
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+            futures = [
+                executor.submit(run_session, app.test_client(), session, script, think_time)
+                for session in range(args.sessions)
+            ]
+            turns = [turn for future in futures for turn in future.result()]
+        chat_elapsed = time.perf_counter() - started
+
+        job_ids = [turn['job_id'] for turn in turns if turn['job_id']]
+        jobs = wait_for_jobs(main, job_ids, args.job_timeout) if job_ids else []
+        main.get_publisher().drain(args.job_timeout)
+    elapsed = time.perf_counter() - started
+
+    finished = [job for job in jobs if job and job['state'] == 'done']
+    failed_turns = [turn for turn in turns if not turn['ok']]
+    failed_jobs = [job for job in jobs if not job or job['state'] != 'done']
+    return {
+        'sessions': args.sessions,
+        'requests': len(turns),
+        'elapsed': elapsed,
+        'throughput': len(turns) / chat_elapsed if chat_elapsed else None,
+        'chat_latency': summarize_latencies([turn['latency'] for turn in turns]),
+        'generations': len(job_ids),
+        'generation_latency': summarize_latencies([
+            (job['updated_at'] - job['created_at']).total_seconds() for job in finished
+        ]),
+        'pusher_events': len(pusher.events),
+        'pusher_calls': pusher.calls,
+        'pusher_event_rate': len(pusher.events) / elapsed if elapsed else None,
+        'errors': len(failed_turns) + len(failed_jobs),
+        'error_rate': (len(failed_turns) + len(failed_jobs)) / (len(turns) + len(job_ids)) if turns else 0.0,
+        'sample_errors': sorted({turn['error'] or 'HTTP error' for turn in failed_turns}
+                                | {(job or {}).get('error') or 'unfinished' for job in failed_jobs})[:5],
+        'openai_calls': dict(openai_client.calls),
+        'rate_limits': main.rate_limit_stats(),
+        'thread_pool': main.get_thread_pool().stats(),
+        'config': {k: v for k, v in vars(args).items() if k != 'out'},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=20, help="concurrent sessions")
+    parser.add_argument('--script', help="JSON script: {\"turns\": [{\"input\", \"reply\", \"generate\"}]}")
+    parser.add_argument('--openai-latency', help="latency of every OpenAI call")
+    parser.add_argument('--token-interval', type=float, default=0.0, help="seconds between streamed deltas")
+    parser.add_argument('--pusher-latency', help="latency of every Pusher call")
+    parser.add_argument('--think-time', help="pause between the turns of a session")
+    parser.add_argument('--file-size', type=int, default=2000, help="characters per generated file")
+    parser.add_argument('--job-timeout', type=float, default=300.0, help="seconds to wait for generations")
+    parser.add_argument('--openai-rpm', type=int, default=0, help="OpenAI requests per minute (0: unlimited)")
+    parser.add_argument('--openai-tpm', type=int, default=0, help="OpenAI tokens per minute (0: unlimited)")
+    parser.add_argument('--rate-limited-runs', type=int, default=0, help="runs failing on a rate limit first")
+    parser.add_argument('--cache', action='store_true', help="keep the generation cache enabled")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = run_load(args)
+    output = json.dumps(results, indent=2, default=str)
+    print(output)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
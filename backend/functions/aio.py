@@ -0,0 +1,55 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import threading
+
+
+class EventLoopThread:
+    """
+    An asyncio event loop running forever in a daemon thread. Every request of
+    the instance runs its coroutines on it, so concurrent sessions (and the
+    AsyncOpenAI connection pool) are multiplexed on one loop.
+    """
+
+    def __init__(self, name='asyncio-loop'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """
+        Schedule a coroutine on the loop, in a copy of the caller's context, and
+        return a concurrent.futures.Future of its result.
+        """
+        ctx = contextvars.copy_context()
+        result = concurrent.futures.Future()
+
+        def done(task):
+            if task.cancelled():
+                result.cancel()
+            elif task.exception() is not None:
+                result.set_exception(task.exception())
+            else:
+                result.set_result(task.result())
+
+        def start():
+            # Tasks copy the context current when they are created
+            task = ctx.run(self.loop.create_task, coro)
+            task.add_done_callback(done)
+
+        self.loop.call_soon_threadsafe(start)
+        return result
+
+    def run(self, coro, timeout=None):
+        """
+        Run a coroutine on the loop and block the calling thread until it
+        returns. Must not be called from the loop.
+        """
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("EventLoopThread.run() called from its own loop, await the coroutine instead")
+        return self.submit(coro).result(timeout)
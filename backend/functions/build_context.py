@@ -0,0 +1,160 @@
+import logging
+import math
+import re
+
+FENCED_CODE = re.compile(r'```[^\n]*\n(.*?)```', re.DOTALL)
+FN_START = re.compile(r'^(pub(\([^)]*\))?\s+)?((const|async|unsafe)\s+|extern\s+"[^"]*"\s+)*fn\s')
+
+# How much of a dependency is sent, from most to least detailed
+LEVELS = ('full', 'signatures', 'imports', 'omitted')
+
+
+def estimate_tokens(text):
+    """
+    Rough token count, about 4 characters per token for code and English.
+    """
+    return math.ceil(len(text) / 4)
+
+
+def code_of(output):
+    """
+    The code in the fenced blocks of an assistant answer, or the answer itself.
+    """
+    blocks = FENCED_CODE.findall(output)
+    return "\n".join(block.rstrip('\n') for block in blocks) if blocks else output
+
+
+def rust_signatures(code):
+    """
+    The public shape of a Rust file: use statements, types, impl blocks and
+    function signatures, with function bodies and comments removed.
+    """
+    kept = []
+    depth = 0
+    skip_to = None
+    in_signature = False
+    for line in code.splitlines():
+        stripped = line.strip()
+        opens, closes = line.count('{'), line.count('}')
+
+        if skip_to is not None:
+            depth += opens - closes
+            if depth <= skip_to:
+                skip_to = None
+            continue
+        if not stripped or stripped.startswith('//'):
+            continue
+
+        if in_signature or FN_START.match(stripped):
+            in_signature = True
+            if '{' in line:
+                kept.append(line[:line.index('{')].rstrip() + ';')
+                in_signature = False
+                if opens > closes:
+                    skip_to = depth
+                    depth += opens - closes
+            else:
+                kept.append(line)
+                if stripped.endswith(';'):
+                    in_signature = False
+            continue
+
+        depth += opens - closes
+        kept.append(line)
+    return "\n".join(kept)
+
+
+def rust_imports(code):
+    """
+    Only what a Cargo.toml needs from a Rust file: its use statements and contract markers.
+    """
+    kept = []
+    in_use = False
+    for line in code.splitlines():
+        stripped = line.strip()
+        if in_use or stripped.startswith(('use ', 'pub use ', 'extern crate ')):
+            kept.append(line)
+            in_use = not stripped.endswith(';')
+        elif stripped.startswith(('#[contract', '#![no_std]')):
+            kept.append(line)
+    return "\n".join(kept)
+
+
+def render(path, output, level):
+    if level == 'full' or not path.endswith('.rs'):
+        return output
+    code = code_of(output)
+    return rust_signatures(code) if level == 'signatures' else rust_imports(code)
+
+
+def preferred_level(target, dependency, output):
+    """
+    The least a file needs to see of one of its dependencies.
+    """
+    if target == 'Cargo.toml':
+        return 'imports'
+    if target.startswith('test/') and '#[contractimpl]' in output:
+        # Tests exercise the contract's behaviour, not just its interface
+        return 'full'
+    return 'signatures'
+
+
+def _context_messages(designer_output, file_path, rendered, levels):
+    messages = [{"role": "user", "content": designer_output}]
+    sections = []
+    for path, text in rendered.items():
+        if levels[path] == 'full':
+            sections.append(f"### {path}\n{text}")
+        elif levels[path] != 'omitted':
+            kind = 'public interface' if levels[path] == 'signatures' else 'imports'
+            sections.append(f"### {path} ({kind})\n```rust\n{text}\n```")
+    omitted = [path for path in rendered if levels[path] == 'omitted']
+    if omitted:
+        sections.append(f"Also generated, not shown: {', '.join(omitted)}")
+    if sections:
+        messages.append({
+            "role": "user",
+            "content": "These files have already been generated:\n\n" + "\n\n".join(sections)
+        })
+    messages.append({"role": "user", "content": f"Generate the code for {file_path}"})
+    return messages
+
+
+def _tokens(messages):
+    return sum(estimate_tokens(m['content']) for m in messages)
+
+
+def build_file_context(designer_output, file_path, dependency_outputs, budget):
+    """
+    Builds the messages seeding the building thread of file_path: the design
+    document, what the file needs to see of its dependencies and the request to
+    generate it, within `budget` estimated tokens.
+
+    Dependencies start at their preferred level and, while the context is over
+    budget, the largest one is sent with less detail (full source, signatures,
+    imports, then only its name). Returns (messages, report) where the report
+    has the tokens sent and the level each dependency was sent at.
+    """
+    levels = {path: preferred_level(file_path, path, output) for path, output in dependency_outputs.items()}
+    rendered = {path: render(path, output, levels[path]) for path, output in dependency_outputs.items()}
+    messages = _context_messages(designer_output, file_path, rendered, levels)
+
+    while _tokens(messages) > budget:
+        reducible = [path for path in rendered if levels[path] != 'omitted']
+        if not reducible:
+            logging.warning(f"Context for {file_path} is over budget with the design document alone")
+            break
+        path = max(reducible, key=lambda p: estimate_tokens(rendered[p]))
+        levels[path] = LEVELS[LEVELS.index(levels[path]) + 1]
+        rendered[path] = '' if levels[path] == 'omitted' else render(path, dependency_outputs[path], levels[path])
+        messages = _context_messages(designer_output, file_path, rendered, levels)
+
+    full_levels = {path: 'full' for path in dependency_outputs}
+    report = {
+        'file_path': file_path,
+        'tokens': _tokens(messages),
+        'unbudgeted_tokens': _tokens(_context_messages(designer_output, file_path, dependency_outputs, full_levels)),
+        'budget': budget,
+        'levels': levels,
+    }
+    return messages, report
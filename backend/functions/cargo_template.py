@@ -0,0 +1,105 @@
+import re
+
+from build_context import code_of
+
+# Bump when the template changes, it is part of the generation cache key
+CARGO_TEMPLATE_VERSION = '2'
+
+USE_ROOT = re.compile(r'^\s*(?:pub\s+)?use\s+(?:::)?\{?\s*([A-Za-z_]\w*)', re.MULTILINE)
+EXTERN_CRATE = re.compile(r'^\s*extern\s+crate\s+([A-Za-z_]\w*)', re.MULTILINE)
+CONTRACT_MARKER = re.compile(r'#\[contract(?:impl)?\b')
+
+# Package name used when the project name has nothing usable
+DEFAULT_PACKAGE_NAME = 'contract'
+
+# Paths that don't come from a dependency
+BUILTIN_ROOTS = {'crate', 'self', 'super', 'core', 'alloc', 'std'}
+
+# Crates the template knows how to declare, with their Cargo.toml dependency line
+KNOWN_CRATES = {
+    'soroban_sdk': 'soroban-sdk = "{sdk_version}"',
+    'soroban_token_sdk': 'soroban-token-sdk = "{sdk_version}"',
+}
+
+CARGO_TEMPLATE = """[package]
+name = "{name}"
+version = "0.1.0"
+edition = "2021"
+
+[lib]
+crate-type = ["cdylib"]
+doctest = false
+
+[dependencies]
+{dependencies}
+
+[dev-dependencies]
+soroban-sdk = {{ version = "{sdk_version}", features = ["testutils"] }}
+
+[profile.release]
+opt-level = "z"
+overflow-checks = true
+debug = 0
+strip = "symbols"
+debug-assertions = false
+panic = "abort"
+codegen-units = 1
+lto = true
+
+[profile.release-with-logs]
+inherits = "release"
+debug-assertions = true
+"""
+
+
+def scan_sources(files):
+    """
+    Returns (crates, has_contract): the external crates the Rust files use and
+    whether any of them defines a contract. Modules of the project itself are
+    not counted as crates.
+    """
+    modules = {path.rsplit('/', 1)[-1][:-3] for path in files if path.endswith('.rs')}
+    crates = set()
+    has_contract = False
+    for path, output in files.items():
+        if not path.endswith('.rs'):
+            continue
+        code = code_of(output)
+        crates.update(USE_ROOT.findall(code))
+        crates.update(EXTERN_CRATE.findall(code))
+        has_contract = has_contract or bool(CONTRACT_MARKER.search(code))
+    return crates - BUILTIN_ROOTS - modules, has_contract
+
+
+def package_name(project_name):
+    """
+    The project name as a Cargo package name: lowercase alphanumeric words joined
+    by dashes, starting with a letter ("MyToken" and "my token" give "my-token").
+    """
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1-\2', (project_name or '').strip())
+    name = re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+    if not name:
+        return DEFAULT_PACKAGE_NAME
+    return name if name[0].isalpha() else f"{DEFAULT_PACKAGE_NAME}-{name}"
+
+
+def generate_cargo_toml(project_name, files, sdk_version):
+    """
+    Cargo.toml for the generated sources, formatted like an assistant answer, or
+    None when it can't be produced from the template: no contract was found or
+    the sources use a crate the template doesn't know.
+    """
+    crates, has_contract = scan_sources(files)
+    if not has_contract or crates - set(KNOWN_CRATES):
+        return None
+    # The SDK is always needed, tests use it through the dev-dependency features
+    crates.add('soroban_sdk')
+    dependencies = "\n".join(
+        KNOWN_CRATES[crate].format(sdk_version=sdk_version) for crate in sorted(crates)
+    )
+    content = CARGO_TEMPLATE.format(
+        name=package_name(project_name),
+        dependencies=dependencies,
+        sdk_version=sdk_version
+    )
+    return f"```toml\n{content}```\n"
@@ -0,0 +1,58 @@
+import datetime
+
+from contract_store import MAX_BATCH_WRITES, decode_file, encode_file, file_doc_id
+
+
+class GenerationCheckpoint:
+    """
+    Persists the progress of one contract generation so it can be resumed.
+
+    The checkpoint document keeps the designer output, the file plan and the
+    building thread used for each file; every finished file is written to the
+    'files' subcollection as soon as it has been built, and deleted once the
+    contract is saved.
+    """
+
+    def __init__(self, db, checkpoint_id, collection='generation_checkpoints', compress_threshold=4096):
+        self.db = db
+        self.checkpoint_id = checkpoint_id
+        self.compress_threshold = compress_threshold
+        self.ref = db.collection(collection).document(checkpoint_id)
+
+    def start(self, **fields):
+        self.ref.set(dict(fields, status='in_progress', updated_at=datetime.datetime.now()), merge=True)
+
+    def update(self, **fields):
+        self.ref.set(dict(fields, updated_at=datetime.datetime.now()), merge=True)
+
+    def record_thread(self, file_path, thread_id):
+        self.ref.set({'building_threads': {file_path: thread_id}}, merge=True)
+
+    def save_file(self, file_path, content):
+        batch = self.db.batch()
+        batch.set(
+            self.ref.collection('files').document(file_doc_id(file_path)),
+            encode_file(file_path, content, self.compress_threshold)
+        )
+        batch.set(self.ref, {'updated_at': datetime.datetime.now()}, merge=True)
+        batch.commit()
+
+    def finish(self, contract_id):
+        # The contract holds the files now, keeping them here would store them twice
+        refs = [snapshot.reference for snapshot in self.ref.collection('files').stream()]
+        for start in range(0, len(refs), MAX_BATCH_WRITES):
+            batch = self.db.batch()
+            for ref in refs[start:start + MAX_BATCH_WRITES]:
+                batch.delete(ref)
+            batch.commit()
+        self.update(status='completed', contract_id=contract_id)
+
+    def load(self):
+        snapshot = self.ref.get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def load_files(self):
+        return {
+            doc['path']: decode_file(doc)
+            for doc in (snapshot.to_dict() for snapshot in self.ref.collection('files').stream())
+        }
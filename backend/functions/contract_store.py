@@ -0,0 +1,172 @@
+import hashlib
+import zlib
+from urllib.parse import quote, unquote
+
+# Firestore commits at most 500 writes per batch
+MAX_BATCH_WRITES = 500
+
+
+def file_doc_id(file_path):
+    # Document ids can't contain '/', so the path is percent-encoded
+    return quote(file_path, safe='')
+
+
+def encode_file(file_path, content, compress_threshold):
+    raw = content.encode('utf-8')
+    doc = {
+        'path': file_path,
+        'size': len(raw),
+        'sha256': hashlib.sha256(raw).hexdigest(),
+    }
+    if len(raw) > compress_threshold:
+        doc['encoding'] = 'zlib'
+        doc['content'] = zlib.compress(raw, 6)
+    else:
+        doc['encoding'] = 'identity'
+        doc['content'] = content
+    return doc
+
+
+def decode_file(doc):
+    if doc.get('encoding') == 'zlib':
+        return zlib.decompress(bytes(doc['content'])).decode('utf-8')
+    return doc.get('content', '')
+
+
+def save_contract(db, contract_id, metadata, files_data, compress_threshold=4096, collection='contracts'):
+    """
+    Save a contract as a metadata document plus one document per file in its
+    'files' subcollection, compressing files larger than compress_threshold bytes.
+
+    Everything goes out in one batched commit (split only past Firestore's
+    500 writes per batch).
+    """
+    contract_ref = db.collection(collection).document(contract_id)
+    writes = [(contract_ref, dict(metadata, file_paths=list(files_data.keys())))]
+    for index, (file_path, content) in enumerate(files_data.items()):
+        file_ref = contract_ref.collection('files').document(file_doc_id(file_path))
+        writes.append((file_ref, dict(encode_file(file_path, content, compress_threshold), index=index)))
+
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for ref, data in writes[start:start + MAX_BATCH_WRITES]:
+            batch.set(ref, data)
+        batch.commit()
+    return contract_id
+
+
+def update_contract(db, contract_id, metadata, files_data, changed_files, removed_files=(),
+                    compress_threshold=4096, collection='contracts'):
+    """
+    Update a contract saved by save_contract() after some of its files were
+    regenerated: only the files in changed_files are written again, the others
+    just get their new index, and removed_files are deleted.
+
+    The version being replaced is kept in the 'versions' subcollection, as its
+    metadata plus the files this update overwrites or deletes, so that
+    load_contract_version() can rebuild it.
+    """
+    contract_ref = db.collection(collection).document(contract_id)
+    previous = contract_ref.get().to_dict() or {}
+    version_ref = contract_ref.collection('versions').document(str(previous.get('version', 1)))
+    # Copies of the previous version go first, in case the writes span batches
+    writes = [(version_ref, previous, False)]
+    for file_path in [f for f in files_data if f in changed_files] + list(removed_files):
+        snapshot = contract_ref.collection('files').document(file_doc_id(file_path)).get()
+        if snapshot.exists:
+            writes.append((version_ref.collection('files').document(snapshot.id), snapshot.to_dict(), False))
+
+    writes.append((contract_ref, dict(metadata, file_paths=list(files_data.keys())), True))
+    for index, (file_path, content) in enumerate(files_data.items()):
+        file_ref = contract_ref.collection('files').document(file_doc_id(file_path))
+        if file_path in changed_files:
+            writes.append((file_ref, dict(encode_file(file_path, content, compress_threshold), index=index), False))
+        else:
+            writes.append((file_ref, {'index': index}, True))
+    for file_path in removed_files:
+        writes.append((contract_ref.collection('files').document(file_doc_id(file_path)), None, False))
+
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for ref, data, merge in writes[start:start + MAX_BATCH_WRITES]:
+            if data is None:
+                batch.delete(ref)
+            else:
+                batch.set(ref, data, merge=merge)
+        batch.commit()
+    return contract_id
+
+
+def load_contract_metadata(db, contract_id, collection='contracts'):
+    snapshot = db.collection(collection).document(contract_id).get()
+    if not snapshot.exists:
+        return None
+    metadata = snapshot.to_dict()
+    # Contracts saved before the files subcollection keep their files inline
+    if 'files' in metadata and 'file_paths' not in metadata:
+        metadata['file_paths'] = list(metadata['files'].keys())
+    metadata.pop('files', None)
+    return metadata
+
+
+def load_contract_file(db, contract_id, file_path, collection='contracts'):
+    """
+    Fetch a single file of a contract. Returns None if it doesn't exist.
+    """
+    contract_ref = db.collection(collection).document(contract_id)
+    snapshot = contract_ref.collection('files').document(file_doc_id(file_path)).get()
+    if snapshot.exists:
+        return decode_file(snapshot.to_dict())
+
+    legacy = contract_ref.get()
+    if legacy.exists:
+        file_doc = (legacy.to_dict().get('files') or {}).get(file_path)
+        if file_doc:
+            return file_doc.get('content', '')
+    return None
+
+
+def load_contract_version(db, contract_id, version, collection='contracts'):
+    """
+    The files of a past (or the current) version of a contract as {file_path: content},
+    or None when the contract or the version doesn't exist.
+    """
+    metadata = load_contract_metadata(db, contract_id, collection)
+    if metadata is None:
+        return None
+    current = metadata.get('version', 1)
+    if not 1 <= version <= current:
+        return None
+    files = dict(iter_contract_files(db, contract_id, collection))
+    # Walk back from the current version, restoring what each update replaced
+    versions = db.collection(collection).document(contract_id).collection('versions')
+    for past in range(current - 1, version - 1, -1):
+        version_ref = versions.document(str(past))
+        snapshot = version_ref.get()
+        if not snapshot.exists:
+            return None
+        for file_snapshot in version_ref.collection('files').stream():
+            doc = file_snapshot.to_dict()
+            files[doc['path']] = decode_file(doc)
+        files = {path: files[path] for path in snapshot.get('file_paths') or [] if path in files}
+    return files
+
+
+def iter_contract_files(db, contract_id, collection='contracts'):
+    """
+    Lazily yield (file_path, content) for every file of a contract, in the order
+    they were generated.
+    """
+    contract_ref = db.collection(collection).document(contract_id)
+    found = False
+    for snapshot in contract_ref.collection('files').order_by('index').stream():
+        found = True
+        doc = snapshot.to_dict()
+        yield doc.get('path', unquote(snapshot.id)), decode_file(doc)
+    if found:
+        return
+
+    legacy = contract_ref.get()
+    if legacy.exists:
+        for file_path, file_doc in (legacy.to_dict().get('files') or {}).items():
+            yield file_path, file_doc.get('content', '')
@@ -0,0 +1,356 @@
+import difflib
+import re
+
+# A path (or bare file name) of a Rust source file
+RS_PATH = re.compile(r'(?<![\w/.\-])((?:[\w\-]+/)*[\w\-]+\.rs)\b')
+HEADING = re.compile(r'^\s{0,3}#{1,6}\s+(.*?)\s*#*\s*$')
+TREE_LINE = re.compile(r'^(?P<prefix>(?:[│|]\s{2,3}|\s{4}|\s{3})*)(?:[├└|`+]\s*[─\-]{2}\s*)?(?P<name>[^\s│├└─#]+)')
+CARGO_NAME = re.compile(r'^\s*name\s*=\s*"([^"]+)"', re.MULTILINE)
+LABELLED_NAME = re.compile(
+    r'(?:project|contract|crate)\s+name\s*\**\s*[:\-]\s*\**\s*`?([A-Za-z][\w\- ]*?)`?\s*(?:\*\*)?\s*$',
+    re.IGNORECASE | re.MULTILINE
+)
+TREE_MARKERS = ('├', '└', '|--', '`--', '+--')
+# Words that describe the document rather than name the project in a title
+TITLE_NOISE = {
+    'design', 'document', 'documentation', 'specification', 'spec', 'smart', 'contract',
+    'soroban', 'stellar', 'architecture', 'overview', 'project', 'for', 'the', 'a', 'of',
+}
+
+
+def snake_case(name):
+    name = re.sub(r'([a-z0-9])([A-Z])', r'\1_\2', name.strip())
+    return re.sub(r'[^a-z0-9]+', '_', name.lower()).strip('_')
+
+
+def _fenced_blocks(markdown):
+    """
+    Yields (info_string, body) for every fenced block of the document.
+    """
+    for match in re.finditer(r'^```([^\n]*)\n(.*?)^```', markdown, re.MULTILINE | re.DOTALL):
+        yield match.group(1).strip(), match.group(2)
+
+
+def _close_fence(markdown):
+    """
+    The document with its unterminated fenced block closed, to parse a document
+    that is still being written.
+    """
+    fences = len(re.findall(r'^\s*```', markdown, re.MULTILINE))
+    return markdown + "\n```\n" if fences % 2 else markdown
+
+
+def _file_sections(lines):
+    """
+    Yields (paths, start, end) for every section whose heading names Rust files,
+    as line indexes. A section runs to the next heading of the same or a higher
+    level, end is None when the lines end first.
+    """
+    headings = []
+    in_fence = False
+    for index, line in enumerate(lines):
+        if line.lstrip().startswith('```'):
+            in_fence = not in_fence
+            continue
+        heading = None if in_fence else HEADING.match(line)
+        if heading:
+            level = len(line.lstrip()) - len(line.lstrip().lstrip('#'))
+            headings.append((index, level, heading.group(1)))
+
+    for position, (start, level, title) in enumerate(headings):
+        paths = [_normalize(path.lstrip('./')) for path in RS_PATH.findall(title)]
+        if paths:
+            end = next((index for index, other, _ in headings[position + 1:] if other <= level), None)
+            yield paths, start, end
+
+
+def _tree_paths(block):
+    """
+    Rebuilds full paths from a `tree`-style listing. Returns (root_name, paths).
+    """
+    lines = [line for line in block.splitlines() if line.strip()]
+    if not any(marker in block for marker in TREE_MARKERS):
+        return None, []
+
+    root = None
+    stack = []
+    paths = []
+    for line in lines:
+        match = TREE_LINE.match(line)
+        if not match:
+            continue
+        name = match.group('name')
+        has_branch = any(marker in line for marker in ('├', '└', '--'))
+        if not has_branch and root is None and name.endswith('/'):
+            root = name.rstrip('/')
+            continue
+        depth = len(match.group('prefix').replace('│', ' ').replace('|', ' ')) // 4
+        stack = stack[:depth]
+        if name.endswith('/'):
+            stack.append(name.rstrip('/'))
+        else:
+            paths.append('/'.join(stack + [name]))
+    return root, paths
+
+
+def _is_test_file(path):
+    name = path.rsplit('/', 1)[-1]
+    parts = path.split('/')[:-1]
+    return (
+        'tests' in parts or 'test' in parts
+        or name in ('test.rs', 'tests.rs')
+        or name.endswith('_test.rs') or name.endswith('_tests.rs')
+    )
+
+
+def _normalize(path):
+    if _is_test_file(path):
+        return f"test/{path.rsplit('/', 1)[-1]}"
+    if 'src/' in path:
+        return 'src/' + path.split('src/', 1)[1]
+    return f"src/{path}"
+
+
+def _project_name(markdown, tree_root):
+    if tree_root and tree_root not in ('src', 'tests', 'test'):
+        return snake_case(tree_root), 1.0
+    for info, body in _fenced_blocks(markdown):
+        if info.lower() == 'toml':
+            match = CARGO_NAME.search(body)
+            if match:
+                return snake_case(match.group(1)), 1.0
+    match = LABELLED_NAME.search(markdown)
+    if match:
+        return snake_case(match.group(1)), 0.9
+    for line in markdown.splitlines():
+        heading = HEADING.match(line)
+        if heading:
+            words = [w for w in re.split(r'[\s:_\-]+', heading.group(1).replace('`', '')) if w]
+            name = [w for w in words if w.lower() not in TITLE_NOISE]
+            if name:
+                return snake_case(' '.join(name)), 0.6
+            break
+    return None, 0.0
+
+
+def parse_design_document(markdown):
+    """
+    Pulls the project name and the Rust files out of a designer document without an LLM.
+
+    Files are taken from tree listings when the document has one, otherwise from
+    every .rs path mentioned in the text, in the order they first appear. Returns
+    (project_name, src_files, test_files, confidence) where confidence is between
+    0 and 1 and tells how much the result can be trusted.
+    """
+    tree_root = None
+    tree_files = []
+    for info, body in _fenced_blocks(markdown):
+        root, paths = _tree_paths(body)
+        if paths:
+            tree_root = tree_root or root
+            tree_files.extend(p for p in paths if p.endswith('.rs'))
+
+    mentioned = RS_PATH.findall(markdown)
+
+    found = tree_files or mentioned
+    ordered = []
+    for path in found:
+        path = _normalize(path.lstrip('./'))
+        if path not in ordered:
+            ordered.append(path)
+
+    src_files = [p for p in ordered if p.startswith('src/')]
+    test_files = [p for p in ordered if p.startswith('test/')]
+    project_name, name_confidence = _project_name(markdown, tree_root)
+
+    if not src_files or not project_name:
+        return project_name, src_files, test_files, 0.0
+
+    if tree_files:
+        files_confidence = 1.0
+    elif any('/' in path for path in mentioned):
+        files_confidence = 0.8
+    else:
+        # Only bare file names, we had to guess the folders
+        files_confidence = 0.5
+    if 'src/lib.rs' not in src_files:
+        files_confidence *= 0.5
+
+    return project_name, src_files, test_files, round(files_confidence * name_confidence, 2)
+
+
+def order_design_files(src_files, test_files):
+    """
+    Orders the files to generate: sources, then tests, then Cargo.toml and README.md.
+    """
+    ordered_files = []
+
+    # 1. First add all .rs files that aren't tests
+    for file in src_files:
+        if file.endswith('.rs') and not file.endswith('_test.rs'):
+            if not file.startswith('src/'):
+                file = f"src/{file}"
+            ordered_files.append(file)
+
+    # 2. Then the tests
+    for file in test_files:
+        if file.endswith('.rs'):
+            if not file.startswith('test/'):
+                file = f"test/{file}"
+            ordered_files.append(file)
+
+    # 3. Add cargo file
+    ordered_files.append("Cargo.toml")
+
+    ordered_files.append("README.md")
+
+    return ordered_files
+
+
+def design_sections(markdown):
+    """
+    The part of the design about each Rust file: the text of the sections whose
+    heading names the file, by normalized path.
+    """
+    lines = markdown.splitlines()
+    sections = {}
+    for paths, start, end in _file_sections(lines):
+        text = "\n".join(lines[start:end]).strip()
+        for path in paths:
+            sections[path] = f"{sections[path]}\n{text}" if path in sections else text
+    return sections
+
+
+def _line_key(line):
+    # Tree listings redraw the branches of their last entries when one is added
+    return re.sub(r'[\s│├└─|`+]+', ' ', line).strip()
+
+
+def changed_design_files(old_design, new_design, old_files, new_files):
+    """
+    The files of new_files whose part of the design changed, in new_files order.
+
+    These are files new to the plan and files whose sections changed. Changed
+    lines outside the file sections count for the files they name, or for every
+    source file when they name none. src/lib.rs also changes with the set of
+    source modules it declares.
+    """
+    changed = {f for f in new_files if f not in old_files}
+    src_files = [f for f in new_files if f.startswith('src/')]
+    if set(src_files) != {f for f in old_files if f.startswith('src/')}:
+        changed.add('src/lib.rs')
+
+    old_sections, new_sections = design_sections(old_design), design_sections(new_design)
+    changed.update(f for f in new_files if old_sections.get(f) != new_sections.get(f))
+
+    def other_lines(markdown):
+        lines = markdown.splitlines()
+        in_sections = set()
+        for _, start, end in _file_sections(lines):
+            in_sections.update(range(start, len(lines) if end is None else end))
+        # Headings alone don't change anything, the lines under them do
+        return [_line_key(line) for index, line in enumerate(lines)
+                if index not in in_sections and not HEADING.match(line)]
+
+    old_lines, new_lines = other_lines(old_design), other_lines(new_design)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        for line in old_lines[old_start:old_end] + new_lines[new_start:new_end]:
+            named = {_normalize(path.lstrip('./')) for path in RS_PATH.findall(line)}
+            if named:
+                changed.update(named)
+            elif line:
+                changed.update(src_files)
+
+    return [f for f in new_files if f in changed]
+
+
+class DesignStreamParser:
+    """
+    parse_design_document() for a design document that is still streaming in.
+
+    feed() takes the streamed text and returns True when it completed lines.
+    The document is parsed again, with an open fenced block taken as closed,
+    only when one of these lines can change the result: a fence, a heading, a
+    line naming a Rust file or the project, or a line of a tree listing. Files
+    of a tree listing are found as they are written. project_name, src_files,
+    test_files and confidence are those of the lines seen so far, and `text`
+    holds these lines.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pending = ""
+        self._last_line = ""
+        self._in_fence = False
+        self._tree_block = False
+        self._sections = []
+        self.project_name = None
+        self.src_files = []
+        self.test_files = []
+        self.confidence = 0.0
+
+    def feed(self, delta):
+        self._pending += delta
+        if '\n' not in delta:
+            return False
+        lines, _, self._pending = self._pending.rpartition('\n')
+        self.text += lines + '\n'
+        parse, sections = False, False
+        for line in lines.split('\n'):
+            changes_parse, changes_sections = self._scan(line)
+            parse, sections = parse or changes_parse, sections or changes_sections
+        if sections:
+            self._sections = list(_file_sections(self.text.splitlines()))
+        if parse:
+            self._parse()
+        return True
+
+    def close(self):
+        """
+        Parses the last line, once the document is over.
+        """
+        self.text += self._pending
+        self._pending = ""
+        self._sections = list(_file_sections(self.text.splitlines()))
+        self._parse()
+
+    def _scan(self, line):
+        """
+        Whether a completed line can change the parse result and the file sections.
+        """
+        previous, self._last_line = self._last_line, line
+        if line.lstrip().startswith('```'):
+            self._in_fence = not self._in_fence
+            self._tree_block = False
+            return True, True
+        if HEADING.match(line):
+            return True, True
+        if self._in_fence and not self._tree_block:
+            self._tree_block = any(marker in line for marker in TREE_MARKERS)
+        return (
+            # Once a block is a tree listing, each line can add a folder or a file
+            (self._in_fence and self._tree_block)
+            or RS_PATH.search(line) is not None
+            or CARGO_NAME.match(line) is not None
+            or LABELLED_NAME.search(f"{previous}\n{line}") is not None
+        ), False
+
+    def _parse(self):
+        self.project_name, self.src_files, self.test_files, self.confidence = \
+            parse_design_document(_close_fence(self.text))
+
+    def file_list(self):
+        """
+        The files to generate found so far, ordered like order_design_files().
+        """
+        return order_design_files(self.src_files, self.test_files) if self.src_files else []
+
+    def section_complete(self, file_path):
+        """
+        Whether a section of the design about file_path was written and a later
+        heading closed it.
+        """
+        return any(file_path in paths and end is not None for paths, _, end in self._sections)
@@ -0,0 +1,195 @@
+import logging
+import time
+
+from openai import AsyncAssistantEventHandler
+from typing_extensions import override
+
+import tracing
+from design_parser import DesignStreamParser
+from fence_scanner import CodeFenceScanner
+from stream_recorder import recorder_for
+
+
+# Define the EventHandler class to handle streaming from assistants. Callbacks
+# run on the event loop, publishing goes through an AsyncPublisher.
+class AsyncEventHandler(AsyncAssistantEventHandler):
+    def __init__(self, pusher_client, thread_id, channel_id, event_type, is_code_generation=False, stage=None):
+        super().__init__()
+        self.pusher_client = pusher_client
+        self.thread_id = thread_id
+        self.channel_id = channel_id
+        self.event_type = event_type
+        self._response_parts = []
+        self.message_in_progress = False
+        self.generate_contract_called = False
+        self.is_code_generation = is_code_generation
+        self.fence_scanner = CodeFenceScanner()
+        # Latency of the run, reported as a span named after the stage when the stream ends
+        self.stage = stage or event_type
+        self.current_file_path = None
+        self._started_at = time.time()
+        self._started = time.perf_counter()
+        self._first_token = None
+        self._last_token = None
+        self._delta_count = 0
+        self._completion_tokens = None
+        self._run_status = None
+        # Id of the run once created, token usage and, when it failed, its last_error
+        self.run_id = None
+        self.usage = None
+        self.run_error = None
+        self.recorder = recorder_for(self.stage, thread_id)
+
+    @override
+    async def on_event(self, event):
+        if self.recorder is not None:
+            self.recorder.record(event)
+        # The base handler has no hook for created, completed or failed runs
+        if event.event == 'thread.run.created':
+            self.run_id = event.data.id
+        elif event.event == 'thread.run.completed':
+            await self.on_run_completed(event.data)
+        elif event.event == 'thread.run.failed':
+            self.on_run_failed(event.data)
+
+    @property
+    def run_in_progress(self):
+        return self.run_id is not None and self._run_status is None
+
+    @property
+    def full_response(self):
+        return "".join(self._response_parts)
+
+    @full_response.setter
+    def full_response(self, value):
+        self._response_parts = [value] if value else []
+
+    @override
+    async def on_text_created(self, text):
+        if self._first_token is None:
+            self._first_token = time.perf_counter()
+        self.message_in_progress = True
+        self.full_response = ""
+        logging.info(f"Starting new message in channel {self.channel_id}")
+        print(f"\n--- Starting new {self.event_type} ---")
+        await self.pusher_client.trigger(self.channel_id, self.event_type, {
+            'message_start': True,
+            'thread_id': self.thread_id,
+        })
+
+    @override
+    async def on_text_delta(self, delta, snapshot):
+        if self.message_in_progress:
+            self._last_token = time.perf_counter()
+            self._delta_count += 1
+            self._response_parts.append(delta.value)
+            if self.is_code_generation:
+                for code_content in self.fence_scanner.feed(delta.value):
+                    await self.pusher_client.trigger(self.channel_id, 'code-chunk', {
+                        'content': code_content,
+                        'filePath': self.current_file_path,
+                        'thread_id': self.thread_id,
+                    })
+            else:
+                # Handle non-code messages
+                await self.pusher_client.trigger(self.channel_id, self.event_type, {
+                    'message': delta.value,
+                    'thread_id': self.thread_id,
+                    'is_complete': False
+                })
+
+    @override
+    async def on_text_done(self, text):
+        self.message_in_progress = False
+        print(f"\n--- End of {self.event_type} ---\n")
+        logging.info(f"Message completed. Sending full response to channel {self.channel_id}")
+        # Send the complete message. Code was streamed as code-chunk events and is
+        # confirmed by the file's completion event, so it isn't sent again.
+        completion = {'thread_id': self.thread_id, 'is_complete': True}
+        if not self.is_code_generation:
+            completion['message'] = self.full_response  # Send the accumulated response
+        await self.pusher_client.trigger(self.channel_id, self.event_type, completion)
+        # Don't leave batched deltas behind once the message is over
+        await self.pusher_client.flush()
+
+    @override
+    async def on_tool_call_created(self, tool_call):
+        logging.info(f"Tool call created: {tool_call.type}")
+        if tool_call.type == 'function':
+            if hasattr(tool_call, 'function') and tool_call.function.name == 'generate_contract':
+                self.generate_contract_called = True
+                logging.info("Generate contract function called.")
+        elif tool_call.type == 'file_search':
+            # Handle file search tool call if needed
+            pass
+        # Add more conditions for other tool call types as necessary
+
+    async def on_run_completed(self, run):
+        logging.info(f"Run completed for thread {self.thread_id}")
+        self.run_completed = True
+        self._run_status = run.status
+        self.usage = run.usage
+        if run.usage is not None:
+            self._completion_tokens = run.usage.completion_tokens
+        await self.pusher_client.trigger(self.channel_id, self.event_type, {
+            'run_completed': True,
+            'thread_id': self.thread_id,
+        })
+        await self.pusher_client.flush()
+
+    def on_run_failed(self, run):
+        logging.error(f"Run failed for thread {self.thread_id}: {run.last_error}")
+        self._run_status = run.status
+        self.usage = run.usage
+        self.run_error = run.last_error
+
+    @override
+    async def on_end(self):
+        if self.recorder is not None:
+            self.recorder.close(file_path=self.current_file_path)
+        # Also reached for runs that are cancelled or fail, which never complete
+        duration = time.perf_counter() - self._started
+        metrics = {'total_duration': duration, 'deltas': self._delta_count}
+        if self._first_token is not None:
+            metrics['time_to_first_token'] = self._first_token - self._started
+            # Estimate from the streamed text when the run reports no usage
+            tokens = self._completion_tokens
+            if tokens is None:
+                tokens = len(self.full_response) / 4
+            streaming_time = (self._last_token or self._first_token) - self._first_token
+            if streaming_time > 0:
+                metrics['tokens_per_second'] = tokens / streaming_time
+            metrics['completion_tokens'] = tokens
+        tracing.record_span(
+            self.stage, self._started_at, duration, metrics=metrics,
+            thread_id=self.thread_id, channel_id=self.channel_id,
+            file_path=self.current_file_path, status=self._run_status or 'incomplete'
+        )
+
+
+# Event handler of designer runs, also parsing the design while it streams.
+# on_design(parser) is awaited whenever the parser completed lines.
+class DesignEventHandler(AsyncEventHandler):
+    def __init__(self, *args, on_design=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.design_parser = DesignStreamParser()
+        self.on_design = on_design
+
+    @override
+    async def on_text_created(self, text):
+        # Like full_response, the design is the run's last message
+        self.design_parser = DesignStreamParser()
+        await super().on_text_created(text)
+
+    @override
+    async def on_text_delta(self, delta, snapshot):
+        await super().on_text_delta(delta, snapshot)
+        if self.message_in_progress and self.design_parser.feed(delta.value) and self.on_design:
+            await self.on_design(self.design_parser)
+
+    @override
+    async def on_text_done(self, text):
+        self.design_parser.close()
+        if self.on_design:
+            await self.on_design(self.design_parser)
+        await super().on_text_done(text)
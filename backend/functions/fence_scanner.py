@@ -0,0 +1,66 @@
+FENCE = '```'
+
+
+class CodeFenceScanner:
+    """
+    Incrementally extracts the contents of ``` code blocks from streamed text.
+
+    Each feed() only looks at the new delta plus a carry-over of at most two
+    backticks, so a whole response is scanned in linear time. The chunks it
+    returns match what the original regex-over-buffer state machine sent as
+    code-chunk events: the language line after an opening fence is skipped,
+    text outside code blocks is ignored and trailing backticks inside a block
+    are held back until we know whether they close it.
+    """
+
+    def __init__(self):
+        self.state = 'normal'
+        self.carry = ''
+
+    def feed(self, delta):
+        text = self.carry + delta if self.carry else delta
+        self.carry = ''
+        chunks = []
+        pos = 0
+
+        while True:
+            if self.state == 'normal':
+                start = text.find(FENCE, pos)
+                if start == -1:
+                    # Keep up to two trailing backticks, they may begin the next fence
+                    tail = text[pos:]
+                    kept = len(tail) - len(tail.rstrip('`'))
+                    self.carry = tail[len(tail) - min(kept, 2):] if kept else ''
+                    break
+                pos = start + len(FENCE)
+                self.state = 'awaiting_language'
+
+            elif self.state == 'awaiting_language':
+                newline = text.find('\n', pos)
+                if newline == -1:
+                    # Still inside the language identifier, nothing to keep
+                    break
+                pos = newline + 1
+                self.state = 'in_code_block'
+
+            else:
+                end = text.find(FENCE, pos)
+                if end != -1:
+                    if end > pos:
+                        chunks.append(text[pos:end])
+                    pos = end + len(FENCE)
+                    self.state = 'normal'
+                    continue
+
+                tail = text[pos:]
+                code = tail.rstrip('`')
+                if code == tail and tail.endswith('\n') and tail[:-1].endswith('`'):
+                    # The original r'`+$' search also matched right before a final newline
+                    code = tail[:-1].rstrip('`')
+                # Hold back a partial closing delimiter
+                self.carry = tail[len(code):]
+                if code:
+                    chunks.append(code)
+                break
+
+        return chunks
@@ -0,0 +1,94 @@
+"""
+Framing of the events sent to the browser, read by frontend/my-app/src/framing.js.
+
+code-chunk events carry a sequence number per file build so the frontend can
+detect a lost chunk, and the completion event of a file carries the number and
+hash of the chunks sent instead of the file, which was already streamed.
+Payloads too large for the transport are split into numbered fragments.
+"""
+import hashlib
+import json
+import sys
+import uuid
+
+# Pusher rejects events with more than 10 KB of data, keep a margin
+DEFAULT_MAX_PAYLOAD_BYTES = 9000
+
+
+def payload_size(data):
+    """
+    Size of an event's data as the Pusher client checks it: sys.getsizeof of its
+    JSON string, which is above the UTF-8 length for non-ASCII text.
+    """
+    text = json.dumps(data, ensure_ascii=False)
+    return max(sys.getsizeof(text), len(text.encode('utf-8')))
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class _FileBuild:
+    def __init__(self):
+        self.seq = 0
+        self.hash = hashlib.sha256()
+
+
+class EventFramer:
+    """
+    Turns one event into the events to send. Must see the events of a channel
+    in the order they are sent.
+
+    The 'generating' status of a file starts its sequence at 0, every code-chunk
+    of the file gets the next seq and the 'complete' status gets `chunks` (the
+    number of chunks sent) and `contentHash` (sha256 of their concatenated
+    content). Data over max_payload_bytes, once encoded, is sent as events of
+    the same name with {'fragment': {'id', 'index', 'count'}, 'part'}, the
+    parts joined in index order being the JSON of the original data.
+    """
+
+    def __init__(self, max_payload_bytes=DEFAULT_MAX_PAYLOAD_BYTES):
+        self.max_payload_bytes = max_payload_bytes
+        self._builds = {}
+
+    def frame(self, channel, event_name, data):
+        file_path = data.get('filePath')
+        if event_name == 'code-chunk' and file_path:
+            build = self._builds.setdefault((channel, file_path), _FileBuild())
+            data = dict(data, seq=build.seq)
+            build.seq += 1
+            build.hash.update(data['content'].encode('utf-8'))
+        elif event_name == 'file-generation-status' and file_path:
+            if data.get('status') == 'generating':
+                self._builds[(channel, file_path)] = _FileBuild()
+            elif data.get('status') == 'complete':
+                build = self._builds.pop((channel, file_path), None) or _FileBuild()
+                data = dict(data, chunks=build.seq, contentHash=build.hash.hexdigest())
+
+        if self.max_payload_bytes is None or payload_size(data) <= self.max_payload_bytes:
+            return [(channel, event_name, data)]
+        return [(channel, event_name, fragment) for fragment in self.fragments(data)]
+
+    def fragments(self, data):
+        text = json.dumps(data, ensure_ascii=False)
+        fragment_id = uuid.uuid4().hex
+        parts = []
+        start = 0
+        while start < len(text):
+            length = len(text) - start
+            while True:
+                part = text[start:start + length]
+                # Index and count are sized for the worst case, they are known at the end
+                size = payload_size(self._fragment(fragment_id, len(text), len(text), part))
+                if size <= self.max_payload_bytes:
+                    break
+                if length == 1:
+                    raise ValueError(f"max_payload_bytes={self.max_payload_bytes} can't fit a fragment")
+                length = max(1, min(length - 1, length * self.max_payload_bytes // size))
+            parts.append(part)
+            start += length
+        return [self._fragment(fragment_id, index, len(parts), part) for index, part in enumerate(parts)]
+
+    @staticmethod
+    def _fragment(fragment_id, index, count, part):
+        return {'fragment': {'id': fragment_id, 'index': index, 'count': count}, 'part': part}
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_design(designer_output):
+    """
+    Normalizes formatting noise that doesn't change the design: line endings,
+    trailing spaces and runs of blank lines.
+    """
+    text = designer_output.replace('\r\n', '\n').replace('\r', '\n')
+    text = '\n'.join(line.rstrip() for line in text.split('\n'))
+    return re.sub(r'\n{3,}', '\n\n', text).strip()
+
+
+def generation_cache_key(designer_output, assistant_ids, version=''):
+    payload = json.dumps({
+        'design': normalize_design(designer_output),
+        'assistants': list(assistant_ids),
+        'version': version,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class InMemoryGenerationCache:
+    """
+    LRU cache of generation results with a TTL, an entry limit and a size limit.
+    """
+
+    def __init__(self, ttl=7 * 24 * 3600, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, size = item
+            if time.time() - entry['created_at'] > self.ttl:
+                del self._entries[key]
+                self._bytes -= size
+                return None
+            self._entries.move_to_end(key)
+            return json.loads(json.dumps(entry))
+
+    def set(self, key, entry):
+        entry = dict(entry, created_at=time.time())
+        size = len(json.dumps(entry).encode('utf-8'))
+        if size > self.max_bytes:
+            logging.info(f"Generation result too large to cache ({size} bytes)")
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (entry, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+
+class DiskGenerationCache:
+    """
+    Generation results stored as one JSON file per key in a local directory.
+
+    Access time is tracked through the file mtime, which is used for LRU eviction
+    once the entry or size limit is exceeded.
+    """
+
+    def __init__(self, directory, ttl=7 * 24 * 3600, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('created_at', 0) > self.ttl:
+            self._remove(path)
+            return None
+        os.utime(path)
+        return entry
+
+    def set(self, key, entry):
+        entry = dict(entry, created_at=time.time())
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        with self._lock:
+            files = []
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            files.sort()
+            count = len(files)
+            total = sum(size for _, size, _ in files)
+            now = time.time()
+            # Oldest first: drop expired entries and whatever exceeds the limits
+            for mtime, size, path in files:
+                expired = now - mtime > self.ttl
+                if not expired and count <= self.max_entries and total <= self.max_bytes:
+                    continue
+                self._remove(path)
+                count -= 1
+                total -= size
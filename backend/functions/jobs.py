@@ -0,0 +1,177 @@
+import copy
+import datetime
+import logging
+import queue
+import threading
+import uuid
+
+JOB_STATES = ('queued', 'designing', 'building', 'saving', 'done', 'failed')
+FINAL_STATES = ('done', 'failed')
+
+
+def new_job(**fields):
+    now = datetime.datetime.now()
+    job = {
+        'job_id': str(uuid.uuid4()),
+        'state': 'queued',
+        'created_at': now,
+        'updated_at': now,
+        'contract_id': None,
+        'error': None,
+    }
+    job.update(fields)
+    return job
+
+
+def is_stale(job, max_age):
+    """
+    Whether an unfinished job hasn't been updated for max_age seconds, as when
+    the instance running it was recycled or timed out.
+    """
+    if job['state'] in FINAL_STATES or job.get('updated_at') is None:
+        return False
+    updated_at = job['updated_at']
+    # Firestore gives back timezone-aware datetimes
+    now = datetime.datetime.now(updated_at.tzinfo)
+    return (now - updated_at).total_seconds() > max_age
+
+
+class InMemoryJobStore:
+    """
+    Keeps job records in process memory. Used for local runs and tests.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job['job_id']] = copy.deepcopy(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job else None
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+
+class FirestoreJobStore:
+    """
+    Keeps job records in Firestore so any function instance can report their status.
+    """
+
+    def __init__(self, db, collection='generation_jobs'):
+        self.db = db
+        self.collection = collection
+
+    def create(self, job):
+        self.db.collection(self.collection).document(job['job_id']).set(job)
+
+    def get(self, job_id):
+        snapshot = self.db.collection(self.collection).document(job_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+
+    def update(self, job_id, **fields):
+        self.db.collection(self.collection).document(job_id).set(fields, merge=True)
+
+
+class InMemoryJobQueue:
+    """
+    Queue backend holding job ids for the local worker pool.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+
+    def enqueue(self, job_id):
+        self._queue.put(job_id)
+
+    def dequeue(self, timeout=None):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def task_done(self):
+        self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+
+class JobManager:
+    """
+    Creates job records, queues them and runs them on a pool of worker threads.
+
+    handler(job) receives the job record and returns the fields to store once it
+    finishes (typically contract_id). It can move the job through the intermediate
+    states with set_state(). A job the handler leaves unfinished is marked done,
+    and one that raises is marked failed.
+    """
+
+    def __init__(self, store, job_queue, handler, max_workers=2):
+        self.store = store
+        self.queue = job_queue
+        self.handler = handler
+        self.max_workers = max_workers
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def submit(self, **fields):
+        job = new_job(**fields)
+        self.store.create(job)
+        self._ensure_workers()
+        self.queue.enqueue(job['job_id'])
+        logging.info(f"Queued job {job['job_id']}")
+        return job['job_id']
+
+    def resubmit(self, job_id, **fields):
+        self.set_state(job_id, 'queued', error=None, **fields)
+        self._ensure_workers()
+        self.queue.enqueue(job_id)
+        logging.info(f"Requeued job {job_id}")
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def set_state(self, job_id, state, **fields):
+        if job_id is None:
+            return
+        if state not in JOB_STATES:
+            raise ValueError(f"Unknown job state: {state}")
+        self.store.update(job_id, state=state, updated_at=datetime.datetime.now(), **fields)
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._workers = [w for w in self._workers if w.is_alive()]
+            while len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work, name=f'job-worker-{len(self._workers)}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            job_id = self.queue.dequeue()
+            if job_id is None:
+                continue
+            try:
+                self.run(job_id)
+            finally:
+                self.queue.task_done()
+
+    def run(self, job_id):
+        job = self.store.get(job_id)
+        if job is None:
+            logging.error(f"Job {job_id} not found")
+            return
+        try:
+            result = self.handler(job) or {}
+            if self.store.get(job_id)['state'] not in FINAL_STATES:
+                self.set_state(job_id, 'done', **result)
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {str(e)}")
+            self.set_state(job_id, 'failed', error=str(e))
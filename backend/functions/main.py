@@ -1,22 +1,39 @@
 # Backend code with fixes applied
 
 from firebase_functions import https_fn
-from firebase_admin import initialize_app
-import functions_framework
 from flask import jsonify
-from openai import OpenAI, AssistantEventHandler
-from typing_extensions import override
 import os
-import pusher
+import asyncio
 import logging
-from threading import Thread
+import threading
 import json
-import re
-import firebase_admin
-from firebase_admin import initialize_app, credentials, firestore
 import datetime
 import uuid
-from flask import make_response
+import hashlib
+import functools
+import atexit
+from collections import OrderedDict
+from flask import make_response, Response
+from publisher import BatchingPublisher, PublishQueue, AsyncPublisher
+from aio import EventLoopThread
+from framing import EventFramer
+from realtime import PusherTransport, SSETransport, format_sse, sse_events
+from rate_limits import (UpstreamLimiter, TokenBucket, RateLimitedError, INTERACTIVE, priority,
+                         retry_async, parse_retry_after, retry_after_from_headers)
+from fence_scanner import CodeFenceScanner
+from scheduler import build_dependency_graph, dependents_of, run_dag
+from build_context import build_file_context
+from cargo_template import generate_cargo_toml, CARGO_TEMPLATE_VERSION
+from design_parser import parse_design_document, order_design_files, changed_design_files
+from speculation import SpeculativePlanner
+from generation_cache import generation_cache_key, InMemoryGenerationCache, DiskGenerationCache
+from contract_store import save_contract, update_contract, load_contract_metadata, iter_contract_files
+from memory_firestore import MemoryFirestore
+from checkpoints import GenerationCheckpoint
+from sharded_counter import ShardedCounter, BufferedCounter
+from thread_pool import ThreadPool
+from jobs import JobManager, InMemoryJobStore, FirestoreJobStore, InMemoryJobQueue, is_stale
+import tracing
 
 
 OPEN_AI_KEY=os.getenv("OPEN_AI_KEY")
@@ -28,22 +45,266 @@ ASSISTANT_DESIGNER_ID=os.getenv("ASSISTANT_DESIGNER_ID")
 ASSISTANT_BUILDER_ID=os.getenv("ASSISTANT_BUILDER_ID")
 ASSISTANT_TEST_BUILDER_ID=os.getenv("ASSISTANT_TEST_BUILDER_ID")
 ASSISTANT_DOCUMENTATION_ID=os.getenv("ASSISTANT_DOCUMENTATION_ID")
+PUSHER_BATCH_WINDOW_MS=int(os.getenv("PUSHER_BATCH_WINDOW_MS", "50"))
+PUSHER_BATCH_MAX_BYTES=int(os.getenv("PUSHER_BATCH_MAX_BYTES", "8192"))
+PUBLISH_QUEUE_MAX_SIZE=int(os.getenv("PUBLISH_QUEUE_MAX_SIZE", "1000"))
+PUBLISH_QUEUE_POLICY=os.getenv("PUBLISH_QUEUE_POLICY", "drop-oldest")
+PUBLISH_DRAIN_TIMEOUT=float(os.getenv("PUBLISH_DRAIN_TIMEOUT", "30"))
+PUBLISH_WORKERS=int(os.getenv("PUBLISH_WORKERS", "4"))
+GENERATION_MAX_WORKERS=int(os.getenv("GENERATION_MAX_WORKERS", "4"))
+JOB_STORE=os.getenv("JOB_STORE", "firestore")
+JOB_WORKERS=int(os.getenv("JOB_WORKERS", "2"))
+JOB_STALE_AFTER=float(os.getenv("JOB_STALE_AFTER", "900"))
+DESIGN_PARSER_MIN_CONFIDENCE=float(os.getenv("DESIGN_PARSER_MIN_CONFIDENCE", "0.7"))
+FILE_NAMES_CACHE_SIZE=int(os.getenv("FILE_NAMES_CACHE_SIZE", "128"))
+GENERATION_CACHE_BACKEND=os.getenv("GENERATION_CACHE_BACKEND", "memory")
+GENERATION_CACHE_DIR=os.getenv("GENERATION_CACHE_DIR", "/tmp/generation_cache")
+GENERATION_CACHE_TTL=int(os.getenv("GENERATION_CACHE_TTL", str(7 * 24 * 3600)))
+GENERATION_CACHE_MAX_ENTRIES=int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "256"))
+GENERATION_CACHE_MAX_BYTES=int(os.getenv("GENERATION_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+GENERATION_CACHE_VERSION=os.getenv("GENERATION_CACHE_VERSION", "1")
+CONTRACT_COMPRESS_THRESHOLD=int(os.getenv("CONTRACT_COMPRESS_THRESHOLD", "4096"))
+FIRESTORE_BACKEND=os.getenv("FIRESTORE_BACKEND", "firestore")
+ANALYTICS_SHARDS=int(os.getenv("ANALYTICS_SHARDS", "10"))
+ANALYTICS_FLUSH_INTERVAL=float(os.getenv("ANALYTICS_FLUSH_INTERVAL", "0"))
+CONTEXT_TOKEN_BUDGET=int(os.getenv("CONTEXT_TOKEN_BUDGET", "16000"))
+SOROBAN_SDK_VERSION=os.getenv("SOROBAN_SDK_VERSION", "21.7.6")
+OPENAI_MAX_CONNECTIONS=int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE=int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+OPENAI_KEEPALIVE_EXPIRY=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))
+OPENAI_CONNECT_TIMEOUT=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT=float(os.getenv("OPENAI_READ_TIMEOUT", "600"))
+OPENAI_HTTP2=os.getenv("OPENAI_HTTP2", "false").lower() == "true"
+PUSHER_POOL_MAXSIZE=int(os.getenv("PUSHER_POOL_MAXSIZE", "10"))
+PUSHER_MAX_RETRIES=int(os.getenv("PUSHER_MAX_RETRIES", "2"))
+PUSHER_TIMEOUT=float(os.getenv("PUSHER_TIMEOUT", "5"))
+REALTIME_TRANSPORT=os.getenv("REALTIME_TRANSPORT", "pusher")
+SSE_CHANNEL_TTL=float(os.getenv("SSE_CHANNEL_TTL", "600"))
+SSE_POLL_INTERVAL=float(os.getenv("SSE_POLL_INTERVAL", "0.1"))
+SSE_BATCH_SIZE=int(os.getenv("SSE_BATCH_SIZE", "100"))
+SSE_HEARTBEAT_INTERVAL=float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+SSE_IDLE_TIMEOUT=float(os.getenv("SSE_IDLE_TIMEOUT", "300"))
+EVENT_MAX_PAYLOAD_BYTES=int(os.getenv("EVENT_MAX_PAYLOAD_BYTES", "9000"))
+OPENAI_MAX_RETRIES=int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_REQUESTS_PER_MINUTE=int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "0"))
+OPENAI_TOKENS_PER_MINUTE=int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "0"))
+PUSHER_MESSAGES_PER_SECOND=float(os.getenv("PUSHER_MESSAGES_PER_SECOND", "0"))
+RATE_LIMIT_MAX_ATTEMPTS=int(os.getenv("RATE_LIMIT_MAX_ATTEMPTS", "4"))
+RATE_LIMIT_BACKOFF_BASE=float(os.getenv("RATE_LIMIT_BACKOFF_BASE", "0.5"))
+RATE_LIMIT_BACKOFF_CAP=float(os.getenv("RATE_LIMIT_BACKOFF_CAP", "30"))
+SPECULATIVE_BUILD=os.getenv("SPECULATIVE_BUILD", "true").lower() == "true"
+OPENAI_THREAD_POOL_SIZE=int(os.getenv("OPENAI_THREAD_POOL_SIZE", "4"))
+OPENAI_THREAD_MAX_AGE=float(os.getenv("OPENAI_THREAD_MAX_AGE", "3600"))
 
-# Initialize OpenAI client
-client = OpenAI(api_key=OPEN_AI_KEY)
-cred = credentials.Certificate("key.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# Clients are created on first use and shared across requests, so importing
+# this module (cold starts, preflight requests) doesn't pay for them
+_clients = {}
+_clients_lock = threading.RLock()
 
+def _get_or_create(name, factory):
+    instance = _clients.get(name)
+    if instance is None:
+        with _clients_lock:
+            instance = _clients.get(name)
+            if instance is None:
+                instance = factory()
+                _clients[name] = instance
+    return instance
+
+# Every HTTP request to OpenAI is counted on the spans of the request making it
+async def count_openai_round_trip(request):
+    tracing.count('openai_round_trips')
+
+# OpenAI calls of the instance share the organization's rate limits (0 for none),
+# chat turns going first
+def get_openai_limiter():
+    return _get_or_create('openai_limiter', lambda: UpstreamLimiter('openai', {
+        'requests': TokenBucket.per_minute(OPENAI_REQUESTS_PER_MINUTE),
+        'tokens': TokenBucket.per_minute(OPENAI_TOKENS_PER_MINUTE),
+    }))
+
+# Every HTTP request to OpenAI waits for its turn. Runs and completions also wait
+# until the tokens used by earlier ones, charged when they end, are paid back.
+async def limit_openai_request(request):
+    costs = {'requests': 1}
+    if request.method == 'POST' and request.url.path.endswith(('/runs', '/chat/completions')):
+        costs['tokens'] = 1
+    await get_openai_limiter().acquire(**costs)
+
+# A 429 holds every OpenAI call of the instance for its Retry-After
+async def pause_on_rate_limit(response):
+    if response.status_code == 429:
+        get_openai_limiter().pause(retry_after_from_headers(response.headers) or RATE_LIMIT_BACKOFF_BASE)
+
+def charge_openai_usage(usage):
+    if usage is not None and usage.total_tokens:
+        get_openai_limiter().charge(tokens=usage.total_tokens)
+        tracing.count('openai_tokens', usage.total_tokens)
+
+def rate_limit_stats():
+    return {'openai': get_openai_limiter().stats()}
+
+# Connection reuse of the pooled transports, by service ('openai', 'pusher')
+def get_transport_metrics(service):
+    def create():
+        from transport import TransportMetrics
+        return TransportMetrics()
+    return _get_or_create(f'{service}_transport_metrics', create)
+
+def transport_stats():
+    return {
+        name[:-len('_transport_metrics')]: metrics.snapshot()
+        for name, metrics in list(_clients.items())
+        if name.endswith('_transport_metrics')
+    }
+
+# Initialize OpenAI client. It is async and bound to the shared event loop.
+def get_openai_client():
+    def create():
+        from openai import AsyncOpenAI
+        from transport import create_openai_http_client
+        return AsyncOpenAI(
+            api_key=OPEN_AI_KEY,
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=create_openai_http_client(
+                get_transport_metrics('openai'),
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive=OPENAI_MAX_KEEPALIVE,
+                keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+                connect_timeout=OPENAI_CONNECT_TIMEOUT,
+                read_timeout=OPENAI_READ_TIMEOUT,
+                http2=OPENAI_HTTP2,
+                request_hooks=[count_openai_round_trip, limit_openai_request],
+                response_hooks=[pause_on_rate_limit]
+            )
+        )
+    return _get_or_create('openai', create)
+
+def get_db():
+    def create():
+        if FIRESTORE_BACKEND == 'memory':
+            # Local runs and tests without Firebase credentials
+            return MemoryFirestore()
+        import firebase_admin
+        from firebase_admin import credentials, firestore
+        cred = credentials.Certificate("key.json")
+        firebase_admin.initialize_app(cred)
+        return firestore.client()
+    return _get_or_create('db', create)
 
 # Initialize Pusher client
-pusher_client = pusher.Pusher(
-  app_id=PUSHER_APP_ID,
-  key=PUSHER_KEY,
-  secret=PUSHER_SECRET,
-  cluster='eu',
-  ssl=True
-)
+def get_pusher_client():
+    def create():
+        import pusher
+        from transport import PooledRequestsBackend, create_pusher_session
+        return pusher.Pusher(
+          app_id=PUSHER_APP_ID,
+          key=PUSHER_KEY,
+          secret=PUSHER_SECRET,
+          cluster='eu',
+          ssl=True,
+          timeout=PUSHER_TIMEOUT,
+          # Keep-alive connections shared by every publish of the instance
+          backend=PooledRequestsBackend,
+          session=create_pusher_session(pool_maxsize=PUSHER_POOL_MAXSIZE, max_retries=PUSHER_MAX_RETRIES),
+          metrics=get_transport_metrics('pusher')
+        )
+    return _get_or_create('pusher', create)
+
+# Transport delivering channel events to the browser: Pusher, or Server-Sent
+# Events (REALTIME_TRANSPORT=sse) relayed through Firestore, so any instance
+# streams the events published by any other
+def get_realtime_transport():
+    def create():
+        if REALTIME_TRANSPORT == 'sse':
+            return SSETransport(
+                get_db(),
+                channel_ttl=SSE_CHANNEL_TTL,
+                poll_interval=SSE_POLL_INTERVAL,
+                batch_size=SSE_BATCH_SIZE
+            )
+        return PusherTransport(get_pusher_client())
+    return _get_or_create('realtime', create)
+
+# Publish from a background worker so the OpenAI stream never waits on the transport
+def get_publish_queue():
+    return _get_or_create('publish_queue', lambda: PublishQueue(
+        get_realtime_transport(),
+        max_size=PUBLISH_QUEUE_MAX_SIZE,
+        policy=PUBLISH_QUEUE_POLICY,
+        rate_limit=TokenBucket(PUSHER_MESSAGES_PER_SECOND) if PUSHER_MESSAGES_PER_SECOND and REALTIME_TRANSPORT != 'sse' else None,
+        max_attempts=RATE_LIMIT_MAX_ATTEMPTS,
+        workers=PUBLISH_WORKERS
+    ))
+
+# Coalesce streamed deltas into batched Pusher calls, sequencing code chunks and
+# splitting payloads over Pusher's size limit (SSE has none)
+def get_publisher():
+    return _get_or_create('publisher', lambda: BatchingPublisher(
+        get_publish_queue(),
+        window_ms=PUSHER_BATCH_WINDOW_MS,
+        max_bytes=PUSHER_BATCH_MAX_BYTES,
+        framer=EventFramer(None if REALTIME_TRANSPORT == 'sse' else EVENT_MAX_PAYLOAD_BYTES)
+    ))
+
+# Publisher for the coroutines running on the event loop
+def get_async_publisher():
+    return _get_or_create('async_publisher', lambda: AsyncPublisher(get_publisher()))
+
+# Empty threads created ahead of time for new chats and file builds, used on the
+# shared event loop. It starts filling on first use, or once a chat is answered.
+def get_thread_pool():
+    return _get_or_create('thread_pool', lambda: ThreadPool(
+        get_openai_client(), size=OPENAI_THREAD_POOL_SIZE, max_age=OPENAI_THREAD_MAX_AGE
+    ))
+
+# Event loop shared by every request, so concurrent sessions are multiplexed on
+# one thread and one OpenAI connection pool
+def get_event_loop():
+    return _get_or_create('event_loop', lambda: EventLoopThread())
+
+# Run a coroutine on the shared event loop and wait for its result
+def run_async(coro):
+    return get_event_loop().run(coro)
+
+# Update a job's state without blocking the event loop on the job store
+async def set_job_state(job_id, state, **fields):
+    if job_id is not None:
+        await asyncio.to_thread(get_job_manager().set_state, job_id, state, **fields)
+
+# Sharded analytics/contract_generation counters, optionally buffered in process
+def get_analytics_counter():
+    def create():
+        counter = ShardedCounter(get_db(), 'analytics', 'contract_generation', num_shards=ANALYTICS_SHARDS)
+        if ANALYTICS_FLUSH_INTERVAL > 0:
+            counter = BufferedCounter(counter, flush_interval=ANALYTICS_FLUSH_INTERVAL)
+            atexit.register(counter.flush)
+        return counter
+    return _get_or_create('analytics_counter', create)
+
+# Cache of full generation results, keyed on the normalized design, or None
+# with GENERATION_CACHE_BACKEND=none
+def get_generation_cache():
+    def create():
+        if GENERATION_CACHE_BACKEND == 'disk':
+            return DiskGenerationCache(
+                GENERATION_CACHE_DIR,
+                ttl=GENERATION_CACHE_TTL,
+                max_entries=GENERATION_CACHE_MAX_ENTRIES,
+                max_bytes=GENERATION_CACHE_MAX_BYTES
+            )
+        return InMemoryGenerationCache(
+            ttl=GENERATION_CACHE_TTL,
+            max_entries=GENERATION_CACHE_MAX_ENTRIES,
+            max_bytes=GENERATION_CACHE_MAX_BYTES
+        )
+    if GENERATION_CACHE_BACKEND not in ('disk', 'memory'):
+        return None
+    return _get_or_create('generation_cache', create)
+
+# Memoized extract_file_names results, keyed by a hash of the designer output
+file_names_cache = OrderedDict()
+file_names_cache_lock = threading.Lock()
 
 # Define the generate_contract function schema for function calling
 generate_contract_function = {
@@ -51,184 +312,232 @@ generate_contract_function = {
     "description": "Initiate the contract generation process when all information has been gathered.",
     "parameters": {
         "type": "object",
-        "properties": {},
-        "required": [],
+        "properties": {
+            "edit_contract": {
+                "type": "boolean",
+                "description": "True only when the user asks to change the contract already generated in this "
+                               "chat, false when they want a new contract."
+            }
+        },
+        "required": ["edit_contract"],
         "additionalProperties": False,
     },
     "strict": True
 }
 
-# Define the EventHandler class to handle streaming from assistants
-class EventHandler(AssistantEventHandler):
-    def __init__(self, pusher_client, thread_id, channel_id, event_type, is_code_generation=False):
-        super().__init__()
-        self.pusher_client = pusher_client
-        self.thread_id = thread_id
-        self.channel_id = channel_id
-        self.event_type = event_type
-        self.full_response = ""
-        self.message_in_progress = False
-        self.generate_contract_called = False
-        self.is_code_generation = is_code_generation
-        self.buffer = ""
-        self.state = 'normal'
-
-    @override
-    def on_text_created(self, text):
-        self.message_in_progress = True
-        self.full_response = ""
-        logging.info(f"Starting new message in channel {self.channel_id}")
-        print(f"\n--- Starting new {self.event_type} ---")
-        self.pusher_client.trigger(self.channel_id, self.event_type, {
-            'message_start': True,
-            'thread_id': self.thread_id,
-        })
+# Function streaming an assistant run to a new event handler and returning the
+# handler. process_events, when given, consumes the stream's events. A run
+# failed on a rate limit before streaming any text is started again after a
+# jittered backoff honouring Retry-After (a refused run request is already
+# retried by the client, up to OPENAI_MAX_RETRIES times). A run whose task is
+# cancelled (a discarded speculative build) is cancelled too.
+async def stream_run(make_event_handler, process_events=None, **run_params):
+    params = dict(run_params)
 
-    @override
-    def on_text_delta(self, delta, snapshot):
-        if self.message_in_progress:
-            self.full_response += delta.value
-            if self.is_code_generation:
-                self.buffer += delta.value
-
-                while True:
-                    if self.state == 'normal':
-                        # Look for the start of a code block
-                        start_match = re.search(r'```', self.buffer)
-                        if start_match:
-                            # Transition to awaiting_language state
-                            self.state = 'awaiting_language'
-                            # Remove everything before and including the '```'
-                            self.buffer = self.buffer[start_match.end():]
-                        else:
-                            # No code block start found; exit the loop
-                            break
-
-                    elif self.state == 'awaiting_language':
-                        # Check if there's a newline indicating the end of the language identifier
-                        newline_index = self.buffer.find('\n')
-                        if newline_index != -1:
-                            # Potentially have a language identifier; skip it
-                            # Remove the language identifier and the newline
-                            self.buffer = self.buffer[newline_index+1:]
-                            # Transition to in_code_block state
-                            self.state = 'in_code_block'
-                        else:
-                            # Wait for more data to determine if there's a language identifier
-                            break
-
-                    elif self.state == 'in_code_block':
-                        # Look for the end of the code block
-                        end_match = re.search(r'```', self.buffer)
-                        if end_match:
-                            # Found the end of the code block
-                            code_content = self.buffer[:end_match.start()]
-                            if code_content:
-                                self.pusher_client.trigger(self.channel_id, 'code-chunk', {
-                                    'content': code_content,
-                                    'filePath': self.current_file_path,
-                                    'thread_id': self.thread_id,
-                                })
-                            # Remove the processed code and the closing delimiter
-                            self.buffer = self.buffer[end_match.end():]
-                            # Transition back to normal state
-                            self.state = 'normal'
-                        elif self.buffer.endswith('```'):
-                            # Handle case where '```' is at the end of the buffer
-                            code_content = self.buffer[:-3]
-                            if code_content:
-                                self.pusher_client.trigger(self.channel_id, 'code-chunk', {
-                                    'content': code_content,
-                                    'filePath': self.current_file_path,
-                                    'thread_id': self.thread_id,
-                                })
-                            # Remove '```' from buffer
-                            self.buffer = ''
-                            self.state = 'normal'
-                        else:
-                            # No end delimiter found yet; send the buffer as code content
-                            if self.buffer:
-                                # Before sending, ensure we don't include partial '```' at the end
-                                # Check for partial delimiter at the end
-                                partial_delimiter_match = re.search(r'`+$', self.buffer)
-                                if partial_delimiter_match:
-                                    # Exclude the partial delimiter from code content
-                                    code_content = self.buffer[:partial_delimiter_match.start()]
-                                    # Keep the partial delimiter in the buffer
-                                    self.buffer = self.buffer[partial_delimiter_match.start():]
-                                else:
-                                    code_content = self.buffer
-                                    self.buffer = ''
-
-                                if code_content:
-                                    self.pusher_client.trigger(self.channel_id, 'code-chunk', {
-                                        'content': code_content,
-                                        'filePath': self.current_file_path,
-                                        'thread_id': self.thread_id,
-                                    })
-                            # Break to wait for more data
-                            break
-            else:
-                # Handle non-code messages
-                self.pusher_client.trigger(self.channel_id, self.event_type, {
-                    'message': delta.value,
-                    'thread_id': self.thread_id,
-                    'is_complete': False
-                })
-
-    @override
-    def on_text_done(self, text):
-        self.message_in_progress = False
-        print(f"\n--- End of {self.event_type} ---\n")
-        logging.info(f"Message completed. Sending full response to channel {self.channel_id}")
-        # Send the complete message
-        self.pusher_client.trigger(self.channel_id, self.event_type, {
-            'message': self.full_response,  # Send the accumulated response
-            'thread_id': self.thread_id,
-            'is_complete': True
-        })
+    async def attempt():
+        event_handler = make_event_handler()
+        try:
+            async with get_openai_client().beta.threads.runs.stream(event_handler=event_handler, **params) as stream:
+                if process_events is not None:
+                    await process_events(stream)
+                else:
+                    await stream.until_done()
+        except asyncio.CancelledError:
+            await cancel_run_async(params['thread_id'], event_handler)
+            raise
+        charge_openai_usage(event_handler.usage)
+        error = event_handler.run_error
+        if error is not None and error.code == 'rate_limit_exceeded' and not event_handler.full_response:
+            # The failed run already added its messages to the thread
+            params.pop('additional_messages', None)
+            raise RateLimitedError(error.message, retry_after=parse_retry_after(error.message))
+        return event_handler
 
-    @override
-    def on_tool_call_created(self, tool_call):
-        logging.info(f"Tool call created: {tool_call.type}")
-        if tool_call.type == 'function':
-            if hasattr(tool_call, 'function') and tool_call.function.name == 'generate_contract':
-                self.generate_contract_called = True
-                logging.info("Generate contract function called.")
-        elif tool_call.type == 'file_search':
-            # Handle file search tool call if needed
-            pass
-        # Add more conditions for other tool call types as necessary
-
-    @override
-    def on_run_completed(self, run):
-        logging.info(f"Run completed for thread {self.thread_id}")
-        self.run_completed = True
-        self.pusher_client.trigger(self.channel_id, self.event_type, {
-            'run_completed': True,
-            'thread_id': self.thread_id,
-        })
+    return await retry_async(
+        attempt, (RateLimitedError,),
+        max_attempts=RATE_LIMIT_MAX_ATTEMPTS,
+        base=RATE_LIMIT_BACKOFF_BASE,
+        cap=RATE_LIMIT_BACKOFF_CAP,
+        limiter=get_openai_limiter()
+    )
 
-def add_message(thread_id, content, role):
-    # Add user message to the thread
-    client.beta.threads.messages.create(
-            thread_id=thread_id,
-            role=role,
-            content=content
-        )   
-    return
+# Function cancelling a run still in progress. Closing its stream doesn't stop
+# the run, which would go on generating (and being billed) for nothing.
+async def cancel_run_async(thread_id, event_handler):
+    if not event_handler.run_in_progress:
+        return
+    logging.info(f"Cancelling run {event_handler.run_id} of thread {thread_id}")
+    try:
+        await get_openai_client().beta.threads.runs.cancel(run_id=event_handler.run_id, thread_id=thread_id)
+        tracing.count('runs_cancelled')
+    except Exception as e:
+        logging.warning(f"Could not cancel run {event_handler.run_id}: {str(e)}")
+
+# Function streaming the questioner's answer to a user message. Returns the
+# thread id, whether the questioner asked for the contract to be generated and
+# whether it asked to edit the contract generated before rather than start a new one.
+async def run_questioner(thread_id, channel_id, user_input):
+    if not thread_id:
+        print("Getting a new thread")
+        thread_id = await get_thread_pool().acquire()
+        print(f"Got new thread with id: {thread_id}")
+        logging.info(f"Got new thread with id: {thread_id}")
+
+    print("Creating EventHandler")
+    # Imported here so module import (and preflight requests) skip the openai package
+    from event_handler import AsyncEventHandler
+    edit_requested = False
+
+    async def process_events(stream):
+        nonlocal edit_requested
+        print("Processing stream events")
+        async for event in stream:
+            print(f"Received event: {event.event}")
+            logging.info(f"Received event: {event.event}")
+
+            if event.event == "thread.run.requires_action":
+                print("Run requires action")
+                required_action = event.data.required_action
+                if required_action.type == 'submit_tool_outputs':
+                    tool_outputs = []
+                    for tool_call in required_action.submit_tool_outputs.tool_calls:
+                        if tool_call.type == 'function' and tool_call.function.name == 'generate_contract':
+                            edit_requested = bool(parse_tool_arguments(tool_call.function.arguments).get('edit_contract'))
+                            # Execute the function
+                            print("hi")
+                            await get_openai_client().beta.threads.runs.cancel(
+                                thread_id=thread_id,
+                                run_id=event.data.id
+                            )
+                                        # Since the function has no outputs, output is empty
+                            tool_outputs.append({
+                                'tool_call_id': tool_call.id,
+                                'output': "Contract generation started. Tell the user to wait a little while the contract is being generated."
+                            })
+                    
+                    # # Submit the tool outputs
+                    # print("Submitting tool outputs")
+                    # get_openai_client().beta.threads.runs.submit_tool_outputs(
+                    #     thread_id=thread_id,
+                    #     run_id=event.data.id,
+                    #     tool_outputs=tool_outputs
+                    # )
+            elif event.event == "thread.run.completed":
+                
+                print("Run completed")
+                # We can proceed
+                
+            # Process other events as needed
+
+    event_handler = await stream_run(
+        lambda: AsyncEventHandler(get_async_publisher(), thread_id, channel_id, "chat-response", stage="questioner"),
+        process_events,
+        thread_id=thread_id,
+        assistant_id=ASSISTANT_QUESTIONER_ID,
+        # The user message is added by the run itself, saving a round trip
+        additional_messages=[{"role": "user", "content": user_input}],
+        tools=[{
+            "type": "function",
+            "function": generate_contract_function
+        }]
+    )
+    print("Stream processing completed")
+    await get_async_publisher().drain(PUBLISH_DRAIN_TIMEOUT, [channel_id])
+    return thread_id, event_handler.generate_contract_called, edit_requested
+
+def parse_tool_arguments(arguments):
+    try:
+        return json.loads(arguments or '{}')
+    except ValueError:
+        logging.warning(f"Could not parse tool call arguments: {arguments}")
+        return {}
+
+# Function answering a chat message. Returns the JSON body and status of the answer.
+# With the contract_id of a generated contract, generating edits that contract
+# only when the questioner was asked to change it, otherwise a new one is generated.
+async def answer_chat(thread_id, channel_id, user_input, contract_id=None):
+    # Chat turns get the OpenAI rate limits before background builds
+    with priority(INTERACTIVE):
+        thread_id, generate_contract_called, edit_requested = await run_questioner(thread_id, channel_id, user_input)
+    if not edit_requested:
+        contract_id = None
+    tracing.tag(thread_id=thread_id, channel_id=channel_id)
+    logging.info(f"OpenAI round trips: {tracing.current_span().metrics.get('openai_round_trips', 0)}")
+    # Have threads ready for the builds and the next chats, in the background
+    get_thread_pool().fill()
+
+    if generate_contract_called:
+        # Generation takes minutes, run it as a background job and answer right away
+        print("Generating contract")
+        job_id = await asyncio.to_thread(
+            get_job_manager().submit, thread_id=thread_id, channel_id=channel_id, user_input=user_input,
+            base_contract_id=contract_id
+        )
+        return {
+            'message': 'Contract edit started' if contract_id else 'Contract generation started',
+            'thread_id': thread_id,
+            'job_id': job_id
+        }, 202
+    return {'message': 'Processing request', 'thread_id': thread_id}, 200
+
+# Function answering a CORS preflight request
+def preflight_response(methods, headers='Content-Type'):
+    response = jsonify({'message': 'OK'})
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    response.headers.add('Access-Control-Allow-Headers', headers)
+    response.headers.add('Access-Control-Allow-Methods', methods)
+    return response
+
+# Decorator answering the preflight requests of an endpoint and letting any
+# origin read its responses
+def cors(methods, headers='Content-Type'):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(req):
+            if req.method == 'OPTIONS':
+                return preflight_response(methods, headers)
+            response = make_response(handler(req))
+            response.headers.setdefault('Access-Control-Allow-Origin', '*')
+            return response
+        return wrapper
+    return decorator
+
+# Server-Sent Events response with the headers keeping proxies from buffering it
+def sse_response(frames):
+    response = Response(frames, mimetype='text/event-stream')
+    response.headers.add('Cache-Control', 'no-cache')
+    response.headers.add('X-Accel-Buffering', 'no')
+    return response
+
+# Function answering a chat message over the HTTP response: the channel's events
+# are streamed as they are published, then a 'response' event carries the JSON
+# answer. Events of the generation job started by the answer go to the events
+# endpoint, like they go to Pusher.
+def stream_chat(thread_id, channel_id, user_input, contract_id=None):
+    transport = get_realtime_transport()
+    if not isinstance(transport, SSETransport):
+        return make_response(jsonify({'error': 'Streaming answers need REALTIME_TRANSPORT=sse'}), 400)
+
+    # Subscribe before the run starts so no event is missed
+    subscription = transport.subscribe(channel_id)
+    answer = get_event_loop().submit(answer_chat(thread_id, channel_id, user_input, contract_id))
+
+    def frames():
+        yield from sse_events(transport, subscription, done=answer.done, heartbeat=SSE_HEARTBEAT_INTERVAL)
+        try:
+            body, _ = answer.result()
+            yield format_sse('response', body)
+        except Exception as e:
+            logging.error(f"Error processing request: {str(e)}")
+            yield format_sse('error', {'message': str(e)})
+
+    return sse_response(frames())
 
 # Main chat handler function
 @https_fn.on_request()
+@cors('POST')
+@tracing.traced('chat_handler')
 def chat_handler(req: https_fn.Request) -> https_fn.Response:
-    if req.method == 'OPTIONS':
-        # Respond to preflight request
-        response = jsonify({'message': 'OK'})
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        response.headers.add('Access-Control-Allow-Headers', 'Content-Type')
-        response.headers.add('Access-Control-Allow-Methods', 'POST')
-        return response
-
     try:
         print("Starting chat_handler function")
         data = req.get_json()
@@ -240,186 +549,417 @@ def chat_handler(req: https_fn.Request) -> https_fn.Response:
         print(f"Received request with input: {user_input}, thread_id: {thread_id}, channel_id: {channel_id}")
         logging.info(f"Received request with input: {user_input}, thread_id: {thread_id}, channel_id: {channel_id}")
 
-        if not thread_id:
-            print("Creating new thread")
-            thread = client.beta.threads.create()
-            thread_id = thread.id
-            print(f"Created new thread with id: {thread_id}")
-            logging.info(f"Created new thread with id: {thread_id}")
-        else:
-            print(f"Retrieving existing thread with id: {thread_id}")
-            thread = client.beta.threads.retrieve(thread_id)
-            print(f"Retrieved existing thread with id: {thread_id}")
-            logging.info(f"Retrieved existing thread with id: {thread_id}")
-
-        add_message(thread_id, user_input, "user")
-        logging.info("Added user message to thread")
-
-        
-
-        print("Creating EventHandler")
-        event_handler = EventHandler(pusher_client, thread_id, channel_id, "chat-response")
-        
-        with client.beta.threads.runs.stream(
-            thread_id=thread_id,
-            assistant_id=ASSISTANT_QUESTIONER_ID,
-            event_handler=event_handler,
-            tools=[{
-                "type": "function",
-                "function": generate_contract_function
-            }]
-        ) as stream:
-            print("Processing stream events")
-            for event in stream:
-                print(f"Received event: {event.event}")
-                logging.info(f"Received event: {event.event}")
-
-                if event.event == "thread.run.requires_action":
-                    print("Run requires action")
-                    required_action = event.data.required_action
-                    if required_action.type == 'submit_tool_outputs':
-                        tool_outputs = []
-                        for tool_call in required_action.submit_tool_outputs.tool_calls:
-                            if tool_call.type == 'function' and tool_call.function.name == 'generate_contract':
-                                # Execute the function
-                                print("hi")
-                                client.beta.threads.runs.cancel(
-                                    thread_id=thread_id,
-                                    run_id=event.data.id
-                                )
-                                            # Since the function has no outputs, output is empty
-                                tool_outputs.append({
-                                    'tool_call_id': tool_call.id,
-                                    'output': "Contract generation started. Tell the user to wait a little while the contract is being generated."
-                                })
-                        
-                        # # Submit the tool outputs
-                        # print("Submitting tool outputs")
-                        # client.beta.threads.runs.submit_tool_outputs(
-                        #     thread_id=thread_id,
-                        #     run_id=event.data.id,
-                        #     tool_outputs=tool_outputs
-                        # )
-                elif event.event == "thread.run.completed":
-                    
-                    print("Run completed")
-                    # We can proceed
-                    
-                # Process other events as needed
-        if event_handler.generate_contract_called:
-            print("Generating contract")
-            generate_contract(thread_id, channel_id, user_input)
+        if data.get('stream') or 'text/event-stream' in req.headers.get('Accept', ''):
+            return stream_chat(thread_id, channel_id, user_input, data.get('contract_id'))
 
-        print("Stream processing completed")
-        response = make_response(jsonify({'message': 'Processing request', 'thread_id': thread_id}))
-        response.headers.add('Access-Control-Allow-Origin', '*')
-        return response
+        body, status = run_async(answer_chat(thread_id, channel_id, user_input, data.get('contract_id')))
+        return make_response(jsonify(body), status)
 
     except Exception as e:
         print(f"Error in chat_handler: {str(e)}")
         logging.error(f"Error processing request: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-# Function to generate the contract
-def generate_contract(thread_id, channel_id, user_input):
+# Function to generate the contract, a thin wrapper running the async pipeline
+# on the shared event loop
+def generate_contract(thread_id, channel_id, user_input, job_id=None):
+    return run_async(generate_contract_async(thread_id, channel_id, user_input, job_id=job_id))
+
+@tracing.traced('generate_contract')
+async def generate_contract_async(thread_id, channel_id, user_input, job_id=None):
+    tracing.tag(thread_id=thread_id, channel_id=channel_id, job_id=job_id)
     logging.info("Generating contract...")
     print("\n=== Starting Contract Generation ===\n")
     
-    generated_files = {}
-    
     try:
+        await set_job_state(job_id, 'designing')
         print("--- Designer Assistant Output ---")
         
+        # The first file is built while the designer is still writing the rest
+        async def build_speculatively(design, file_path):
+            building_thread_id, messages = await fork_building_thread_async(design, file_path, {})
+            return building_thread_id, await build_file_async(building_thread_id, channel_id, file_path, messages)
+
+        planner = SpeculativePlanner(
+            get_async_publisher(), channel_id, build_speculatively, build_file_structure,
+            min_confidence=DESIGN_PARSER_MIN_CONFIDENCE, speculate=SPECULATIVE_BUILD
+        )
+
         # Use existing chat thread for designer
-        event_handler = EventHandler(pusher_client, thread_id, channel_id, "chat-response")
+        from event_handler import DesignEventHandler
         try:
-            with client.beta.threads.runs.stream(
+            event_handler = await stream_run(
+                lambda: DesignEventHandler(get_async_publisher(), thread_id, channel_id, "chat-response", stage="designer",
+                                           on_design=planner.on_design),
                 thread_id=thread_id,  # Using existing chat thread
-                assistant_id=ASSISTANT_DESIGNER_ID,
-                event_handler=event_handler
-            ) as stream:
-                stream.until_done()
+                assistant_id=ASSISTANT_DESIGNER_ID
+            )
 
-            # Get designer's output
-            messages = client.beta.threads.messages.list(thread_id=thread_id)
-            designer_output = messages.data[0].content[0].text.value
+            # The handler accumulated the designer's output while streaming it
+            designer_output = event_handler.full_response
 
             if designer_output.strip():
+                # Near-identical designs were generated before, reuse their files
+                cache_key = design_cache_key(designer_output)
+                generation_cache = get_generation_cache()
+                cached = generation_cache.get(cache_key) if generation_cache else None
+
                 # Process the designer's output
-                project_name, file_list = extract_file_names(designer_output)
+                if cached:
+                    logging.info(f"Generation cache hit for {cache_key}")
+                    project_name, file_list = cached['project_name'], cached['file_list']
+                else:
+                    project_name, file_list = await extract_file_names_async(designer_output)
+                # Cached files are replayed, a speculative build of one of them isn't needed
+                in_flight = await planner.reconcile(designer_output, file_list, keep=not cached)
 
-                print(f"\nProject name: {project_name}")
-                print(f"Files to be generated: {file_list}\n")
+                # Record the plan so a failed generation can be resumed
+                checkpoint = GenerationCheckpoint(get_db(), job_id or str(uuid.uuid4()), compress_threshold=CONTRACT_COMPRESS_THRESHOLD)
+                state = {
+                    'thread_id': thread_id,
+                    'channel_id': channel_id,
+                    'user_input': user_input,
+                    'designer_output': designer_output,
+                    'project_name': project_name,
+                    'file_list': file_list,
+                    'cache_key': cache_key
+                }
+                await asyncio.to_thread(checkpoint.start, **state)
 
-                # Send file structure to front-end
-                file_structure = build_file_structure(file_list, project_name)
-                pusher_client.trigger(channel_id, 'initial-structure', {
-                    'structure': file_structure
-                })
-                
-                # Create single new thread for all builders
-                building_thread = client.beta.threads.create()
-                building_thread_id = building_thread.id
-                
-                # Add designer's output to building thread
-                add_message(building_thread_id, designer_output, "user")
-                
-                # Build each file using the same building thread
-                for file_info in file_list:
-                    print(f"\n--- Building file: {file_info} ---")
-                    add_message(building_thread_id, f"Generate the code for {file_info}", "user")
-                    code_output = build_file(building_thread_id, channel_id, file_info)
-                    generated_files[file_info] = code_output
-                    print(f"--- Finished building file: {file_info} ---\n")
-                
-                # Save contract data and send notifications
-                contract_id = save_contract_data(project_name, generated_files, user_input)
-                
-                pusher_client.trigger(channel_id, 'contract-saved', {
-                    'contract_id': contract_id,
-                    'project_name': project_name
-                })
-                
-                feedback_message = (
-                    "We would greatly appreciate feedback on the product to keep improving. "
-                    "Please respond to this survey once you've reviewed the generation of the contract. "
-                    "It will be an amazing push of help this project. Take into account this is the first prototype "
-                    "and that vast improvements are still possible: "
-                    "[Feedback Form](https://forms.gle/ZX6bGYcS2hxPaw5Z6)"
+                return await build_and_save_contract_async(
+                    checkpoint, state, cached['files'] if cached else {}, job_id,
+                    in_flight=in_flight, structure_update=planner.structure_sent
                 )
-                
-                pusher_client.trigger(channel_id, 'chat-response', {
-                    'message': feedback_message,
-                    'thread_id': thread_id,
-                    'is_complete': True
-                })
             else:
                 logging.error("Designer output was empty")
                 raise ValueError("Designer output was empty")
                 
         except Exception as e:
-            logging.error(f"Error in contract generation: {str(e)}")
-            pusher_client.trigger(channel_id, 'error', {
-                'message': f"Error generating contract: {str(e)}"
-            })
+            await report_generation_error_async(channel_id, job_id, e)
+        finally:
+            planner.cancel()
     except Exception as e:
         # Update analytics for failed generations
-        analytics_ref = db.collection('analytics').document('contract_generation')
-        analytics_ref.set({
-            'failed_generations': firestore.Increment(1),
+        await asyncio.to_thread(get_analytics_counter().increment, {
+            'failed_generations': 1,
             'last_error': str(e),
             'last_error_timestamp': datetime.datetime.now()
-        }, merge=True)
+        })
         
         logging.error(f"Error in contract generation: {str(e)}")
-        pusher_client.trigger(channel_id, 'error', {
+        await set_job_state(job_id, 'failed', error=str(e))
+        await get_async_publisher().trigger(channel_id, 'error', {
             'message': f"Error generating contract: {str(e)}"
         })
+    finally:
+        # Everything queued for this generation must reach Pusher before we return
+        await get_async_publisher().drain(PUBLISH_DRAIN_TIMEOUT, [channel_id])
+        logging.info(f"Publish queue stats: {get_publish_queue().stats()}")
+        logging.info(f"Transport stats: {transport_stats()}")
+        logging.info(f"Rate limit stats: {rate_limit_stats()}")
+        logging.info(f"Thread pool stats: {get_thread_pool().stats()}")
 
-# Function to extract file names using structured outputs
-def extract_file_names(designer_output):
-    logging.info("Extracting file names and project name from designer output...")
+# Key of the files generated for a design in the generation cache
+def design_cache_key(designer_output):
+    return generation_cache_key(
+        designer_output,
+        [ASSISTANT_BUILDER_ID, ASSISTANT_TEST_BUILDER_ID, ASSISTANT_DOCUMENTATION_ID,
+         f"cargo-template-{CARGO_TEMPLATE_VERSION}-{SOROBAN_SDK_VERSION}"],
+        GENERATION_CACHE_VERSION
+    )
+
+async def report_generation_error_async(channel_id, job_id, e):
+    logging.error(f"Error in contract generation: {str(e)}")
+    await set_job_state(job_id, 'failed', error=str(e))
+    await get_async_publisher().trigger(channel_id, 'error', {
+        'message': f"Error generating contract: {str(e)}"
+    })
+
+# Function to build the planned files and save the contract. Files already in
+# `completed` (from a checkpoint or the generation cache) are replayed, not rebuilt,
+# unless replay is False because the frontend has them already (edits). Builds
+# already running in `in_flight` (started on a partial design) are awaited.
+async def build_and_save_contract_async(checkpoint, state, completed, job_id=None, in_flight=None,
+                                        structure_update=False, replay=True):
+    channel_id = state['channel_id']
+    designer_output = state['designer_output']
+    project_name = state['project_name']
+    file_list = state['file_list']
+
+    print(f"\nProject name: {project_name}")
+    print(f"Files to be generated: {file_list}\n")
+
+    # Send file structure to front-end
+    file_structure = build_file_structure(file_list, project_name)
+    await get_async_publisher().trigger(channel_id, 'initial-structure', {
+        'structure': file_structure,
+        'update': structure_update
+    })
     
+    await set_job_state(job_id, 'building', project_name=project_name)
+    in_flight = dict(in_flight or {})
+
+    completed = {f: completed[f] for f in file_list if f in completed}
+    if completed and replay:
+        await replay_generated_files_async(channel_id, list(completed), completed)
+
+    # Build independent files concurrently, each on its own thread
+    # seeded with the design and the files it depends on
+    async def build_planned_file(file_info, dependency_outputs):
+        if file_info in in_flight:
+            try:
+                building_thread_id, code_output = await in_flight.pop(file_info)
+                await asyncio.to_thread(checkpoint.record_thread, file_info, building_thread_id)
+                await asyncio.to_thread(checkpoint.save_file, file_info, code_output)
+                return code_output
+            except Exception as e:
+                logging.warning(f"Speculative build of {file_info} failed, building it again: {str(e)}")
+        print(f"\n--- Building file: {file_info} ---")
+        if file_info == 'Cargo.toml':
+            code_output = await build_cargo_toml_async(channel_id, project_name, dependency_outputs)
+            if code_output is not None:
+                await asyncio.to_thread(checkpoint.save_file, file_info, code_output)
+                return code_output
+        building_thread_id, messages = await fork_building_thread_async(designer_output, file_info, dependency_outputs)
+        await asyncio.to_thread(checkpoint.record_thread, file_info, building_thread_id)
+        code_output = await build_file_async(building_thread_id, channel_id, file_info, messages)
+        # Persist right away so a later failure doesn't lose this file
+        await asyncio.to_thread(checkpoint.save_file, file_info, code_output)
+        print(f"--- Finished building file: {file_info} ---\n")
+        return code_output
+
+    files_built = 0
+
+    async def build_and_report(file_info, dependency_outputs):
+        nonlocal files_built
+        code_output = await build_planned_file(file_info, dependency_outputs)
+        files_built += 1
+        # Also shows the job is alive, one not updated for JOB_STALE_AFTER can be resumed
+        await set_job_state(job_id, 'building', files_built=files_built)
+        return code_output
+
+    generated_files = await run_dag(
+        build_dependency_graph(file_list),
+        build_and_report,
+        max_concurrency=GENERATION_MAX_WORKERS,
+        completed=completed
+    )
+
+    generation_cache = get_generation_cache()
+    if generation_cache and len(completed) < len(file_list):
+        generation_cache.set(state['cache_key'], {
+            'project_name': project_name,
+            'file_list': file_list,
+            'files': generated_files
+        })
+    
+    # Save contract data and send notifications
+    await set_job_state(job_id, 'saving')
+    if state.get('contract_id'):
+        # An edit writes the files it rebuilt into the contract it started from
+        reused = state.get('reused_files', [])
+        contract_id = await asyncio.to_thread(
+            update_contract_data, state['contract_id'], project_name, generated_files,
+            [f for f in file_list if f not in reused], state
+        )
+    else:
+        contract_id = await asyncio.to_thread(
+            save_contract_data, project_name, generated_files, state['user_input'], designer_output
+        )
+    await asyncio.to_thread(checkpoint.finish, contract_id)
+    
+    await get_async_publisher().trigger(channel_id, 'contract-saved', {
+        'contract_id': contract_id,
+        'project_name': project_name
+    })
+    
+    feedback_message = (
+        "We would greatly appreciate feedback on the product to keep improving. "
+        "Please respond to this survey once you've reviewed the generation of the contract. "
+        "It will be an amazing push of help this project. Take into account this is the first prototype "
+        "and that vast improvements are still possible: "
+        "[Feedback Form](https://forms.gle/ZX6bGYcS2hxPaw5Z6)"
+    )
+    
+    await get_async_publisher().trigger(channel_id, 'chat-response', {
+        'message': feedback_message,
+        'thread_id': state['thread_id'],
+        'is_complete': True
+    })
+    return contract_id
+
+# Function to resume a generation from its checkpoint, continuing with the
+# files that weren't finished instead of redoing the designer and every builder.
+# A job that failed before its file plan was checkpointed starts over from its record.
+def resume_generation(checkpoint_id, job_id=None, job=None):
+    return run_async(resume_generation_async(checkpoint_id, job_id=job_id, job=job))
+
+async def resume_generation_async(checkpoint_id, job_id=None, job=None):
+    checkpoint = GenerationCheckpoint(get_db(), checkpoint_id, compress_threshold=CONTRACT_COMPRESS_THRESHOLD)
+    state = await asyncio.to_thread(checkpoint.load)
+    if not (state and state.get('file_list')):
+        if job is None:
+            raise ValueError(f"No checkpoint found for {checkpoint_id}")
+        # Failed while designing, start over
+        logging.info(f"No file plan checkpointed for {checkpoint_id}, starting the generation over")
+        if job.get('base_contract_id'):
+            return await edit_contract_async(job['base_contract_id'], job['thread_id'], job['channel_id'], job['user_input'], job_id=job_id)
+        return await generate_contract_async(job['thread_id'], job['channel_id'], job['user_input'], job_id=job_id)
+
+    logging.info(f"Resuming contract generation {checkpoint_id}...")
+    try:
+        completed = await asyncio.to_thread(checkpoint.load_files)
+        if state.get('reused_files'):
+            # An edit only checkpoints the files it rebuilds, the others are in the contract
+            reused = await asyncio.to_thread(load_contract_files, state['contract_id'], state['reused_files'])
+            completed = dict(reused, **completed)
+        logging.info(f"Reusing {len(completed)} of {len(state['file_list'])} files from the checkpoint")
+        return await build_and_save_contract_async(checkpoint, state, completed, job_id)
+    except Exception as e:
+        await report_generation_error_async(state['channel_id'], job_id, e)
+    finally:
+        await get_async_publisher().drain(PUBLISH_DRAIN_TIMEOUT, [state['channel_id']])
+
+# Function to apply a change request to a saved contract. The designer revises
+# the stored design, then only the files whose part of the design changed and
+# the files depending on them are built again, the others are reused.
+def edit_contract(contract_id, thread_id, channel_id, change_request, job_id=None):
+    return run_async(edit_contract_async(contract_id, thread_id, channel_id, change_request, job_id=job_id))
+
+@tracing.traced('edit_contract')
+async def edit_contract_async(contract_id, thread_id, channel_id, change_request, job_id=None):
+    tracing.tag(contract_id=contract_id, thread_id=thread_id, channel_id=channel_id, job_id=job_id)
+    logging.info(f"Editing contract {contract_id}...")
+    try:
+        metadata = await asyncio.to_thread(load_contract_metadata, get_db(), contract_id)
+        if metadata is None:
+            raise ValueError(f"No contract found for {contract_id}")
+        old_design = metadata.get('designer_output')
+        if not old_design:
+            # Saved before contracts kept their design, there is nothing to diff against
+            logging.info(f"Contract {contract_id} has no stored design, generating it from scratch")
+            return await generate_contract_async(thread_id, channel_id, change_request, job_id=job_id)
+
+        await set_job_state(job_id, 'designing')
+        if not thread_id:
+            thread_id = await get_thread_pool().acquire()
+        from event_handler import AsyncEventHandler
+        event_handler = await stream_run(
+            lambda: AsyncEventHandler(get_async_publisher(), thread_id, channel_id, "chat-response", stage="designer"),
+            thread_id=thread_id,
+            assistant_id=ASSISTANT_DESIGNER_ID,
+            additional_messages=[{"role": "user", "content": edit_design_message(old_design, change_request)}]
+        )
+        designer_output = event_handler.full_response
+        if not designer_output.strip():
+            raise ValueError("Designer output was empty")
+
+        project_name, file_list = await extract_file_names_async(designer_output)
+        old_files = metadata.get('file_paths', [])
+        changed = changed_design_files(old_design, designer_output, old_files, file_list)
+        rebuilt = dependents_of(build_dependency_graph(file_list), changed)
+        reused = await asyncio.to_thread(load_contract_files, contract_id, [f for f in file_list if f not in rebuilt])
+        logging.info(f"Edit of {contract_id} changes {changed}, rebuilding {len(file_list) - len(reused)} "
+                     f"of {len(file_list)} files")
+        tracing.current_span().metric(files_reused=len(reused), files_rebuilt=len(file_list) - len(reused))
+
+        checkpoint = GenerationCheckpoint(get_db(), job_id or str(uuid.uuid4()), compress_threshold=CONTRACT_COMPRESS_THRESHOLD)
+        state = {
+            'thread_id': thread_id,
+            'channel_id': channel_id,
+            'user_input': change_request,
+            'designer_output': designer_output,
+            'project_name': project_name,
+            'file_list': file_list,
+            'cache_key': design_cache_key(designer_output),
+            'contract_id': contract_id,
+            'contract_version': metadata.get('version', 1) + 1,
+            'reused_files': list(reused),
+            'removed_files': [f for f in old_files if f not in file_list]
+        }
+        await asyncio.to_thread(checkpoint.start, **state)
+
+        # The frontend keeps the files it has, only the rebuilt ones are streamed
+        return await build_and_save_contract_async(checkpoint, state, reused, job_id, structure_update=True, replay=False)
+    except Exception as e:
+        await report_generation_error_async(channel_id, job_id, e)
+    finally:
+        await get_async_publisher().drain(PUBLISH_DRAIN_TIMEOUT, [channel_id])
+
+def edit_design_message(design, change_request):
+    return (
+        f"This is the current design of the contract:\n\n{design}\n\n"
+        "Revise it for the change request below and write the whole revised design. Keep every part "
+        "the change doesn't affect exactly as it is, with the same headings and file names.\n\n"
+        f"Change request: {change_request}"
+    )
+
+def load_contract_files(contract_id, file_paths):
+    return {path: content for path, content in iter_contract_files(get_db(), contract_id) if path in file_paths}
+
+# Background job running one contract generation
+def run_generation_job(job):
+    if job.get('resume'):
+        contract_id = resume_generation(job['job_id'], job_id=job['job_id'], job=job)
+    elif job.get('base_contract_id'):
+        contract_id = edit_contract(job['base_contract_id'], job['thread_id'], job['channel_id'], job['user_input'], job_id=job['job_id'])
+    else:
+        contract_id = generate_contract(job['thread_id'], job['channel_id'], job['user_input'], job_id=job['job_id'])
+    return {'contract_id': contract_id} if contract_id else {}
+
+def get_job_manager():
+    return _get_or_create('job_manager', lambda: JobManager(
+        FirestoreJobStore(get_db()) if JOB_STORE == 'firestore' else InMemoryJobStore(),
+        InMemoryJobQueue(),
+        run_generation_job,
+        max_workers=JOB_WORKERS
+    ))
+
+# Endpoint reporting the state of a contract generation job
+@https_fn.on_request()
+@cors('GET')
+def job_status(req: https_fn.Request) -> https_fn.Response:
+    job_id = req.args.get('job_id')
+    job = get_job_manager().get(job_id) if job_id else None
+    if job is None:
+        response = make_response(jsonify({'error': 'Job not found'}), 404)
+    else:
+        response = make_response(jsonify({
+            key: value.isoformat() if isinstance(value, datetime.datetime) else value
+            for key, value in job.items()
+            if key != 'user_input'
+        }))
+    return response
+
+# Function to extract file names, parsing the design locally and using
+# structured outputs only when the local parse isn't confident enough
+@tracing.traced('extract_file_names')
+async def extract_file_names_async(designer_output):
+    logging.info("Extracting file names and project name from designer output...")
+
+    key = hashlib.sha256(designer_output.encode('utf-8')).hexdigest()
+    with file_names_cache_lock:
+        if key in file_names_cache:
+            file_names_cache.move_to_end(key)
+            project_name, ordered_files = file_names_cache[key]
+            return project_name, list(ordered_files)
+
+    project_name, src_files, test_files, confidence = parse_design_document(designer_output)
+    if confidence >= DESIGN_PARSER_MIN_CONFIDENCE:
+        logging.info(f"Parsed design document locally (confidence {confidence})")
+        ordered_files = order_design_files(src_files, test_files)
+    else:
+        logging.info(f"Local design parse not confident enough ({confidence}), asking gpt-4o")
+        project_name, ordered_files = await extract_file_names_with_llm_async(designer_output)
+
+    with file_names_cache_lock:
+        file_names_cache[key] = (project_name, list(ordered_files))
+        while len(file_names_cache) > FILE_NAMES_CACHE_SIZE:
+            file_names_cache.popitem(last=False)
+
+    return project_name, ordered_files
+
+async def extract_file_names_with_llm_async(designer_output):
     extract_files_function = {
         "name": "extract_file_names",
         "description": "Extracts the project name and list of contract and testfiles from the designer's output.",
@@ -445,7 +985,7 @@ def extract_file_names(designer_output):
         }
     }
 
-    completion = client.chat.completions.create(
+    completion = await get_openai_client().chat.completions.create(
         model='gpt-4o',
         messages=[
             {
@@ -481,6 +1021,7 @@ Remember: The sequence of files in the output MUST match their appearance order
         functions=[extract_files_function],
         function_call={"name": "extract_file_names"}
     )
+    charge_openai_usage(completion.usage)
     
     arguments = completion.choices[0].message.function_call.arguments
     json_dict = json.loads(arguments)
@@ -488,29 +1029,7 @@ Remember: The sequence of files in the output MUST match their appearance order
     files_list = json_dict.get("src_folder_files", [])
     test_files = json_dict.get("test_folder_files", [])
     
-    # Create ordered file structure
-    ordered_files = []
-    
-    # 1. First add all .rs files that aren't tests
-    for file in files_list:
-        if file.endswith('.rs') and not file.endswith('_test.rs'):
-            if not file.startswith('src/'):
-                file = f"src/{file}"
-            ordered_files.append(file)
-
-    for file in test_files:
-        if file.endswith('.rs'):
-            if not file.startswith('test/'):
-                file = f"test/{file}"
-            ordered_files.append(file)
-
-    # 3. Add cargo file
-    ordered_files.append("Cargo.toml")
-
-    ordered_files.append("README.md")
-    
-
-    return project_name, ordered_files
+    return project_name, order_design_files(files_list, test_files)
 
 def build_file_structure(files_list, project_name):
     logging.info("Building file structure...")
@@ -558,53 +1077,97 @@ def build_file_structure(files_list, project_name):
     
     return root
 
+# Function to take the building thread for one file of the plan from the pool.
+# Returns it with its context (the design and as much of its dependencies as the
+# token budget allows), sent with the file's run instead of a thread creation.
+async def fork_building_thread_async(designer_output, file_path, dependency_outputs):
+    with tracing.span('build_context', file_path=file_path) as context_span:
+        messages, report = build_file_context(designer_output, file_path, dependency_outputs, CONTEXT_TOKEN_BUDGET)
+        context_span.metric(context_tokens=report['tokens'], unbudgeted_tokens=report['unbudgeted_tokens'])
+    logging.info(f"Context for {file_path}: {report['tokens']} tokens "
+                 f"({report['unbudgeted_tokens']} unbudgeted), dependencies {report['levels']}")
+
+    building_thread_id = await get_thread_pool().acquire()
+    return building_thread_id, messages
+
 # Function to build each file using the Builder Assistant
-def build_file(building_thread_id, channel_id, file_path):
+async def build_file_async(building_thread_id, channel_id, file_path, context_messages=()):
     logging.info(f"Building file {file_path}...")
     
     # Select appropriate assistant and context based on file type
     if file_path.endswith('_test.rs'):
         assistant_id = ASSISTANT_TEST_BUILDER_ID
-        context_message = "[Context for test generation] You have access to all the main Rust source files that have already been generated. Use this context to create appropriate tests."
+        context_message = "[Context for test generation] The files this test depends on are shown above, in full, as their public interface or, when too long, only by name. Use this context to create appropriate tests."
     elif file_path.endswith('.md'):
         assistant_id = ASSISTANT_DOCUMENTATION_ID
-        context_message = "[Context for documentation generation] You have access to all source code, tests, and cargo files. Use this context to create comprehensive documentation."
+        context_message = "[Context for documentation generation] The design document and the public interface of the generated files are shown above, files listed as not shown exist too. Use this context to create comprehensive documentation."
     else:
         assistant_id = ASSISTANT_BUILDER_ID
         context_message = "[Context for file generation] "
         if file_path == "Cargo.toml":
-            context_message += "You have seen all the Rust source files and test files. Use this context to specify the correct dependencies."
-    
-    # Add context to building thread
-    add_message(building_thread_id, context_message, "user")
+            context_message += "The use statements of the generated Rust files are shown above. Use this context to specify the correct dependencies."
     
     # Create event handler with file path
-    event_handler = EventHandler(pusher_client, building_thread_id, channel_id, "code-generation", is_code_generation=True)
-    event_handler.current_file_path = file_path
+    from event_handler import AsyncEventHandler
+    def make_event_handler():
+        event_handler = AsyncEventHandler(get_async_publisher(), building_thread_id, channel_id, "code-generation", is_code_generation=True, stage="build_file")
+        event_handler.current_file_path = file_path
+        return event_handler
     
     # Notify frontend of file generation start
-    pusher_client.trigger(channel_id, 'file-generation-status', {
+    await get_async_publisher().trigger(channel_id, 'file-generation-status', {
         'filePath': file_path,
         'status': 'generating'
     })
     
-    with client.beta.threads.runs.stream(
+    event_handler = await stream_run(
+        make_event_handler,
         thread_id=building_thread_id,  # Using the building thread
         assistant_id=assistant_id,
-        event_handler=event_handler
-    ) as stream:
-        stream.until_done()
+        additional_messages=[*context_messages, {"role": "user", "content": context_message}]
+    )
 
-    # Send completion status
-    pusher_client.trigger(channel_id, 'file-generation-status', {
+    # Send completion status, the framer adds the hash of the streamed chunks
+    await get_async_publisher().trigger(channel_id, 'file-generation-status', {
         'filePath': file_path,
-        'status': 'complete',
-        'content': event_handler.full_response if hasattr(event_handler, 'full_response') else ""
+        'status': 'complete'
     })
     
     return event_handler.full_response if hasattr(event_handler, 'full_response') else ""
 
-def save_contract_data(project_name, files_data, user_input):
+# Function to write Cargo.toml from the template when the sources only use known
+# crates, streamed like a live build. Returns None when the builder must run.
+@tracing.traced('cargo_template')
+async def build_cargo_toml_async(channel_id, project_name, source_outputs):
+    code_output = generate_cargo_toml(project_name, source_outputs, SOROBAN_SDK_VERSION)
+    if code_output is None:
+        logging.info("Sources use crates unknown to the Cargo.toml template, building it with the assistant")
+        return None
+    await replay_generated_files_async(channel_id, ['Cargo.toml'], {'Cargo.toml': code_output})
+    return code_output
+
+# Function to stream previously generated files exactly like a live build
+async def replay_generated_files_async(channel_id, file_list, files):
+    for file_path in file_list:
+        code_output = files.get(file_path, "")
+        await get_async_publisher().trigger(channel_id, 'file-generation-status', {
+            'filePath': file_path,
+            'status': 'generating'
+        })
+        for code_content in CodeFenceScanner().feed(code_output):
+            await get_async_publisher().trigger(channel_id, 'code-chunk', {
+                'content': code_content,
+                'filePath': file_path,
+                'thread_id': None,
+            })
+        await get_async_publisher().trigger(channel_id, 'file-generation-status', {
+            'filePath': file_path,
+            'status': 'complete'
+        })
+    return {file_path: files.get(file_path, "") for file_path in file_list}
+
+@tracing.traced('save_contract_data')
+def save_contract_data(project_name, files_data, user_input, designer_output=None):
     """
     Save contract generation data and files to Firestore
     """
@@ -612,51 +1175,143 @@ def save_contract_data(project_name, files_data, user_input):
         # Generate a unique ID for this contract
         contract_id = str(uuid.uuid4())
         
-        # Create the contract document
-        contract_ref = db.collection('contracts').document(contract_id)
-        
         # Count different types of files
-        file_metrics = {
-            'total_files': len(files_data),
-            'source_files': len([f for f in files_data.keys() if f.startswith('src/')]),
-            'test_files': len([f for f in files_data.keys() if f.startswith('test/')]),
-            'other_files': len([f for f in files_data.keys() if not (f.startswith('src/') or f.startswith('test/'))])
-        }
+        file_metrics = count_contract_files(files_data)
         
-        # Prepare the contract data
+        # Prepare the contract metadata, file contents go to the 'files' subcollection.
+        # The design is kept so later edits can tell which files it changes.
         contract_data = {
             'project_name': project_name,
             'timestamp': datetime.datetime.now(),
             'prompt': user_input,
-            'files': {},
             'status': 'completed',
-            'file_metrics': file_metrics  # Add file metrics to contract data
+            'file_metrics': file_metrics,  # Add file metrics to contract data
+            'designer_output': designer_output,
+            'version': 1
         }
         
-        # Add each file's content to the contract data
-        for file_path, content in files_data.items():
-            contract_data['files'][file_path] = {
-                'content': content,
-                'path': file_path
-            }
-        
-        # Save to Firestore
-        contract_ref.set(contract_data)
+        # Save to Firestore in a single batched commit
+        save_contract(get_db(), contract_id, contract_data, files_data, compress_threshold=CONTRACT_COMPRESS_THRESHOLD)
         
         # Update analytics with aggregated metrics
-        analytics_ref = db.collection('analytics').document('contract_generation')
-        analytics_ref.set({
-            'total_contracts': firestore.Increment(1),
-            'total_files_generated': firestore.Increment(file_metrics['total_files']),
-            'total_source_files': firestore.Increment(file_metrics['source_files']),
-            'total_test_files': firestore.Increment(file_metrics['test_files']),
-            'total_other_files': firestore.Increment(file_metrics['other_files']),
-            'avg_files_per_contract': firestore.Increment(file_metrics['total_files']),  # We'll divide by total_contracts when querying
+        get_analytics_counter().increment({
+            'total_contracts': 1,
+            'total_files_generated': file_metrics['total_files'],
+            'total_source_files': file_metrics['source_files'],
+            'total_test_files': file_metrics['test_files'],
+            'total_other_files': file_metrics['other_files'],
+            'avg_files_per_contract': file_metrics['total_files'],  # We'll divide by total_contracts when querying
             'last_generated': datetime.datetime.now()
-        }, merge=True)
+        })
         
         return contract_id
     except Exception as e:
         logging.error(f"Error saving contract data: {str(e)}")
         raise e
 
+def count_contract_files(files_data):
+    return {
+        'total_files': len(files_data),
+        'source_files': len([f for f in files_data.keys() if f.startswith('src/')]),
+        'test_files': len([f for f in files_data.keys() if f.startswith('test/')]),
+        'other_files': len([f for f in files_data.keys() if not (f.startswith('src/') or f.startswith('test/'))])
+    }
+
+@tracing.traced('update_contract_data')
+def update_contract_data(contract_id, project_name, files_data, changed_files, state):
+    """
+    Save the files an edit rebuilt, and its design, into the edited contract
+    """
+    try:
+        contract_data = {
+            'project_name': project_name,
+            'timestamp': datetime.datetime.now(),
+            'last_change_request': state['user_input'],
+            'status': 'completed',
+            'file_metrics': count_contract_files(files_data),
+            'designer_output': state['designer_output'],
+            'version': state['contract_version']
+        }
+        update_contract(get_db(), contract_id, contract_data, files_data, changed_files,
+                        removed_files=state.get('removed_files', []), compress_threshold=CONTRACT_COMPRESS_THRESHOLD)
+
+        get_analytics_counter().increment({
+            'total_contract_edits': 1,
+            'total_files_regenerated': len(changed_files),
+            'total_files_reused': len(files_data) - len(changed_files),
+            'last_generated': datetime.datetime.now()
+        })
+        return contract_id
+    except Exception as e:
+        logging.error(f"Error updating contract data: {str(e)}")
+        raise e
+
+
+# Endpoint streaming the events of a channel as Server-Sent Events, when the
+# realtime transport is SSE. EventSource reconnects with Last-Event-ID and
+# receives the events it missed.
+@https_fn.on_request()
+@cors('GET', headers='Content-Type, Last-Event-ID')
+def realtime_events(req: https_fn.Request) -> https_fn.Response:
+    transport = get_realtime_transport()
+    channel_id = req.args.get('channel_id')
+    if not isinstance(transport, SSETransport):
+        response = make_response(jsonify({'error': 'Events are sent through Pusher'}), 404)
+    elif not channel_id:
+        response = make_response(jsonify({'error': 'channel_id is required'}), 400)
+    else:
+        last_event_id = req.headers.get('Last-Event-ID') or req.args.get('last_event_id')
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+        subscription = transport.subscribe(channel_id, last_event_id)
+        return sse_response(sse_events(
+            transport, subscription, heartbeat=SSE_HEARTBEAT_INTERVAL, idle_timeout=SSE_IDLE_TIMEOUT
+        ))
+    return response
+
+# Endpoint applying a change request to a saved contract, as a background job
+# rebuilding only the files the change affects
+@https_fn.on_request()
+@cors('POST')
+def edit_contract_handler(req: https_fn.Request) -> https_fn.Response:
+    data = req.get_json(silent=True) or {}
+    contract_id = data.get('contract_id')
+    change_request = data.get('change_request')
+    if not contract_id or not change_request or not data.get('channel_id'):
+        response = make_response(jsonify({'error': 'contract_id, change_request and channel_id are required'}), 400)
+    elif load_contract_metadata(get_db(), contract_id) is None:
+        response = make_response(jsonify({'error': 'Contract not found'}), 404)
+    else:
+        job_id = get_job_manager().submit(
+            thread_id=data.get('thread_id'), channel_id=data['channel_id'], user_input=change_request,
+            base_contract_id=contract_id
+        )
+        response = make_response(jsonify({'message': 'Contract edit started', 'job_id': job_id}), 202)
+    return response
+
+# Endpoint resuming a failed or stalled contract generation job from its last checkpoint
+@https_fn.on_request()
+@cors('POST')
+def resume_job(req: https_fn.Request) -> https_fn.Response:
+    data = req.get_json(silent=True) or {}
+    job_id = data.get('job_id')
+    job = get_job_manager().get(job_id) if job_id else None
+    if job is None:
+        response = make_response(jsonify({'error': 'Job not found'}), 404)
+    elif job['state'] != 'failed' and not is_stale(job, JOB_STALE_AFTER):
+        response = make_response(jsonify({
+            'error': f"Job is {job['state']}, only failed jobs and jobs stalled for {JOB_STALE_AFTER:.0f}s can be resumed"
+        }), 409)
+    else:
+        fields = {'resume': True}
+        if data.get('channel_id'):
+            # The frontend may be listening on a new channel after a reload
+            fields['channel_id'] = data['channel_id']
+            checkpoint = GenerationCheckpoint(get_db(), job_id)
+            if checkpoint.load() is not None:
+                checkpoint.update(channel_id=data['channel_id'])
+        get_job_manager().resubmit(job_id, **fields)
+        response = make_response(jsonify({'message': 'Contract generation resumed', 'job_id': job_id}), 202)
+    return response
@@ -0,0 +1,180 @@
+import copy
+import operator
+import threading
+import uuid
+
+# Comparison operators of where()
+OPERATORS = {
+    '==': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+}
+
+
+def _is_increment(value):
+    # firestore.Increment without importing google.cloud.firestore
+    return type(value).__name__ == 'Increment' and hasattr(value, 'value')
+
+
+def _apply(existing, data, merge):
+    result = copy.deepcopy(existing) if (merge and existing) else {}
+    for key, value in data.items():
+        if _is_increment(value):
+            current = result.get(key, 0) if merge else 0
+            result[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+        elif merge and isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = _apply(result[key], value, merge=True)
+        else:
+            result[key] = copy.deepcopy(value)
+    return result
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class DocumentReference:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path[-1]
+
+    def collection(self, name):
+        return CollectionReference(self._db, self.path + (name,))
+
+    def get(self):
+        with self._db._lock:
+            return DocumentSnapshot(self, copy.deepcopy(self._db._docs.get(self.path)))
+
+    def set(self, data, merge=False):
+        with self._db._lock:
+            self._db._write(self.path, data, merge)
+
+    def update(self, data):
+        with self._db._lock:
+            if self.path not in self._db._docs:
+                raise KeyError(f"No document to update: {'/'.join(self.path)}")
+            self._db._write(self.path, data, merge=True)
+
+    def delete(self):
+        with self._db._lock:
+            self._db._docs.pop(self.path, None)
+
+
+class CollectionReference:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path[-1]
+
+    def document(self, document_id=None):
+        return DocumentReference(self._db, self.path + (document_id or uuid.uuid4().hex,))
+
+    def order_by(self, field, direction='ASCENDING'):
+        return Query(self).order_by(field, direction)
+
+    def where(self, field, op, value):
+        return Query(self).where(field, op, value)
+
+    def limit(self, count):
+        return Query(self).limit(count)
+
+    def stream(self):
+        with self._db._lock:
+            matches = sorted(
+                (path, copy.deepcopy(data)) for path, data in self._db._docs.items()
+                if len(path) == len(self.path) + 1 and path[:-1] == self.path
+            )
+        for path, data in matches:
+            yield DocumentSnapshot(DocumentReference(self._db, path), data)
+
+
+class Query:
+    def __init__(self, collection, filters=(), orders=(), count=None):
+        self._collection = collection
+        self._filters = filters
+        self._orders = orders
+        self._count = count
+
+    def where(self, field, op, value):
+        return Query(self._collection, self._filters + ((field, OPERATORS[op], value),), self._orders, self._count)
+
+    def order_by(self, field, direction='ASCENDING'):
+        return Query(self._collection, self._filters, self._orders + ((field, direction == 'DESCENDING'),), self._count)
+
+    def limit(self, count):
+        return Query(self._collection, self._filters, self._orders, count)
+
+    def stream(self):
+        # Like Firestore, documents without a filtered or ordered field don't match
+        fields = {field for field, _, _ in self._filters} | {field for field, _ in self._orders}
+        snapshots = [
+            s for s in self._collection.stream()
+            if all(field in s._data for field in fields)
+            and all(compare(s._data[field], value) for field, compare, value in self._filters)
+        ]
+        for field, descending in reversed(self._orders):
+            snapshots.sort(key=lambda s: s._data[field], reverse=descending)
+        return iter(snapshots if self._count is None else snapshots[:self._count])
+
+
+class WriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('set', reference, data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(('update', reference, data, True))
+
+    def delete(self, reference):
+        self._writes.append(('delete', reference, None, False))
+
+    def commit(self):
+        with self._db._lock:
+            for op, reference, _, _ in self._writes:
+                if op == 'update' and reference.path not in self._db._docs:
+                    raise KeyError(f"No document to update: {'/'.join(reference.path)}")
+            for op, reference, data, merge in self._writes:
+                if op == 'delete':
+                    self._db._docs.pop(reference.path, None)
+                else:
+                    self._db._write(reference.path, data, merge)
+            self._db.commits += 1
+        self._writes = []
+
+
+class MemoryFirestore:
+    """
+    In-memory stand-in for the parts of the Firestore client this backend uses:
+    collections, documents, subcollections, merge writes, firestore.Increment,
+    batched commits and queries with where(), order_by() and limit(). Meant for local runs, benchmarks and tests.
+    """
+
+    def __init__(self):
+        self._docs = {}
+        self._lock = threading.RLock()
+        self.commits = 0
+
+    def _write(self, path, data, merge):
+        self._docs[path] = _apply(self._docs.get(path), data, merge)
+
+    def collection(self, name):
+        return CollectionReference(self, (name,))
+
+    def batch(self):
+        return WriteBatch(self)
@@ -0,0 +1,370 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+
+import tracing
+from rate_limits import RateLimitedError, retry_sync
+
+# Pusher accepts at most 10 events per batch call
+PUSHER_MAX_BATCH_SIZE = 10
+
+# Events whose payloads are streamed deltas, mapped to the key holding the text.
+# Consecutive deltas for the same channel/event/metadata are merged into one payload.
+COALESCE_KEYS = {
+    'chat-response': 'message',
+    'code-chunk': 'content',
+}
+
+
+def _is_delta(event_name, data):
+    text_key = COALESCE_KEYS.get(event_name)
+    if text_key is None or not isinstance(data.get(text_key), str):
+        return False
+    # The final chat message carries the full text and must go out as is
+    return not data.get('is_complete')
+
+
+def _metadata(event_name, data):
+    text_key = COALESCE_KEYS[event_name]
+    return {k: v for k, v in data.items() if k != text_key}
+
+
+class BatchingPublisher:
+    """
+    Drop-in replacement for pusher_client.trigger that coalesces streamed deltas.
+
+    Deltas are merged per channel/event and flushed by a timer thread window_ms
+    after the first of them was buffered, when the buffered text reaches max_bytes,
+    when a non-delta event is published or when flush() is called. The events of a
+    channel always go out in the order they were triggered, through the framer
+    (see framing.py) when one is given.
+    """
+
+    def __init__(self, pusher_client, window_ms=50, max_bytes=8192, framer=None):
+        self.pusher_client = pusher_client
+        self.window = window_ms / 1000.0
+        self.max_bytes = max_bytes
+        self.framer = framer
+        self._pending = []
+        self._pending_bytes = 0
+        self._first_pending_at = None
+        # _lock only guards the buffer, sending (which can block) holds _send_lock
+        self._lock = threading.RLock()
+        self._send_lock = threading.Lock()
+        self._window_started = threading.Condition(self._lock)
+        self._timer = None
+
+    def buffer(self, channel, event_name, data):
+        """
+        Adds a delta to the buffer when that doesn't call for a flush, so it never
+        waits on the client. Returns False, buffering nothing, otherwise.
+        """
+        if not _is_delta(event_name, data):
+            return False
+        size = len(data[COALESCE_KEYS[event_name]].encode('utf-8'))
+        with self._lock:
+            if (self._pending_bytes + size >= self.max_bytes
+                    or self._first_pending_at is not None
+                    and time.monotonic() - self._first_pending_at >= self.window):
+                return False
+            self._add(channel, event_name, data, size)
+            return True
+
+    def trigger(self, channel, event_name, data):
+        if self.buffer(channel, event_name, data):
+            return
+        size = len(data[COALESCE_KEYS[event_name]].encode('utf-8')) if _is_delta(event_name, data) else 0
+        with self._lock:
+            full = self._pending_bytes + size > self.max_bytes
+        if full:
+            self.flush()
+        with self._lock:
+            self._add(channel, event_name, data, size)
+        # A non-delta event, a full buffer or an elapsed window
+        self.flush()
+
+    def _add(self, channel, event_name, data, size):
+        last = self._pending[-1] if self._pending else None
+        if (size and last is not None
+                and last[0] == channel
+                and last[1] == event_name
+                and _is_delta(event_name, last[2])
+                and _metadata(event_name, last[2]) == _metadata(event_name, data)
+                and self._pending_bytes + size <= self.max_bytes):
+            last[2][COALESCE_KEYS[event_name]] += data[COALESCE_KEYS[event_name]]
+        else:
+            self._pending.append((channel, event_name, dict(data)))
+        if size and self._first_pending_at is None:
+            self._first_pending_at = time.monotonic()
+            self._ensure_timer()
+            self._window_started.notify()
+        self._pending_bytes += size
+
+    def flush(self):
+        # Buffers are taken and sent in the same order, one flush at a time
+        with self._send_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = []
+                self._pending_bytes = 0
+                self._first_pending_at = None
+            if not pending:
+                return
+            if self.framer is not None:
+                pending = [framed for event in pending for framed in self.framer.frame(*event)]
+
+            # One batch never mixes channels, so the queue can send them concurrently
+            by_channel = {}
+            for event in pending:
+                by_channel.setdefault(event[0], []).append(event)
+            for events in by_channel.values():
+                for start in range(0, len(events), PUSHER_MAX_BATCH_SIZE):
+                    self._send(events[start:start + PUSHER_MAX_BATCH_SIZE])
+
+    def _ensure_timer(self):
+        if self._timer is None or not self._timer.is_alive():
+            self._timer = threading.Thread(target=self._flush_when_due, name='pusher-batch-window', daemon=True)
+            self._timer.start()
+
+    def _flush_when_due(self):
+        # Without it the last deltas of a pause in the stream would wait for the next one
+        while True:
+            with self._window_started:
+                while self._first_pending_at is None or self._first_pending_at + self.window > time.monotonic():
+                    if self._first_pending_at is None:
+                        self._window_started.wait()
+                    else:
+                        self._window_started.wait(self._first_pending_at + self.window - time.monotonic())
+            self.flush()
+
+    def drain(self, timeout=None, channels=None):
+        """
+        Flush buffered deltas and wait until the underlying client has sent them,
+        only those of the given channels when channels is set.
+        """
+        self.flush()
+        if hasattr(self.pusher_client, 'drain'):
+            return self.pusher_client.drain(timeout, channels=channels)
+        return True
+
+    def _send(self, batch):
+        if len(batch) == 1:
+            channel, event_name, data = batch[0]
+            self.pusher_client.trigger(channel, event_name, data)
+            return
+        try:
+            # trigger_batch encodes the data in place, so hand it fresh dicts
+            self.pusher_client.trigger_batch([
+                {'channel': channel, 'name': event_name, 'data': data}
+                for channel, event_name, data in batch
+            ])
+        except (AttributeError, NotImplementedError):
+            # Client without batch support: fall back to one call per event, in order
+            logging.info("trigger_batch unavailable, publishing events one by one")
+            for channel, event_name, data in batch:
+                self.pusher_client.trigger(channel, event_name, data)
+
+
+class PublishQueue:
+    """
+    Bounded queue drained by worker threads so callers never wait on Pusher.
+
+    Up to `workers` calls are sent concurrently, but never two for the same
+    channel: a call waits while an earlier one sharing a channel is queued or
+    being sent, so the events of each channel arrive in order.
+
+    Exposes the same trigger/trigger_batch interface as the Pusher client. With the
+    'drop-oldest' policy a full queue discards the oldest pending chat deltas to make
+    room; everything else (code chunks, status and completion events) is never
+    dropped and the caller blocks until there is space instead.
+
+    With a rate_limit token bucket the worker waits for one token per event sent,
+    and calls answered with a rate limit are retried up to max_attempts times.
+    """
+
+    POLICIES = ('block', 'drop-oldest')
+
+    def __init__(self, pusher_client, max_size=1000, policy='block', rate_limit=None, max_attempts=1, workers=4):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown publish queue policy: {policy}")
+        self.pusher_client = pusher_client
+        self.max_size = max_size
+        self.policy = policy
+        self.rate_limit = rate_limit
+        self.max_attempts = max_attempts
+        self.workers = max(1, workers)
+        self._items = deque()
+        self._in_flight = 0
+        # Channels with a call being sent, and calls queued or sent per channel
+        self._busy = set()
+        self._pending = {}
+        self._cond = threading.Condition()
+        self._workers = []
+        self._stats = {
+            'enqueued': 0,
+            'published': 0,
+            'dropped': 0,
+            'failed': 0,
+            'max_depth': 0,
+            'publish_time_total': 0.0,
+            'publish_time_max': 0.0,
+            'queue_wait_total': 0.0,
+            'rate_limit_wait_total': 0.0,
+        }
+
+    def trigger(self, channel, event_name, data):
+        self._put(('trigger', (channel, event_name, data)), [(event_name, data)], {channel})
+
+    def trigger_batch(self, batch):
+        self._put(('trigger_batch', (batch,)), [(e['name'], e['data']) for e in batch], {e['channel'] for e in batch})
+
+    def _put(self, call, events, channels):
+        droppable = all(name == 'chat-response' and _is_delta(name, data) for name, data in events)
+        with self._cond:
+            self._ensure_workers()
+            while len(self._items) >= self.max_size:
+                if self.policy == 'drop-oldest' and self._drop_oldest():
+                    break
+                self._cond.wait()
+            self._items.append((call, droppable, time.monotonic(), tracing.current_span(), channels))
+            for channel in channels:
+                self._pending[channel] = self._pending.get(channel, 0) + 1
+            self._stats['enqueued'] += 1
+            self._stats['max_depth'] = max(self._stats['max_depth'], len(self._items))
+            self._cond.notify_all()
+
+    def _drop_oldest(self):
+        for index, (_, droppable, _, _, channels) in enumerate(self._items):
+            if droppable:
+                del self._items[index]
+                self._done(channels)
+                self._stats['dropped'] += 1
+                return True
+        return False
+
+    def _done(self, channels):
+        for channel in channels:
+            self._pending[channel] -= 1
+            if not self._pending[channel]:
+                del self._pending[channel]
+
+    def _ensure_workers(self):
+        self._workers = [worker for worker in self._workers if worker.is_alive()]
+        while len(self._workers) < self.workers:
+            worker = threading.Thread(target=self._run, name=f'pusher-publish-{len(self._workers)}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def _next_item(self):
+        """
+        The oldest call whose channels have no call in flight or queued before it.
+        """
+        blocked = set(self._busy)
+        for index, item in enumerate(self._items):
+            channels = item[4]
+            if blocked.isdisjoint(channels):
+                del self._items[index]
+                return item
+            blocked.update(channels)
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                item = self._next_item()
+                while item is None:
+                    self._cond.wait()
+                    item = self._next_item()
+                (method, args), _, enqueued_at, parent_span, channels = item
+                self._busy.update(channels)
+                self._in_flight += 1
+                queue_wait = time.monotonic() - enqueued_at
+                self._stats['queue_wait_total'] += queue_wait
+                self._cond.notify_all()
+
+            batch = args[0] if method == 'trigger_batch' else [{'channel': args[0]}]
+            rate_limit_wait = self.rate_limit.reserve(len(batch)) if self.rate_limit is not None else 0.0
+            if rate_limit_wait:
+                time.sleep(rate_limit_wait)
+
+            started_at = time.time()
+            started = time.monotonic()
+            try:
+                retry_sync(lambda: getattr(self.pusher_client, method)(*args), RateLimitedError,
+                           max_attempts=self.max_attempts)
+                failed = False
+            except Exception as e:
+                logging.error(f"Error publishing to Pusher: {str(e)}")
+                failed = True
+            elapsed = time.monotonic() - started
+            tracing.record_span('pusher_publish', started_at, elapsed, parent=parent_span, metrics={
+                'queue_wait': queue_wait,
+                'rate_limit_wait': rate_limit_wait,
+                'events': len(batch),
+            }, channel_id=batch[0]['channel'] if batch else None, failed=failed)
+
+            with self._cond:
+                self._in_flight -= 1
+                self._busy.difference_update(channels)
+                self._done(channels)
+                self._stats['failed' if failed else 'published'] += 1
+                self._stats['rate_limit_wait_total'] += rate_limit_wait
+                self._stats['publish_time_total'] += elapsed
+                self._stats['publish_time_max'] = max(self._stats['publish_time_max'], elapsed)
+                self._cond.notify_all()
+
+    def drain(self, timeout=None, channels=None):
+        """
+        Block until every queued event, or every event of the given channels,
+        has been handed to Pusher. Returns False on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while (self._items or self._in_flight) if channels is None else any(c in self._pending for c in channels):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    logging.warning(f"Publish queue drain timed out with {len(self._items)} events pending")
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def is_full(self):
+        with self._cond:
+            return len(self._items) >= self.max_size
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats['depth'] = len(self._items)
+            stats['in_flight'] = self._in_flight
+        sent = stats['published'] + stats['failed']
+        stats['publish_time_avg'] = stats['publish_time_total'] / sent if sent else 0.0
+        stats['queue_wait_avg'] = stats['queue_wait_total'] / sent if sent else 0.0
+        stats['rate_limit_wait_avg'] = stats['rate_limit_wait_total'] / sent if sent else 0.0
+        return stats
+
+
+class AsyncPublisher:
+    """
+    BatchingPublisher interface for coroutines.
+
+    Deltas that only need buffering are added inline on the event loop. Anything
+    that sends (other events, a full buffer or an elapsed window, flush() and
+    drain()) runs in a worker thread, since a full publish queue blocks it and
+    every session shares the loop.
+    """
+
+    def __init__(self, publisher):
+        self.publisher = publisher
+
+    async def trigger(self, channel, event_name, data):
+        if not self.publisher.buffer(channel, event_name, data):
+            await asyncio.to_thread(self.publisher.trigger, channel, event_name, data)
+
+    async def flush(self):
+        await asyncio.to_thread(self.publisher.flush)
+
+    async def drain(self, timeout=None, channels=None):
+        return await asyncio.to_thread(self.publisher.drain, timeout, channels)
@@ -0,0 +1,326 @@
+"""
+Process-wide admission control for outbound calls.
+
+Each upstream (OpenAI, Pusher) has token buckets for its limits, like requests
+and tokens per minute. Coroutines wait for their turn in priority order, so chat
+turns go before background file builds. A 429 pauses the whole upstream for its
+Retry-After, so other callers don't run into the same 429. Calls that still hit
+a rate limit are retried with jittered exponential backoff.
+"""
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import heapq
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+
+import tracing
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background'}
+
+_priority = contextvars.ContextVar('rate_limit_priority', default=BACKGROUND)
+
+RETRY_IN = re.compile(r'try again in (\d+(?:\.\d+)?)\s*(ms|s)\b', re.IGNORECASE)
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextlib.contextmanager
+def priority(level):
+    """
+    Calls made in the block, and in the tasks it starts, wait with this priority.
+    """
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    """
+    Holds up to `capacity` tokens, refilled at `rate` tokens per second. A call
+    asking for more than the capacity waits for a full bucket. The level goes
+    below zero when charge() reports more usage than was taken, and later calls
+    wait until it is paid back.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._level = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, limit):
+        """
+        Bucket for a per-minute limit, or None when the limit is 0 (unlimited).
+        """
+        return cls(limit / 60.0, capacity=limit) if limit else None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount):
+        """
+        Seconds until `amount` tokens are available.
+        """
+        with self._lock:
+            self._refill()
+            return max(0.0, (min(amount, self.capacity) - self._level) / self.rate)
+
+    def take(self, amount):
+        with self._lock:
+            self._refill()
+            self._level -= amount
+
+    def reserve(self, amount):
+        """
+        Take `amount` tokens now and return the seconds to wait before using them.
+        Callers reserving in turn are served in order.
+        """
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (min(amount, self.capacity) - self._level) / self.rate)
+            self._level -= amount
+            return wait
+
+
+class UpstreamLimiter:
+    """
+    Admission control for the coroutines calling one upstream, on one event loop.
+
+    acquire() waits until every bucket named in the costs has enough tokens and
+    the upstream isn't paused. Waiters are served by priority, then arrival, so
+    a waiting background call never goes before an interactive one.
+    """
+
+    def __init__(self, name, buckets=None):
+        self.name = name
+        self.buckets = {key: bucket for key, bucket in (buckets or {}).items() if bucket is not None}
+        self._waiters = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._loop = None
+        self._dispatcher = None
+        self._wakeup = None
+        self._lock = threading.Lock()
+        self._stats = {
+            level: {'calls': 0, 'queued': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+            for level in PRIORITY_NAMES.values()
+        }
+        self._pauses = 0
+
+    def _delay(self, costs):
+        delay = self._paused_until - time.monotonic()
+        for key, amount in costs.items():
+            if amount and key in self.buckets:
+                delay = max(delay, self.buckets[key].delay(amount))
+        return max(0.0, delay)
+
+    def _take(self, costs):
+        for key, amount in costs.items():
+            if amount and key in self.buckets:
+                self.buckets[key].take(amount)
+
+    async def acquire(self, priority=None, **costs):
+        """
+        Wait until a call costing `costs` (e.g. requests=1, tokens=500) may go
+        out, with the priority of the context by default. Returns the seconds waited.
+        """
+        priority = current_priority() if priority is None else priority
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Waiters of another loop can't be served from this one
+            self._loop, self._waiters, self._dispatcher = loop, [], None
+
+        queued = bool(self._waiters) or self._delay(costs) > 0
+        if queued:
+            future = loop.create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), future, costs))
+            self._wake()
+            await future
+        else:
+            self._take(costs)
+
+        waited = time.monotonic() - started
+        self._record(priority, queued, waited)
+        if queued:
+            tracing.count(f'{self.name}_queue_wait', waited)
+        return waited
+
+    def _wake(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = self._loop.create_task(self._dispatch())
+        else:
+            self._wakeup.set()
+
+    async def _dispatch(self):
+        while self._waiters:
+            _, _, future, costs = self._waiters[0]
+            if future.done():
+                # The waiter was cancelled
+                heapq.heappop(self._waiters)
+                continue
+            delay = self._delay(costs)
+            if delay <= 0:
+                heapq.heappop(self._waiters)
+                self._take(costs)
+                future.set_result(None)
+                continue
+            # Sleep until the head can go, or a new waiter may have to go first
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def charge(self, **costs):
+        """
+        Take tokens without waiting, e.g. the tokens a run actually used.
+        """
+        self._take(costs)
+
+    def pause(self, seconds):
+        """
+        Hold every call to the upstream for `seconds`, after a 429.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._pauses += 1
+        logging.warning(f"{self.name} is rate limited, pausing calls for {seconds:.1f}s")
+
+    def _record(self, priority, queued, waited):
+        with self._lock:
+            stats = self._stats[PRIORITY_NAMES.get(priority, 'background')]
+            stats['calls'] += 1
+            stats['queued'] += int(queued)
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+
+    def stats(self):
+        with self._lock:
+            stats = {name: dict(values) for name, values in self._stats.items()}
+            pauses = self._pauses
+        for values in stats.values():
+            values['wait_avg'] = values['wait_total'] / values['calls'] if values['calls'] else 0.0
+        stats['pauses'] = pauses
+        stats['waiting'] = len(self._waiters)
+        return stats
+
+
+class RateLimitedError(Exception):
+    """
+    An upstream refused a call because of a rate limit.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value):
+    """
+    Seconds from a Retry-After value (seconds or an HTTP date) or from an error
+    message saying "try again in 1.5s", None when there is none.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    match = RETRY_IN.search(value)
+    if match:
+        amount = float(match.group(1))
+        return amount / 1000 if match.group(2).lower() == 'ms' else amount
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def retry_after_from_headers(headers):
+    """
+    Seconds to wait from the retry-after-ms or retry-after header, None without them.
+    """
+    retry_after_ms = parse_retry_after(headers.get('retry-after-ms'))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    return parse_retry_after(headers.get('retry-after'))
+
+
+def retry_after_of(error):
+    """
+    The Retry-After of an error: its retry_after attribute or the headers of
+    its HTTP response.
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is not None:
+        return retry_after
+    response = getattr(error, 'response', None)
+    return retry_after_from_headers(response.headers) if response is not None else None
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0, retry_after=None):
+    """
+    Full-jitter exponential backoff for the given attempt (0 for the first
+    retry), never shorter than Retry-After.
+    """
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if retry_after is not None:
+        # Jitter on top, so callers told the same Retry-After don't come back together
+        delay = retry_after + random.uniform(0, base)
+    return delay
+
+
+async def retry_async(fn, retry_on, max_attempts=4, base=0.5, cap=30.0, limiter=None):
+    """
+    Await fn() until it doesn't raise one of retry_on, at most max_attempts
+    times. The wait before a retry honours Retry-After, which also pauses the
+    limiter so other callers hold off too.
+    """
+    for attempt in itertools.count():
+        try:
+            return await fn()
+        except retry_on as e:
+            if attempt + 1 >= max_attempts:
+                raise
+            retry_after = retry_after_of(e)
+            if limiter is not None and retry_after:
+                limiter.pause(retry_after)
+            delay = backoff_delay(attempt, base, cap, retry_after)
+            logging.warning(f"Rate limited ({str(e)}), retrying in {delay:.1f}s (attempt {attempt + 2} of {max_attempts})")
+            tracing.count('rate_limit_retries')
+            await asyncio.sleep(delay)
+
+
+def retry_sync(fn, retry_on, max_attempts=4, base=0.5, cap=30.0):
+    """
+    retry_async() for blocking calls.
+    """
+    for attempt in itertools.count():
+        try:
+            return fn()
+        except retry_on as e:
+            if attempt + 1 >= max_attempts:
+                raise
+            delay = backoff_delay(attempt, base, cap, retry_after_of(e))
+            logging.warning(f"Rate limited ({str(e)}), retrying in {delay:.1f}s (attempt {attempt + 2} of {max_attempts})")
+            time.sleep(delay)
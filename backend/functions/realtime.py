@@ -0,0 +1,189 @@
+"""
+Realtime transports delivering the events of a channel to the browser.
+
+PusherTransport sends them through Pusher. SSETransport keeps them in Firestore,
+where every instance reads them, and they are streamed as Server-Sent Events
+over an HTTP response, without the Pusher hop or its message size and rate
+limits. Both have the
+trigger/trigger_batch interface of the Pusher client, so the publish queue and
+the batching publisher work on top of either.
+"""
+import datetime
+import json
+import threading
+import time
+from collections import deque
+
+
+class RealtimeTransport:
+    """
+    Delivers events to the subscribers of a channel.
+    """
+
+    def trigger(self, channel, event_name, data):
+        raise NotImplementedError
+
+    def trigger_batch(self, batch):
+        for event in batch:
+            self.trigger(event['channel'], event['name'], event['data'])
+
+
+class PusherTransport(RealtimeTransport):
+    def __init__(self, pusher_client):
+        self.pusher_client = pusher_client
+
+    def trigger(self, channel, event_name, data):
+        self.pusher_client.trigger(channel, event_name, data)
+
+    def trigger_batch(self, batch):
+        self.pusher_client.trigger_batch(batch)
+
+
+class Subscription:
+    """
+    The events of one channel for one HTTP response, as (id, event_name, data),
+    read from the transport's event log after last_event_id.
+    """
+
+    def __init__(self, transport, channel, last_event_id):
+        self.transport = transport
+        self.channel = channel
+        self.last_event_id = last_event_id
+        self._events = deque()
+
+    def _fetch(self):
+        if not self._events:
+            self._events.extend(self.transport.read(self.channel, self.last_event_id))
+
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._fetch()
+        while not self._events:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return None
+            time.sleep(self.transport.poll_interval if remaining is None else min(self.transport.poll_interval, remaining))
+            self._fetch()
+        event = self._events.popleft()
+        self.last_event_id = event[0]
+        return event
+
+    def empty(self):
+        self._fetch()
+        return not self._events
+
+
+class SSETransport(RealtimeTransport):
+    """
+    Broker for Server-Sent Events shared by every instance through Firestore:
+    chat_handler, its job workers and realtime_events are separate services.
+
+    Each event is a document of {collection}/{channel}/events with an id
+    increasing per channel (microseconds since the epoch, made strictly
+    increasing in the instance), and subscribers poll for the events after the
+    last one they received, every poll_interval seconds at most. So a subscriber
+    (re)connecting with Last-Event-ID first receives what it missed, from any
+    instance. Events carry an expire_at channel_ttl seconds ahead, for a
+    Firestore TTL policy to delete them.
+    """
+
+    def __init__(self, db, collection='realtime_channels', channel_ttl=600, poll_interval=0.1, batch_size=100):
+        self.db = db
+        self.collection = collection
+        self.channel_ttl = channel_ttl
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def _events(self, channel):
+        return self.db.collection(self.collection).document(channel).collection('events')
+
+    def _next_ids(self, count):
+        with self._lock:
+            first = max(self._last_id + 1, time.time_ns() // 1000)
+            self._last_id = first + count - 1
+        return range(first, first + count)
+
+    def trigger(self, channel, event_name, data):
+        self.trigger_batch([{'channel': channel, 'name': event_name, 'data': data}])
+
+    def trigger_batch(self, batch):
+        expire_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.channel_ttl)
+        writes = self.db.batch()
+        for event_id, event in zip(self._next_ids(len(batch)), batch):
+            data = event['data']
+            writes.set(self._events(event['channel']).document(f"{event_id:020d}"), {
+                'id': event_id,
+                'name': event['name'],
+                # Stored as JSON, payloads can hold what Firestore maps can't
+                'data': data if isinstance(data, str) else json.dumps(data),
+                'expire_at': expire_at,
+            })
+        writes.commit()
+
+    def read(self, channel, after=None):
+        """
+        The events of a channel after the given id, oldest first, at most batch_size.
+        """
+        query = self._events(channel)
+        if after is not None:
+            query = query.where('id', '>', after)
+        return [
+            (doc['id'], doc['name'], json.loads(doc['data']))
+            for doc in (snapshot.to_dict() for snapshot in query.order_by('id').limit(self.batch_size).stream())
+        ]
+
+    def last_event_id(self, channel):
+        latest = list(self._events(channel).order_by('id', direction='DESCENDING').limit(1).stream())
+        return latest[0].get('id') if latest else 0
+
+    def subscribe(self, channel, last_event_id=None):
+        """
+        A subscription to the events published after last_event_id, or from now on.
+        """
+        if last_event_id is None:
+            last_event_id = self.last_event_id(channel)
+        return Subscription(self, channel, last_event_id)
+
+    def unsubscribe(self, subscription):
+        pass
+
+
+def format_sse(event_name, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_name}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def sse_events(transport, subscription, done=None, heartbeat=15.0, idle_timeout=None):
+    """
+    Yields the events of a subscription as SSE frames, with a comment line every
+    `heartbeat` seconds so proxies keep the connection open. Stops once done()
+    is true and every event has been sent, or after idle_timeout seconds without
+    events.
+    """
+    # done() is polled, so wait for events in short slices when it is given
+    poll = heartbeat if done is None else min(heartbeat, 0.05)
+    last_event = last_sent = time.monotonic()
+    try:
+        while True:
+            if done is not None and done() and subscription.empty():
+                return
+            event = subscription.get(timeout=poll)
+            now = time.monotonic()
+            if event is not None:
+                last_event = last_sent = now
+                event_id, event_name, data = event
+                yield format_sse(event_name, data, event_id)
+                continue
+            if idle_timeout is not None and now - last_event >= idle_timeout:
+                return
+            if now - last_sent >= heartbeat:
+                last_sent = now
+                yield ": keep-alive\n\n"
+    finally:
+        transport.unsubscribe(subscription)
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+
+
+def build_dependency_graph(file_list):
+    """
+    Work out which files of the design each file depends on.
+
+    src modules only need the design, tests need every src module, Cargo.toml needs
+    the sources and tests, and README.md needs everything else. The returned dict
+    keeps the order of file_list.
+    """
+    src_files = [f for f in file_list if f.startswith('src/')]
+    test_files = [f for f in file_list if f.startswith('test/')]
+
+    graph = {}
+    for file_path in file_list:
+        if file_path in src_files:
+            deps = []
+        elif file_path in test_files:
+            deps = src_files
+        elif file_path == 'Cargo.toml':
+            deps = src_files + test_files
+        elif file_path.endswith('.md'):
+            deps = [f for f in file_list if f != file_path and not f.endswith('.md')]
+        else:
+            deps = src_files
+        graph[file_path] = [d for d in deps if d != file_path]
+    return graph
+
+
+def dependents_of(graph, files):
+    """
+    The files of the graph depending on any of `files`, directly or through
+    other files, and `files` themselves, in graph order.
+    """
+    affected = {f for f in files if f in graph}
+    grew = True
+    while grew:
+        grew = False
+        for path, deps in graph.items():
+            if path not in affected and any(d in affected for d in deps):
+                affected.add(path)
+                grew = True
+    return [path for path in graph if path in affected]
+
+
+async def run_dag(graph, build_fn, max_concurrency=4, completed=None):
+    """
+    Await build_fn(file_path, dependency_results) for every node of the graph,
+    running up to max_concurrency independent files concurrently. Nodes found in
+    `completed` are not built again, their results are reused.
+
+    Each build is a task, running in a copy of the caller's context. Returns the
+    results keyed by file path in graph order. If a build fails, no new builds
+    are started and the first error is raised once the running ones have finished.
+    """
+    missing = {dep for deps in graph.values() for dep in deps if dep not in graph}
+    if missing:
+        raise ValueError(f"Unknown dependencies in generation plan: {sorted(missing)}")
+
+    results = {path: result for path, result in (completed or {}).items() if path in graph}
+    remaining = {path: deps for path, deps in graph.items() if path not in results}
+    running = {}
+    error = None
+
+    while remaining or running:
+        if error is None:
+            ready = [path for path, deps in remaining.items() if all(d in results for d in deps)]
+            for path in ready[:max(1, max_concurrency) - len(running)]:
+                dependency_results = {d: results[d] for d in remaining.pop(path)}
+                running[asyncio.create_task(build_fn(path, dependency_results))] = path
+
+        if not running:
+            if remaining and error is None:
+                raise ValueError(f"Dependency cycle in generation plan: {sorted(remaining)}")
+            break
+
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            path = running.pop(task)
+            try:
+                results[path] = task.result()
+            except Exception as e:
+                logging.error(f"Building {path} failed: {str(e)}")
+                if error is None:
+                    error = e
+
+    if error is not None:
+        raise error
+    return {path: results[path] for path in graph}
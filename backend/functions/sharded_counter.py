@@ -0,0 +1,114 @@
+import datetime
+import logging
+import random
+import threading
+
+
+def _increment(value):
+    from google.cloud.firestore import Increment
+    return Increment(value)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+class ShardedCounter:
+    """
+    Spreads writes to a counters document over num_shards shard documents.
+
+    Numeric fields are added to a randomly chosen shard with Increment, other
+    fields (timestamps, last error...) are stored on that shard along with the
+    time they were written. read() sums the numbers over all shards and keeps the
+    most recent value of every other field. Values already present on the parent
+    document, written before sharding, are included in the totals.
+    """
+
+    def __init__(self, db, collection, document, num_shards=10):
+        self.db = db
+        self.num_shards = num_shards
+        self.ref = db.collection(collection).document(document)
+
+    def increment(self, fields):
+        shard = self.ref.collection('shards').document(str(random.randrange(self.num_shards)))
+        now = datetime.datetime.now()
+        data = {}
+        updated = {}
+        for name, value in fields.items():
+            if _is_number(value):
+                data[name] = _increment(value)
+            else:
+                data[name] = value
+                updated[name] = now
+        if updated:
+            data['_updated'] = updated
+        shard.set(data, merge=True)
+
+    def read(self):
+        totals = {}
+        latest = {}
+
+        def add(doc):
+            updated = doc.pop('_updated', {})
+            for name, value in doc.items():
+                if _is_number(value):
+                    totals[name] = totals.get(name, 0) + value
+                else:
+                    written_at = updated.get(name)
+                    if name not in latest or (written_at and (latest[name][0] is None or written_at > latest[name][0])):
+                        latest[name] = (written_at, value)
+
+        parent = self.ref.get()
+        if parent.exists:
+            add(parent.to_dict())
+        for snapshot in self.ref.collection('shards').stream():
+            add(snapshot.to_dict())
+
+        totals.update({name: value for name, (_, value) in latest.items()})
+        return totals
+
+
+class BufferedCounter:
+    """
+    Accumulates increments in process and writes them to a ShardedCounter at most
+    once every flush_interval seconds, as a single shard write.
+    """
+
+    def __init__(self, counter, flush_interval=10.0):
+        self.counter = counter
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def increment(self, fields, overwrite=True):
+        with self._lock:
+            for name, value in fields.items():
+                if _is_number(value):
+                    self._pending[name] = self._pending.get(name, 0) + value
+                elif overwrite or name not in self._pending:
+                    self._pending[name] = value
+            if self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if pending:
+            try:
+                self.counter.increment(pending)
+            except Exception as e:
+                logging.error(f"Error flushing counters: {str(e)}")
+                # Put the increments back so they go out with the next flush,
+                # without overwriting values written since
+                self.increment(pending, overwrite=False)
+
+    def read(self):
+        self.flush()
+        return self.counter.read()
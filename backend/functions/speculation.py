@@ -0,0 +1,94 @@
+"""
+Planning the build while the designer is still writing.
+
+The design is parsed as it streams (DesignStreamParser). The files found so far
+are sent to the frontend as initial-structure updates, and the first file of
+the plan is built as soon as its section of the design is complete, on the
+design written so far. Once the whole design is in, reconcile() keeps that
+build when the file's plan didn't change and cancels it otherwise, so the file
+is built again with the others.
+"""
+import asyncio
+import logging
+
+import tracing
+from design_parser import design_sections
+
+
+def file_plan(designer_output, file_path, file_list):
+    """
+    What a source file is built from: its sections of the design and the
+    source modules it sits with.
+    """
+    return (
+        design_sections(designer_output).get(file_path),
+        frozenset(f for f in file_list if f.startswith('src/')),
+    )
+
+
+class SpeculativePlanner:
+    """
+    Receives the DesignStreamParser of a designer run through on_design().
+
+    build_fn(design, file_path) is the coroutine building a file on a partial
+    design, structure_fn(file_list, project_name) builds the initial-structure
+    payload. Nothing is sent or built while the parser's confidence is below
+    min_confidence.
+    """
+
+    def __init__(self, publisher, channel_id, build_fn, structure_fn, min_confidence=0.7, speculate=True):
+        self.publisher = publisher
+        self.channel_id = channel_id
+        self.build_fn = build_fn
+        self.structure_fn = structure_fn
+        self.min_confidence = min_confidence
+        self.speculate = speculate
+        self.structure_sent = False
+        self.file_path = None
+        self.task = None
+        self._plan = None
+        self._basis = None
+
+    async def on_design(self, parser):
+        if parser.confidence < self.min_confidence:
+            return
+        plan = (parser.project_name, parser.file_list())
+        if plan != self._plan:
+            self._plan = plan
+            await self.publisher.trigger(self.channel_id, 'initial-structure', {
+                'structure': self.structure_fn(plan[1], plan[0]),
+                # Later updates keep the files the frontend already has
+                'update': self.structure_sent,
+            })
+            self.structure_sent = True
+
+        if self.speculate and self.task is None and plan[1] and parser.section_complete(plan[1][0]):
+            self.file_path = plan[1][0]
+            self._basis = file_plan(parser.text, self.file_path, plan[1])
+            logging.info(f"Building {self.file_path} speculatively while the designer is writing")
+            self.task = asyncio.get_running_loop().create_task(self.build_fn(parser.text, self.file_path))
+
+    async def reconcile(self, designer_output, file_list, keep=True):
+        """
+        The speculative builds still valid for the final design, as
+        {file_path: task}. The others are cancelled.
+        """
+        if self.task is None:
+            return {}
+        if keep and self.file_path in file_list and file_plan(designer_output, self.file_path, file_list) == self._basis:
+            logging.info(f"Keeping the speculative build of {self.file_path}")
+            tracing.count('speculative_builds_kept')
+            return {self.file_path: self.task}
+
+        logging.info(f"The plan of {self.file_path} changed, discarding its speculative build")
+        tracing.count('speculative_builds_discarded')
+        self.cancel()
+        try:
+            await self.task
+        except (asyncio.CancelledError, Exception):
+            pass
+        return {}
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
@@ -0,0 +1,73 @@
+"""
+Records the assistant events an EventHandler receives, so runs can be replayed
+offline (see backend/benchmarks/fakes.py).
+
+With STREAM_RECORD_DIR set, every run is written to its own JSON-lines file: a
+header line with the stage, thread and file path, then one line per event with
+its offset in seconds from the start of the run.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+STREAM_RECORD_DIR = os.getenv("STREAM_RECORD_DIR")
+
+
+class StreamRecorder:
+    def __init__(self, directory, stage, thread_id, file_path=None):
+        os.makedirs(directory, exist_ok=True)
+        name = f"{int(time.time() * 1000)}-{stage}-{uuid.uuid4().hex[:8]}.jsonl"
+        self.path = os.path.join(directory, name)
+        self.header = {'stage': stage, 'thread_id': thread_id, 'file_path': file_path}
+        self._events = []
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        with self._lock:
+            self._events.append({
+                'offset': time.perf_counter() - self._started,
+                'event': event.event,
+                'data': event.data.to_dict(mode='json'),
+            })
+
+    def close(self, file_path=None):
+        if file_path is not None:
+            self.header['file_path'] = file_path
+        try:
+            with self._lock, open(self.path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(self.header) + '\n')
+                for event in self._events:
+                    f.write(json.dumps(event) + '\n')
+        except OSError as e:
+            logging.error(f"Error writing stream recording {self.path}: {str(e)}")
+
+
+def recorder_for(stage, thread_id):
+    """
+    A recorder for one run when STREAM_RECORD_DIR is set, otherwise None.
+    """
+    if not STREAM_RECORD_DIR:
+        return None
+    return StreamRecorder(STREAM_RECORD_DIR, stage, thread_id)
+
+
+def load_recording(path):
+    """
+    Returns (header, events) of a recording, events being dicts with offset, event and data.
+    """
+    with open(path, encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f if line.strip()]
+    return lines[0], lines[1:]
+
+
+def load_recordings(directory):
+    """
+    All recordings of a directory, oldest first.
+    """
+    names = sorted(n for n in os.listdir(directory) if re.match(r'\d+-.*\.jsonl$', n))
+    return [load_recording(os.path.join(directory, n)) for n in names]
@@ -0,0 +1,108 @@
+"""
+Warm pool of empty OpenAI threads.
+
+Creating a thread is a round trip on the critical path of every new chat and of
+every file build. ThreadPool creates them ahead of time in the background, so
+acquire() usually returns one right away and starts creating its replacement.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from collections import deque
+
+
+class ThreadPool:
+    """
+    Keeps up to `size` empty threads of an AsyncOpenAI client (or anything with
+    an async beta.threads.create()), created at most max_age seconds ago. Older
+    threads are dropped and deleted in the background.
+
+    Refills run as tasks of the event loop the pool is used on, in an empty
+    context so they are neither counted in the caller's spans nor given its
+    rate limit priority. With size 0 every acquire() creates a thread.
+    """
+
+    def __init__(self, client, size=4, max_age=3600.0, delete_expired=True):
+        self.client = client
+        self.size = size
+        self.max_age = max_age
+        self.delete_expired = delete_expired
+        self._threads = deque()
+        self._pending = 0
+        self._loop = None
+        self._tasks = set()
+        self._stats = {'hits': 0, 'misses': 0, 'created': 0, 'expired': 0, 'failed': 0}
+
+    async def acquire(self):
+        """
+        The id of an empty thread, from the pool when one is ready.
+        """
+        self._bind()
+        self._expire()
+        if self._threads:
+            thread_id, _ = self._threads.popleft()
+            self._stats['hits'] += 1
+        else:
+            self._stats['misses'] += 1
+            thread_id = None
+        self.fill()
+        if thread_id is None:
+            thread_id = (await self.client.beta.threads.create()).id
+        return thread_id
+
+    def fill(self):
+        """
+        Start creating the threads missing from the pool. Must run on the pool's event loop.
+        """
+        self._bind()
+        for _ in range(self.size - len(self._threads) - self._pending):
+            self._pending += 1
+            self._spawn(self._create())
+
+    async def _create(self):
+        loop = self._loop
+        try:
+            thread = await self.client.beta.threads.create()
+        except Exception as e:
+            self._stats['failed'] += 1
+            logging.warning(f"Could not create a thread for the pool: {str(e)}")
+            return
+        finally:
+            if self._loop is loop:
+                self._pending -= 1
+        self._stats['created'] += 1
+        self._threads.append((thread.id, time.monotonic()))
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._threads and now - self._threads[0][1] >= self.max_age:
+            thread_id, _ = self._threads.popleft()
+            self._stats['expired'] += 1
+            if self.delete_expired:
+                self._spawn(self._delete(thread_id))
+
+    async def _delete(self, thread_id):
+        try:
+            await self.client.beta.threads.delete(thread_id)
+        except Exception as e:
+            logging.warning(f"Could not delete expired thread {thread_id}: {str(e)}")
+
+    def _spawn(self, coro):
+        task = self._loop.create_task(coro, context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Threads being created on another loop won't arrive here
+            self._loop, self._pending, self._tasks = loop, 0, set()
+
+    def stats(self):
+        stats = dict(self._stats)
+        acquired = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / acquired if acquired else 0.0
+        stats['available'] = len(self._threads)
+        stats['pending'] = self._pending
+        return stats
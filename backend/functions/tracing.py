@@ -0,0 +1,210 @@
+"""
+Span-based latency tracing for the chat and generation pipeline.
+
+Spans are written to the sinks registered with add_sink(); TRACE_SINK_PATH
+registers a JSON-lines file at import. Summarize a trace file per stage with
+
+    python tracing.py traces.jsonl
+"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_sinks = []
+_counts_lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, name, parent=None, **tags):
+        self.name = name
+        self.parent = parent
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent else None
+        self.tags = dict(parent.inherited_tags(), **tags) if parent else dict(tags)
+        self.metrics = {}
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+
+    def inherited_tags(self):
+        return {k: v for k, v in self.tags.items() if k in ('channel_id', 'thread_id', 'job_id')}
+
+    def tag(self, **tags):
+        self.tags.update(tags)
+
+    def metric(self, **metrics):
+        self.metrics.update(metrics)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._started
+        emit(self.to_dict())
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'start': self.start,
+            'duration': self.duration,
+            'tags': self.tags,
+            'metrics': self.metrics,
+        }
+
+
+class JsonLinesSink:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+def add_sink(sink):
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def emit(record):
+    for sink in list(_sinks):
+        try:
+            sink(record)
+        except Exception as e:
+            logging.error(f"Error writing span {record.get('name')}: {str(e)}")
+
+
+def current_span():
+    return _current_span.get()
+
+
+def count(metric, n=1):
+    """
+    Add n to a counter metric of the current span and of every span enclosing it,
+    so a request's root span holds the total (e.g. openai_round_trips).
+    """
+    span = _current_span.get()
+    with _counts_lock:
+        while span is not None:
+            span.metrics[metric] = span.metrics.get(metric, 0) + n
+            span = span.parent
+
+
+def tag(**tags):
+    """
+    Add tags to the span currently running in this context, if any.
+    """
+    span = _current_span.get()
+    if span is not None:
+        span.tag(**tags)
+
+
+@contextmanager
+def span(name, **tags):
+    current = Span(name, parent=_current_span.get(), **tags)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.tag(error=str(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+
+
+def traced(name):
+    """
+    Decorator running the function, or coroutine function, inside a span.
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_span(name, start, duration, metrics=None, parent=None, **tags):
+    """
+    Emit a span measured outside a `with span(...)` block, e.g. across callbacks
+    or on another thread. parent defaults to the span running in this context.
+    """
+    current = Span(name, parent=parent or _current_span.get(), **tags)
+    current.start = start
+    current.duration = duration
+    current.metrics.update(metrics or {})
+    emit(current.to_dict())
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(records):
+    """
+    Per stage (span name): count and p50/p95/p99 of the duration and of every metric.
+    """
+    values = {}
+    for record in records:
+        stage = values.setdefault(record['name'], {})
+        if record.get('duration') is not None:
+            stage.setdefault('duration', []).append(record['duration'])
+        for metric, value in (record.get('metrics') or {}).items():
+            if isinstance(value, (int, float)):
+                stage.setdefault(metric, []).append(value)
+
+    summary = {}
+    for name, stage in values.items():
+        summary[name] = {'count': len(stage.get('duration', []))}
+        for metric, samples in stage.items():
+            summary[name][metric] = {
+                'p50': percentile(samples, 50),
+                'p95': percentile(samples, 95),
+                'p99': percentile(samples, 99),
+            }
+    return summary
+
+
+def load_records(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+if os.getenv("TRACE_SINK_PATH"):
+    add_sink(JsonLinesSink(os.getenv("TRACE_SINK_PATH")))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        sys.exit("usage: python tracing.py traces.jsonl")
+    print(json.dumps(summarize(load_records(sys.argv[1])), indent=2))
@@ -0,0 +1,136 @@
+"""
+Pooled HTTP transports shared by the OpenAI and Pusher clients.
+
+Imported when the first client is created, it pulls in httpx, requests and pusher.
+"""
+import importlib.util
+import logging
+import threading
+
+import httpx
+import requests
+from pusher.http import process_response
+from pusher.requests import RequestsBackend
+from requests.adapters import HTTPAdapter
+
+import tracing
+from rate_limits import RateLimitedError, retry_after_from_headers
+
+
+class TransportMetrics:
+    """
+    Counts requests and the connections opened for them. Every request that
+    didn't open a connection reused a pooled one.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def snapshot(self):
+        with self._lock:
+            requests_, new_connections = self.requests, self.new_connections
+        reused = max(0, requests_ - new_connections)
+        return {
+            'requests': requests_,
+            'new_connections': new_connections,
+            'reused_connections': reused,
+            'reuse_ratio': reused / requests_ if requests_ else 0.0,
+        }
+
+
+def create_openai_http_client(metrics, max_connections=20, max_keepalive=10, keepalive_expiry=30.0,
+                              connect_timeout=5.0, read_timeout=600.0, http2=False, request_hooks=(),
+                              response_hooks=()):
+    """
+    The async httpx client for AsyncOpenAI: one keep-alive pool for every stream
+    of the instance, counting requests and TCP connects in `metrics`. HTTP/2
+    needs the optional h2 package and is turned off with a warning when it is
+    missing. request_hooks and response_hooks must be coroutine functions.
+    """
+    from openai import DefaultAsyncHttpxClient
+
+    if http2 and importlib.util.find_spec('h2') is None:
+        logging.warning("HTTP/2 requested for OpenAI but the h2 package isn't installed, using HTTP/1.1")
+        http2 = False
+
+    async def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            metrics.record_new_connection()
+            tracing.count('openai_new_connections')
+
+    async def on_request(request):
+        metrics.record_request()
+        request.extensions['trace'] = trace
+
+    return DefaultAsyncHttpxClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        ),
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        event_hooks={'request': [on_request, *request_hooks], 'response': list(response_hooks)}
+    )
+
+
+def create_pusher_session(pool_maxsize=10, max_retries=2):
+    """
+    A requests session keeping up to pool_maxsize connections to the Pusher host alive.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_maxsize, max_retries=max_retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class PooledRequestsBackend(RequestsBackend):
+    """
+    Pusher backend sending through a shared session, passed with the client's
+    backend options: pusher.Pusher(..., backend=PooledRequestsBackend, session=s, metrics=m).
+    A 429 raises RateLimitedError with the Retry-After of the response.
+    """
+
+    def __init__(self, client, session=None, metrics=None, **options):
+        super().__init__(client, **options)
+        if session is not None:
+            self.session = session
+        self.metrics = metrics
+
+    def _connections_opened(self, url):
+        pools = self.session.get_adapter(url).poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def _send(self, request):
+        resp = self.session.request(
+            request.method,
+            request.url,
+            headers=request.headers,
+            data=request.body,
+            timeout=self.client.timeout,
+            **self.options)
+        if resp.status_code == 429:
+            raise RateLimitedError(f"Pusher answered 429: {resp.text}", retry_after=retry_after_from_headers(resp.headers))
+        return process_response(resp.status_code, resp.text)
+
+    def send_request(self, request):
+        if self.metrics is None:
+            return self._send(request)
+        opened = self._connections_opened(request.url)
+        try:
+            return self._send(request)
+        finally:
+            self.metrics.record_request()
+            if self._connections_opened(request.url) > opened:
+                self.metrics.record_new_connection()
@@ -0,0 +1,23 @@
+"""
+The tests run main offline on the fakes of benchmarks/fakes.py.
+"""
+import os
+import sys
+
+# Keep every backend in process before main reads its configuration
+os.environ.setdefault('FIRESTORE_BACKEND', 'memory')
+os.environ.setdefault('JOB_STORE', 'memory')
+os.environ['GENERATION_CACHE_BACKEND'] = 'none'
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks')
+if BENCHMARKS_DIR not in sys.path:
+    sys.path.insert(0, BENCHMARKS_DIR)
+
+import fakes  # noqa: E402  (puts backend/functions on sys.path)
+import pytest  # noqa: E402
+
+
+@pytest.fixture
+def main():
+    import main
+    return main
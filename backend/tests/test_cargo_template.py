@@ -0,0 +1,23 @@
+import pytest
+from cargo_template import generate_cargo_toml, package_name
+
+CONTRACT = "```rust\nuse soroban_sdk::{contract, contractimpl};\n\n#[contract]\npub struct Token;\n```\n"
+
+
+@pytest.mark.parametrize('project_name, expected', [
+    ('token_vault', 'token-vault'),
+    ('my token', 'my-token'),
+    ('MyToken', 'my-token'),
+    ('  Token: V2 (beta) ', 'token-v2-beta'),
+    ('2fa vault', 'contract-2fa-vault'),
+    ('***', 'contract'),
+    ('', 'contract'),
+    (None, 'contract'),
+])
+def test_package_name(project_name, expected):
+    assert package_name(project_name) == expected
+
+
+def test_cargo_toml_uses_the_package_name():
+    cargo_toml = generate_cargo_toml('My Token', {'src/lib.rs': CONTRACT}, '21.0.0')
+    assert 'name = "my-token"' in cargo_toml
@@ -0,0 +1,43 @@
+import fakes
+from flask import Flask, request
+
+
+def test_preflight_makes_no_openai_call(main):
+    openai_client = fakes.FakeOpenAI(fakes.default_recordings())
+    fakes.install(main, openai_client, fakes.FakePusher())
+
+    with Flask(__name__).test_request_context(method='OPTIONS'):
+        response = main.chat_handler(request)
+    assert response.status_code == 200
+    assert response.headers['Access-Control-Allow-Methods'] == 'POST'
+    main.run_async(main.asyncio.sleep(0.05))
+    assert openai_client.calls == {}
+    assert 'thread_pool' not in main._clients
+
+
+def test_only_an_explicit_edit_request_edits_the_saved_contract(main):
+    recordings = [
+        fakes.synthetic_run('questioner', "Generating a new contract.", tool_call='generate_contract',
+                            tool_arguments={'edit_contract': False}),
+        fakes.synthetic_run('questioner', "Changing your contract.", tool_call='generate_contract',
+                            tool_arguments={'edit_contract': True}),
+    ] + fakes.default_recordings()
+    fakes.install(main, fakes.FakeOpenAI(recordings), fakes.FakePusher())
+    manager = main.get_job_manager()
+
+    def chat(thread_id, user_input):
+        with Flask(__name__).test_request_context(method='POST', json={
+            'input': user_input, 'thread_id': thread_id, 'channel_id': 'channel', 'contract_id': 'saved'
+        }):
+            response = main.chat_handler(request)
+        assert response.status_code == 202
+        return response.get_json()
+
+    body = chat(None, 'Now a token faucet')
+    assert body['message'] == 'Contract generation started'
+    assert manager.get(body['job_id'])['base_contract_id'] is None
+
+    body = chat(body['thread_id'], 'Add a cap')
+    assert body['message'] == 'Contract edit started'
+    assert manager.get(body['job_id'])['base_contract_id'] == 'saved'
+    manager.queue.join()
@@ -0,0 +1,91 @@
+from contract_store import (file_doc_id, iter_contract_files, load_contract_file, load_contract_metadata,
+                            load_contract_version, save_contract, update_contract)
+from memory_firestore import MemoryFirestore
+
+FILES = {
+    'src/lib.rs': 'pub mod storage;\n',
+    'src/storage.rs': 'pub struct Storage;\n' * 400,
+    'Cargo.toml': '[package]\nname = "token-vault"\n',
+}
+
+
+def file_doc(db, contract_id, file_path):
+    return db.collection('contracts').document(contract_id).collection('files').document(file_doc_id(file_path)).get()
+
+
+def test_save_contract_writes_a_document_per_file():
+    db = MemoryFirestore()
+    assert save_contract(db, 'c1', {'project_name': 'Token Vault'}, FILES) == 'c1'
+
+    assert load_contract_metadata(db, 'c1') == {'project_name': 'Token Vault', 'file_paths': list(FILES)}
+    for file_path, content in FILES.items():
+        assert load_contract_file(db, 'c1', file_path) == content
+    assert load_contract_file(db, 'c1', 'src/missing.rs') is None
+    assert load_contract_file(db, 'missing', 'src/lib.rs') is None
+    assert load_contract_metadata(db, 'missing') is None
+
+
+def test_files_above_the_threshold_are_compressed():
+    db = MemoryFirestore()
+    save_contract(db, 'c1', {}, FILES, compress_threshold=1024)
+
+    small = file_doc(db, 'c1', 'src/lib.rs').to_dict()
+    assert (small['encoding'], small['content']) == ('identity', FILES['src/lib.rs'])
+    large = file_doc(db, 'c1', 'src/storage.rs').to_dict()
+    assert large['encoding'] == 'zlib'
+    assert large['size'] == len(FILES['src/storage.rs'])
+    assert len(large['content']) < 1024
+    assert load_contract_file(db, 'c1', 'src/storage.rs') == FILES['src/storage.rs']
+
+
+def test_iter_contract_files_keeps_the_generation_order():
+    db = MemoryFirestore()
+    files = {f'src/file_{n}.rs': str(n) for n in (3, 1, 10, 2)}
+    save_contract(db, 'c1', {}, files)
+    assert list(iter_contract_files(db, 'c1')) == list(files.items())
+    assert list(iter_contract_files(db, 'missing')) == []
+
+
+def test_update_contract_rewrites_only_the_changed_files():
+    db = MemoryFirestore()
+    save_contract(db, 'c1', {'version': 1}, FILES)
+    storage_doc = file_doc(db, 'c1', 'src/storage.rs').to_dict()
+
+    files = {'src/admin.rs': 'pub fn admin() {}\n', 'src/lib.rs': 'pub mod admin;\n', 'src/storage.rs': FILES['src/storage.rs']}
+    update_contract(db, 'c1', {'version': 2}, files, ['src/admin.rs', 'src/lib.rs'], removed_files=['Cargo.toml'])
+
+    assert load_contract_metadata(db, 'c1') == {'version': 2, 'file_paths': list(files)}
+    assert list(iter_contract_files(db, 'c1')) == list(files.items())
+    assert not file_doc(db, 'c1', 'Cargo.toml').exists
+    # Unchanged files only get their new index
+    assert file_doc(db, 'c1', 'src/storage.rs').to_dict() == dict(storage_doc, index=2)
+
+
+def test_legacy_contracts_keep_their_files_inline():
+    db = MemoryFirestore()
+    db.collection('contracts').document('legacy').set({
+        'project_name': 'Token Vault',
+        'files': {file_path: {'content': content} for file_path, content in FILES.items()},
+    })
+
+    assert load_contract_metadata(db, 'legacy') == {'project_name': 'Token Vault', 'file_paths': list(FILES)}
+    assert load_contract_file(db, 'legacy', 'src/storage.rs') == FILES['src/storage.rs']
+    assert load_contract_file(db, 'legacy', 'src/missing.rs') is None
+    assert list(iter_contract_files(db, 'legacy')) == list(FILES.items())
+
+
+def test_updates_keep_the_versions_they_replace():
+    db = MemoryFirestore()
+    v1 = {'src/lib.rs': 'lib 1', 'src/storage.rs': 'storage 1', 'README.md': 'readme 1'}
+    save_contract(db, 'c1', {'version': 1}, v1)
+    v2 = {'src/lib.rs': 'lib 2', 'src/admin.rs': 'admin 2', 'README.md': 'readme 1'}
+    update_contract(db, 'c1', {'version': 2}, v2, ['src/lib.rs', 'src/admin.rs'], removed_files=['src/storage.rs'])
+    v3 = {'src/lib.rs': 'lib 2', 'src/admin.rs': 'admin 3', 'README.md': 'readme 3'}
+    update_contract(db, 'c1', {'version': 3}, v3, ['src/admin.rs', 'README.md'])
+
+    assert load_contract_version(db, 'c1', 1) == v1
+    assert list(load_contract_version(db, 'c1', 1)) == list(v1)
+    assert load_contract_version(db, 'c1', 2) == v2
+    assert load_contract_version(db, 'c1', 3) == v3
+    assert load_contract_version(db, 'c1', 4) is None
+    assert load_contract_version(db, 'missing', 1) is None
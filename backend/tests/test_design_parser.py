@@ -0,0 +1,35 @@
+import fakes
+from design_parser import DesignStreamParser, _close_fence, _file_sections, parse_design_document
+
+DESIGN = fakes.SAMPLE_DESIGN + """
+Project name:
+  Token Vault
+
+```rust
+# not a heading
+fn deposit() {}
+```
+
+## src/storage.rs
+
+The balances, by depositor.
+
+## Testing
+"""
+
+
+def test_stream_parser_matches_a_full_parse_after_every_line():
+    parser = DesignStreamParser()
+    for start in range(0, len(DESIGN), 7):
+        if not parser.feed(DESIGN[start:start + 7]):
+            continue
+        assert (parser.project_name, parser.src_files, parser.test_files, parser.confidence) == \
+            parse_design_document(_close_fence(parser.text))
+        sections = list(_file_sections(parser.text.splitlines()))
+        for file_path in ('src/lib.rs', 'src/storage.rs'):
+            assert parser.section_complete(file_path) == any(
+                file_path in paths and end is not None for paths, _, end in sections
+            )
+    parser.close()
+    assert (parser.project_name, parser.src_files, parser.test_files, parser.confidence) == parse_design_document(DESIGN)
+    assert parser.section_complete('src/storage.rs')
@@ -0,0 +1,58 @@
+import fakes
+from flask import Flask, request
+from jobs import InMemoryJobQueue, InMemoryJobStore, JobManager
+
+
+def test_job_moves_through_the_states_of_its_handler():
+    seen = []
+
+    def handler(job):
+        seen.append(manager.get(job['job_id'])['state'])
+        for state in ('designing', 'building', 'saving'):
+            manager.set_state(job['job_id'], state)
+            seen.append(manager.get(job['job_id'])['state'])
+        return {'contract_id': 'c1'}
+
+    manager = JobManager(InMemoryJobStore(), InMemoryJobQueue(), handler)
+    job_id = manager.submit(user_input='A token vault')
+    manager.queue.join()
+
+    assert seen == ['queued', 'designing', 'building', 'saving']
+    job = manager.get(job_id)
+    assert (job['state'], job['contract_id'], job['error']) == ('done', 'c1', None)
+    assert job['updated_at'] > job['created_at']
+
+
+def test_a_raising_handler_fails_the_job():
+    def handler(job):
+        manager.set_state(job['job_id'], 'building')
+        raise RuntimeError('Run failed')
+
+    manager = JobManager(InMemoryJobStore(), InMemoryJobQueue(), handler)
+    job_id = manager.submit()
+    manager.queue.join()
+
+    job = manager.get(job_id)
+    assert (job['state'], job['contract_id'], job['error']) == ('failed', None, 'Run failed')
+
+
+def test_job_status(main):
+    fakes.install(main, fakes.FakeOpenAI(fakes.default_recordings()), fakes.FakePusher())
+    manager = JobManager(main.get_job_manager().store, InMemoryJobQueue(), lambda job: {'contract_id': 'c1'})
+    job_id = manager.submit(user_input='A token vault', channel_id='channel')
+    manager.queue.join()
+
+    def status(job_id):
+        with Flask(__name__).test_request_context(method='GET', query_string={'job_id': job_id}):
+            return main.job_status(request)
+
+    response = status('missing')
+    assert response.status_code == 404
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+
+    response = status(job_id)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert (body['state'], body['contract_id'], body['channel_id']) == ('done', 'c1', 'channel')
+    assert 'user_input' not in body
+    assert isinstance(body['updated_at'], str)
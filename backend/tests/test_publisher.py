@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+import fakes
+from publisher import AsyncPublisher, BatchingPublisher, PublishQueue
+
+
+def test_batching_window_flushes_without_a_next_delta():
+    pusher = fakes.FakePusher()
+    publisher = BatchingPublisher(pusher, window_ms=20)
+    publisher.trigger('channel', 'chat-response', {'message': 'Hel'})
+    publisher.trigger('channel', 'chat-response', {'message': 'lo'})
+
+    deadline = time.monotonic() + 2
+    while not pusher.events and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert [e[3] for e in pusher.events_for('channel')] == [{'message': 'Hello'}]
+
+
+def test_flush_never_blocks_the_event_loop():
+    # Sending the first batch fills the queue, the others wait for room
+    queue = PublishQueue(fakes.FakePusher(latency=0.3), max_size=2, workers=1)
+    publisher = AsyncPublisher(BatchingPublisher(queue, window_ms=10000))
+
+    async def scenario():
+        for n in range(5):
+            await publisher.trigger(f'channel-{n}', 'chat-response', {'message': 'delta'})
+        stalls = []
+
+        async def tick():
+            while True:
+                started = time.monotonic()
+                await asyncio.sleep(0.01)
+                stalls.append(time.monotonic() - started)
+
+        ticker = asyncio.create_task(tick())
+        await asyncio.sleep(0.05)
+        await publisher.flush()
+        await publisher.drain(5)
+        ticker.cancel()
+        return max(stalls)
+
+    assert asyncio.run(scenario()) < 0.2
@@ -0,0 +1,78 @@
+import json
+
+import fakes
+import pytest
+from flask import Flask, request
+from realtime import SSETransport
+
+
+@pytest.fixture
+def sse_main(main, monkeypatch):
+    monkeypatch.setattr(main, 'REALTIME_TRANSPORT', 'sse')
+    monkeypatch.setattr(main, 'SSE_POLL_INTERVAL', 0.01)
+    fakes.install(main, fakes.FakeOpenAI(fakes.default_recordings()), fakes.FakePusher())
+    return main
+
+
+def parse_frames(frames):
+    events = []
+    for frame in frames:
+        fields = dict(line.split(': ', 1) for line in frame.strip().split('\n') if not line.startswith(':'))
+        if fields:
+            events.append((fields.get('id'), fields['event'], json.loads(fields['data'])))
+    return events
+
+
+def test_stream_chat_streams_the_answer(sse_main):
+    with Flask(__name__).test_request_context(method='POST', json={
+        'input': 'I want a token vault', 'channel_id': 'chat-channel', 'stream': True
+    }):
+        response = sse_main.chat_handler(request)
+        events = parse_frames(response.response)
+
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Access-Control-Allow-Origin'] == '*'
+    names = [name for _, name, _ in events]
+    assert 'chat-response' in names
+    assert names[-1] == 'response'
+    assert events[-1][2]['thread_id']
+    # Event ids increase along the stream
+    ids = [int(event_id) for event_id, _, _ in events if event_id]
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+
+
+def test_realtime_events_resumes_after_last_event_id(sse_main):
+    # Published by another instance, sharing only the database
+    publisher = SSETransport(sse_main.get_db())
+    publisher.trigger_batch([
+        {'channel': 'job-channel', 'name': 'code-chunk', 'data': {'content': str(n)}} for n in range(4)
+    ])
+    first_id = publisher.read('job-channel')[1][0]
+
+    app = Flask(__name__)
+    with app.test_request_context(method='GET', query_string={'channel_id': 'job-channel'},
+                                  headers={'Last-Event-ID': str(first_id)}):
+        response = sse_main.realtime_events(request)
+        frames = iter(response.response)
+        caught_up = parse_frames([next(frames), next(frames)])
+        publisher.trigger('job-channel', 'generation-complete', {'contract_id': 'c1'})
+        live = parse_frames([next(frames)])
+        frames.close()
+
+    assert [data for _, _, data in caught_up] == [{'content': '2'}, {'content': '3'}]
+    assert live == [(live[0][0], 'generation-complete', {'contract_id': 'c1'})]
+    assert int(live[0][0]) > int(caught_up[-1][0])
+
+
+def test_realtime_events_needs_the_sse_transport(main):
+    fakes.install(main, fakes.FakeOpenAI(fakes.default_recordings()), fakes.FakePusher())
+    with Flask(__name__).test_request_context(method='GET', query_string={'channel_id': 'c'}):
+        response = main.realtime_events(request)
+    assert response.status_code == 404
+
+
+def test_realtime_events_preflight_allows_last_event_id(main):
+    with Flask(__name__).test_request_context(method='OPTIONS'):
+        response = main.realtime_events(request)
+    assert response.headers['Access-Control-Allow-Headers'] == 'Content-Type, Last-Event-ID'
+    assert response.headers['Access-Control-Allow-Methods'] == 'GET'
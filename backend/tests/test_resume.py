@@ -0,0 +1,65 @@
+import datetime
+
+import fakes
+import pytest
+from checkpoints import GenerationCheckpoint
+from flask import Flask, request
+from jobs import new_job
+
+
+def test_resume_job_that_failed_while_designing(main):
+    # The first designer run writes nothing, the second the whole design
+    recordings = [fakes.synthetic_run('designer', '')] + fakes.default_recordings()
+    openai_client = fakes.FakeOpenAI(recordings)
+    pusher = fakes.FakePusher()
+    fakes.install(main, openai_client, pusher)
+
+    thread_id = main.run_async(openai_client.beta.threads.create()).id
+    manager = main.get_job_manager()
+    job_id = manager.submit(thread_id=thread_id, channel_id='first-channel', user_input='I want a token vault')
+    manager.queue.join()
+    assert manager.get(job_id)['state'] == 'failed'
+    assert GenerationCheckpoint(main.get_db(), job_id).load() is None
+
+    app = Flask(__name__)
+    with app.test_request_context(method='POST', json={'job_id': job_id, 'channel_id': 'second-channel'}):
+        response = main.resume_job(request)
+    assert response.status_code == 202
+    manager.queue.join()
+
+    job = manager.get(job_id)
+    assert job['state'] == 'done', job['error']
+    assert job['contract_id']
+    checkpoint = GenerationCheckpoint(main.get_db(), job_id).load()
+    assert checkpoint['status'] == 'completed'
+    assert checkpoint['channel_id'] == 'second-channel'
+    # The saved contract holds the files, the checkpoint doesn't keep a copy
+    assert GenerationCheckpoint(main.get_db(), job_id).load_files() == {}
+    assert pusher.events_for('second-channel', 'code-chunk')
+
+
+def test_resume_unknown_checkpoint_without_job(main):
+    fakes.install(main, fakes.FakeOpenAI(fakes.default_recordings()), fakes.FakePusher())
+    with pytest.raises(ValueError, match='No checkpoint found'):
+        main.resume_generation('missing-job')
+
+
+def resume(main, job_id):
+    with Flask(__name__).test_request_context(method='POST', json={'job_id': job_id}):
+        return main.resume_job(request)
+
+
+def test_resume_only_stalled_running_jobs(main):
+    fakes.install(main, fakes.FakeOpenAI(fakes.default_recordings()), fakes.FakePusher())
+    manager = main.get_job_manager()
+    running = new_job(state='building', thread_id='thread', channel_id='channel', user_input='vault')
+    stalled = new_job(state='building', thread_id='thread', channel_id='channel', user_input='vault',
+                      updated_at=datetime.datetime.now() - datetime.timedelta(seconds=main.JOB_STALE_AFTER + 60))
+    manager.store.create(running)
+    manager.store.create(stalled)
+
+    assert resume(main, running['job_id']).status_code == 409
+    # The recycled instance left it in 'building', it starts over from its record
+    assert resume(main, stalled['job_id']).status_code == 202
+    manager.queue.join()
+    assert manager.get(stalled['job_id'])['state'] == 'done'
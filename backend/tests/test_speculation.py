@@ -0,0 +1,99 @@
+import asyncio
+
+import fakes
+from design_parser import DesignStreamParser
+from speculation import SpeculativePlanner
+
+# The design up to the end of the first file's section
+PARTIAL_DESIGN = fakes.SAMPLE_DESIGN[:fakes.SAMPLE_DESIGN.index('Persistent balances')]
+
+
+class RecordingPublisher:
+    def __init__(self):
+        self.events = []
+
+    async def trigger(self, channel, event, data):
+        self.events.append((channel, event, data))
+
+
+async def stream_design(planner, design):
+    """
+    Feeds the design to the planner line by line, like DesignEventHandler, and
+    returns how many lines were in when the speculative build started.
+    """
+    parser = DesignStreamParser()
+    started_at = None
+    for count, line in enumerate(design.splitlines(keepends=True), 1):
+        if parser.feed(line):
+            await planner.on_design(parser)
+        if planner.task is not None and started_at is None:
+            started_at = count
+    return started_at
+
+
+def test_first_file_is_built_once_its_section_is_complete():
+    built = []
+
+    async def build(design, file_path):
+        built.append((design, file_path))
+
+    async def scenario():
+        planner = SpeculativePlanner(RecordingPublisher(), 'channel', build, lambda files, name: files)
+        started_at = await stream_design(planner, PARTIAL_DESIGN)
+        await planner.task
+        return planner, started_at
+
+    planner, started_at = asyncio.run(scenario())
+    # Built when the next heading closed the section of src/lib.rs
+    assert PARTIAL_DESIGN.splitlines()[started_at - 1] == '## src/storage.rs'
+    assert built == [(PARTIAL_DESIGN, 'src/lib.rs')]
+    assert planner.file_path == 'src/lib.rs'
+    structures = [data for _, event, data in planner.publisher.events if event == 'initial-structure']
+    assert structures[0]['update'] is False and structures[-1]['update'] is True
+    assert 'src/storage.rs' in structures[-1]['structure']
+
+
+def test_nothing_is_sent_or_built_below_min_confidence():
+    # Without the tree listing the files only come from headings
+    design = '# Token Vault Design\n\n' + PARTIAL_DESIGN[PARTIAL_DESIGN.index('## src/lib.rs'):]
+    built = []
+
+    async def build(design, file_path):
+        built.append(file_path)
+
+    async def scenario():
+        planner = SpeculativePlanner(RecordingPublisher(), 'channel', build, lambda files, name: files, min_confidence=0.7)
+        parser = DesignStreamParser()
+        parser.feed(design)
+        assert 0 < parser.confidence < 0.7 and parser.section_complete('src/lib.rs')
+        await planner.on_design(parser)
+        return planner
+
+    planner = asyncio.run(scenario())
+    assert (planner.task, planner.publisher.events, built) == (None, [], [])
+
+
+def test_discarded_speculative_build_cancels_its_run(main):
+    recordings = [fakes.synthetic_run('build_file', 'x' * 400, chunk_size=4, token_interval=0.01)]
+    openai_client = fakes.FakeOpenAI(recordings, speed=1)
+    fakes.install(main, openai_client, fakes.FakePusher())
+    from event_handler import AsyncEventHandler
+
+    async def build(design, file_path):
+        thread_id = (await openai_client.beta.threads.create()).id
+        await main.stream_run(
+            lambda: AsyncEventHandler(main.get_async_publisher(), thread_id, 'channel', 'code-chunk', stage='build_file'),
+            thread_id=thread_id,
+            assistant_id='asst_builder'
+        )
+
+    async def scenario():
+        planner = SpeculativePlanner(main.get_async_publisher(), 'channel', build, main.build_file_structure)
+        await stream_design(planner, PARTIAL_DESIGN)
+        assert planner.file_path == 'src/lib.rs'
+        await asyncio.sleep(0.1)
+        # The final plan has no such file
+        return await planner.reconcile('design', ['src/contract.rs'])
+
+    assert main.run_async(scenario()) == {}
+    assert openai_client.calls.get('runs.cancel') == 1
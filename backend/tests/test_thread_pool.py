@@ -0,0 +1,105 @@
+import asyncio
+from types import SimpleNamespace
+
+import thread_pool
+from thread_pool import ThreadPool
+
+
+class StubThreads:
+    def __init__(self):
+        self.created = 0
+        self.deleted = []
+
+    async def create(self):
+        self.created += 1
+        thread = SimpleNamespace(id=f'thread_{self.created}')
+        await asyncio.sleep(0)
+        return thread
+
+    async def delete(self, thread_id):
+        self.deleted.append(thread_id)
+
+
+def stub_client():
+    return SimpleNamespace(beta=SimpleNamespace(threads=StubThreads()))
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_acquire_counts_hits_and_misses_and_refills():
+    client = stub_client()
+    pool = ThreadPool(client, size=2)
+
+    async def scenario():
+        # Nothing is ready on the first acquire, which creates its own thread
+        first = await pool.acquire()
+        await settle()
+        assert pool.stats()['available'] == 2
+        second = await pool.acquire()
+        assert pool.stats()['pending'] == 1
+        await settle()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first != second
+    stats = pool.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 1, 0.5)
+    assert (stats['available'], stats['pending'], stats['created']) == (2, 0, 3)
+    assert client.beta.threads.created == 4
+
+
+def test_threads_older_than_max_age_are_deleted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(thread_pool.time, 'monotonic', lambda: now[0])
+    client = stub_client()
+    pool = ThreadPool(client, size=2, max_age=60)
+
+    async def scenario():
+        pool.fill()
+        await settle()
+        stale = [thread_id for thread_id, _ in pool._threads]
+        now[0] += 60
+        thread_id = await pool.acquire()
+        await settle()
+        return stale, thread_id
+
+    stale, thread_id = asyncio.run(scenario())
+    assert sorted(client.beta.threads.deleted) == sorted(stale)
+    assert thread_id not in stale
+    stats = pool.stats()
+    assert (stats['expired'], stats['hits'], stats['misses'], stats['available']) == (2, 0, 1, 2)
+
+
+def test_expired_threads_are_kept_when_delete_expired_is_off(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(thread_pool.time, 'monotonic', lambda: now[0])
+    client = stub_client()
+    pool = ThreadPool(client, size=1, max_age=60, delete_expired=False)
+
+    async def scenario():
+        pool.fill()
+        await settle()
+        now[0] += 61
+        await pool.acquire()
+        await settle()
+
+    asyncio.run(scenario())
+    assert client.beta.threads.deleted == []
+    assert pool.stats()['expired'] == 1
+
+
+def test_empty_pool_creates_a_thread_per_acquire():
+    client = stub_client()
+    pool = ThreadPool(client, size=0)
+
+    async def scenario():
+        thread_ids = [await pool.acquire() for _ in range(3)]
+        await settle()
+        return thread_ids
+
+    assert asyncio.run(scenario()) == ['thread_1', 'thread_2', 'thread_3']
+    stats = pool.stats()
+    assert (stats['hits'], stats['misses'], stats['created'], stats['available']) == (0, 3, 0, 0)
@@ -51,6 +51,9 @@ const FileTree = ({ structure, onSelectFile, filesState, initiallyExpanded = []
             {filesState[item.path]?.status === 'generating' && (
               <Loader className="h-3 w-3 ml-2 animate-spin" />
             )}
+            {filesState[item.path]?.status === 'incomplete' && (
+              <span className="ml-2 text-xs text-red-400">incomplete</span>
+            )}
           </div>
         )}
       </div>
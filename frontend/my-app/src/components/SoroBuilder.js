@@ -12,6 +12,8 @@ import { Send, User, Bot, File, Folder, ChevronRight, ChevronDown, Loader, Setti
 import { Prism as SyntaxHighlighter } from 'react-syntax-highlighter'
 import { atomDark } from 'react-syntax-highlighter/dist/esm/styles/prism'
 import Pusher from 'pusher-js'
+import { subscribeChannel } from '../realtime'
+import { createFileTracker } from '../framing'
 import FileTree from './FileTree'
 import JSZip from 'jszip'
 import { saveAs } from 'file-saver'
@@ -22,7 +24,8 @@ const filesReducer = (state, action) => {
     case 'INITIALIZE_FILES':
       const initialState = {};
       action.files.forEach(file => {
-        initialState[file.path] = {
+        // Updates of the structure keep the files that are already being generated
+        initialState[file.path] = (action.update && state[file.path]) || {
           content: '',
           status: 'pending',
           isSelected: false,
@@ -50,6 +53,8 @@ const filesReducer = (state, action) => {
         ...state,
         [action.filePath]: {
           ...state[action.filePath],
+          // A file generated again (e.g. after its design changed) starts over
+          ...(action.status === 'generating' ? { content: '' } : {}),
           status: action.status,
         },
       };
@@ -139,6 +144,7 @@ function SoroBuilder() {
   const [streamingMessage, setStreamingMessage] = useState('');
   const messagesEndRef = useRef(null)
   const [channelId, setChannelId] = useState(null);
+  const [contractId, setContractId] = useState(null); // Edited when the user asks to change it
   const [currentMessage, setCurrentMessage] = useState('');
   const [fileStructure, setFileStructure] = useState([]);
   const [generatingFile, setGeneratingFile] = useState(null);
@@ -146,6 +152,7 @@ function SoroBuilder() {
   const [generatingFiles, setGeneratingFiles] = useState({});
   const [fileContents, setFileContents] = useState({});
   const codeEndRef = useRef(null); // Add a ref for the code end
+  const fileTracker = useRef(createFileTracker()).current; // Detects lost code chunks
 
   // Now use the reducer after it's been defined
   const [filesState, dispatch] = useReducer(filesReducer, {});
@@ -155,29 +162,18 @@ function SoroBuilder() {
     const newChannelId = `user-${Date.now()}`;
     setChannelId(newChannelId);
 
-    // Initialize Pusher
-    const pusherInstance = new Pusher('--------------', {
-      cluster: 'eu'
+    // Subscribe to the channel through Pusher or the backend's event stream,
+    // with listeners for the different types of events
+    const unsubscribe = subscribeChannel(newChannelId, {
+      'chat-response': handleChatResponse,
+      'code-chunk': handleCodeChunk,
+      'file-generation-status': handleFileStatus,
+      'initial-structure': handleInitialStructure,
+      'contract-saved': (data) => setContractId(data.contract_id),
+      'error': handleError, // Add error handler
     });
 
-    setPusher(pusherInstance);
-
-    // Subscribe to the chat response channel
-    const channel = pusherInstance.subscribe(newChannelId);
-
-    // Set up event listeners for different types of events
-    channel.bind('chat-response', handleChatResponse);
-    channel.bind('code-chunk', handleCodeChunk);
-    channel.bind('file-generation-status', handleFileStatus);
-    channel.bind('initial-structure', handleInitialStructure);
-    channel.bind('error', handleError); // Add error handler
-
-    return () => {
-        if (pusherInstance) {
-            pusherInstance.unsubscribe(newChannelId);
-            pusherInstance.disconnect();
-        }
-    };
+    return unsubscribe;
   }, []);
 
   const handleChatResponse = (data) => {
@@ -227,7 +223,8 @@ function SoroBuilder() {
     // Initialize filesState with all files
     dispatch({
       type: 'INITIALIZE_FILES',
-      files: allFiles
+      files: allFiles,
+      update: data.update
     });
     
     // Automatically expand all folders
@@ -249,6 +246,10 @@ function SoroBuilder() {
     if (!data.filePath) return;
     
     console.log('Received code chunk for:', data.filePath); // Add logging
+    const missing = fileTracker.chunk(data);
+    if (missing.length > 0) {
+      console.warn(`Missing code chunks ${missing.join(', ')} of ${data.filePath}`);
+    }
     
     dispatch({
       type: 'UPDATE_CONTENT',
@@ -268,7 +269,16 @@ function SoroBuilder() {
     });
     
     if (status === 'generating') {
+      fileTracker.start(filePath);
       handleFileSelect(filePath);
+    } else if (status === 'complete') {
+      // The completion event only has the hash of the chunks, check we got them all
+      fileTracker.verify(data).then(ok => {
+        if (!ok) {
+          console.warn(`${filePath} is incomplete, some code chunks were lost`);
+          dispatch({ type: 'SET_STATUS', filePath, status: 'incomplete' });
+        }
+      });
     }
   };
 
@@ -315,7 +325,8 @@ function SoroBuilder() {
           body: JSON.stringify({ 
             input: input.trim(),
             thread_id: threadId,
-            channel_id: channelId
+            channel_id: channelId,
+            contract_id: contractId
           }),
         });
         const data = await response.json();
@@ -349,6 +360,7 @@ function SoroBuilder() {
     setGeneratedFiles([])
     setSelectedFile(null)
     setContractName(null)
+    setContractId(null)
     setIsLoading(false)
 
     // Unsubscribe from the current channel and disconnect Pusher
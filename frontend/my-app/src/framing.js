@@ -0,0 +1,66 @@
+// Client side of the backend's event framing (backend/functions/framing.py)
+
+// Returns a function taking the data of an event and returning it whole:
+// fragments of a split payload are kept until the last one arrives, then the
+// original data is returned. Returns null while fragments are missing.
+export function createFragmentDecoder() {
+  const pending = new Map()
+  return (data) => {
+    if (!data || !data.fragment) return data
+    const { id, index, count } = data.fragment
+    const parts = pending.get(id) || new Array(count)
+    parts[index] = data.part
+    pending.set(id, parts)
+    for (let i = 0; i < count; i++) {
+      if (parts[i] === undefined) return null
+    }
+    pending.delete(id)
+    return JSON.parse(parts.join(''))
+  }
+}
+
+async function sha256Hex(text) {
+  const digest = await window.crypto.subtle.digest('SHA-256', new TextEncoder().encode(text))
+  return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('')
+}
+
+// Follows the code-chunk sequence of every file being generated and checks the
+// chunks received against the completion event of the file
+export function createFileTracker() {
+  const files = new Map()
+  const fileOf = (filePath) => {
+    if (!files.has(filePath)) files.set(filePath, { nextSeq: 0, content: '', missing: [] })
+    return files.get(filePath)
+  }
+
+  return {
+    start(filePath) {
+      files.delete(filePath)
+      fileOf(filePath)
+    },
+
+    // Returns the sequence numbers skipped before this chunk
+    chunk(data) {
+      const file = fileOf(data.filePath)
+      const missing = []
+      if (data.seq !== undefined) {
+        for (let seq = file.nextSeq; seq < data.seq; seq++) missing.push(seq)
+        file.nextSeq = Math.max(file.nextSeq, data.seq + 1)
+      }
+      file.missing.push(...missing)
+      file.content += data.content
+      return missing
+    },
+
+    // Resolves to true when every chunk arrived and their content matches the hash
+    async verify(data) {
+      const file = fileOf(data.filePath)
+      files.delete(data.filePath)
+      if (file.missing.length > 0) return false
+      if (data.chunks !== undefined && file.nextSeq !== data.chunks) return false
+      // crypto.subtle only exists in secure contexts
+      if (!data.contentHash || !window.crypto?.subtle) return true
+      return (await sha256Hex(file.content)) === data.contentHash
+    },
+  }
+}
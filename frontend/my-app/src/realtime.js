@@ -0,0 +1,46 @@
+import Pusher from 'pusher-js'
+import { createFragmentDecoder } from './framing'
+
+// 'pusher', or 'sse' to read the events from the backend's realtime_events
+// endpoint. Must match REALTIME_TRANSPORT on the backend.
+const TRANSPORT = process.env.REACT_APP_REALTIME_TRANSPORT || 'pusher'
+const EVENTS_URL = process.env.REACT_APP_EVENTS_URL || 'your-events-url'
+
+// Calls the handler with whole payloads, once every fragment has arrived
+function reassembling(handler) {
+  const decode = createFragmentDecoder()
+  return (data) => {
+    const whole = decode(data)
+    if (whole !== null) handler(whole)
+  }
+}
+
+// Binds the handlers, keyed by event name, to a channel and returns a function
+// closing the subscription
+export function subscribeChannel(channelId, handlers) {
+  handlers = Object.fromEntries(
+    Object.entries(handlers).map(([eventName, handler]) => [eventName, reassembling(handler)])
+  )
+  if (TRANSPORT === 'sse') {
+    // EventSource reconnects by itself, sending Last-Event-ID to catch up
+    const source = new EventSource(`${EVENTS_URL}?channel_id=${encodeURIComponent(channelId)}`)
+    Object.entries(handlers).forEach(([eventName, handler]) => {
+      source.addEventListener(eventName, (event) => {
+        // Connection errors are also 'error' events, without data
+        if (event.data === undefined) return
+        handler(JSON.parse(event.data))
+      })
+    })
+    return () => source.close()
+  }
+
+  const pusher = new Pusher('--------------', {
+    cluster: 'eu'
+  })
+  const channel = pusher.subscribe(channelId)
+  Object.entries(handlers).forEach(([eventName, handler]) => channel.bind(eventName, handler))
+  return () => {
+    pusher.unsubscribe(channelId)
+    pusher.disconnect()
+  }
+}